@@ -1,17 +1,44 @@
 """Archival of notebooks"""
 
+import asyncio
+import hashlib
+import heapq
+import itertools
 import json
-from asyncio import Lock
+import os
+from asyncio import Condition, Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Union
+from weakref import WeakValueDictionary
 
-import aiobotocore
 import nbformat
+from botocore.exceptions import ClientError
 from notebook.services.contents.filemanager import FileContentsManager
 from tornado import ioloop
 
+from .blobs import blob_key, blob_prefix, extract_blobs
 from .bookstore_config import BookstoreSettings
+from .compression import compress
+from .deltas import BASE, DELTA, compute_delta, latest_key, list_versions, read_latest, version_key
+from .metrics import SIZE_BUCKETS
+from .retry import CircuitOpenError
+from .s3_client import S3ClientManager
 from .s3_paths import s3_key, s3_display_path
+from .s3_upload import FileBody, upload_object
+from .spool import ArchiveSpool
+
+# Archive priorities, most urgent first: explicit saves, autosaves and background work such as
+# replaying the spool or retrying failed writes
+EXPLICIT_SAVE = 0
+AUTOSAVE = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {EXPLICIT_SAVE: "explicit", AUTOSAVE: "autosave", BACKGROUND: "background"}
 
 
 class ArchiveRecord(NamedTuple):
@@ -26,13 +53,58 @@ class ArchiveRecord(NamedTuple):
     An archive record (`filepath`, `content`, `queued_time`) contains:
 
     - a `filepath` to the record
-    - the `content` for archival
+    - the `content` for archival, either serialized or a notebook dict that
+      the archiver serializes off the event loop
     - the `queued time` length of time waiting in the queue for archiving
+    - optionally the `spool_entry` holding the record in the local spool
+    - optionally the `os_path` of the saved file, when archiving after save,
+      or of its serialized copy in the spool;
+      `content` is then None and the file is read when the record is written
+    - the `priority` of the record, one of `EXPLICIT_SAVE`, `AUTOSAVE`
+      (the default) and `BACKGROUND`, most urgent first
     """
 
     filepath: str
-    content: str
+    content: Union[str, dict, None]
     queued_time: float  # TODO: refactor to a datetime time
+    spool_entry: Optional[str] = None
+    os_path: Optional[str] = None
+    priority: int = AUTOSAVE
+
+
+def _coalesce(older: ArchiveRecord, newer: ArchiveRecord):
+    """The newer of two records of a path, with the more urgent of their priorities."""
+    return newer._replace(priority=min(older.priority, newer.priority))
+
+
+class PreparedRecord(NamedTuple):
+    """An archive record's content, ready to be written to storage.
+
+    Contains the object `body` (bytes, or a file streamed from disk), its
+    `content_encoding` when compressed, the
+    `digest` of the uncompressed body, for manifests the `blobs` the body
+    references keyed by digest and, for delta archiving, the parsed `notebook`.
+    """
+
+    body: Union[bytes, FileBody]
+    content_encoding: Optional[str]
+    digest: str
+    blobs: Dict[str, bytes]
+    notebook: Optional[dict] = None
+
+
+class DeltaState(NamedTuple):
+    """The last version of a notebook archived as a base or delta.
+
+    Holds the version's `sequence` number, the number of deltas since the
+    last base (`chain_length`), the archived `notebook` the next delta is
+    computed against and the sequence numbers of the `bases` kept.
+    """
+
+    sequence: int
+    chain_length: int
+    notebook: dict
+    bases: Tuple[int, ...]
 
 
 class BookstoreContentsArchiver(FileContentsManager):
@@ -47,21 +119,93 @@ class BookstoreContentsArchiver(FileContentsManager):
     -------
 
     - Bookstore settings combine with the parent Jupyter application settings.
-    - A session is created for the current event loop.
+    - A shared S3 client manager is used for the current event loop.
     - To write to a particular path on S3, acquire a lock.
-    - After acquiring the lock, `archive` method authenticates using the storage
-      service's credentials.
-    - If allowed, the notebook is queued to be written to storage (i.e. S3).
+    - After acquiring the lock, `archive` method writes using the shared,
+      long-lived S3 client.
+    - While a path is locked, newer records for it replace a single pending
+      slot; once the in-flight write finishes only the newest is written.
+    - At most ``max_threads`` writes run at once across all paths; at most
+      ``archive_queue_size`` more wait for one of those write slots.
+    - Waiting writes get slots by priority: explicit saves (checkpoints)
+      before autosaves before replayed and retried records. Within a
+      priority, smaller notebooks go first with ``archive_prioritize_small``,
+      then writes are served in arrival order, so paths take turns.
 
     Attributes
     ----------
 
-    path_locks : dict
-        Dictionary of paths to storage and the lock associated with a path.
-    path_lock_ready: asyncio mutex lock
-        A mutex lock associated with a path.
+    client_manager : bookstore.s3_client.S3ClientManager
+        Owner of the pooled S3 client; replaced by the process-wide manager
+        when the bookstore server extension loads.
+    path_locks : weakref.WeakValueDictionary
+        Mapping of paths to storage and the lock associated with a path. Entries
+        are only held by the writers using them, so idle paths drop out on their own.
+    pending_records : dict
+        Dictionary of paths to the newest record waiting on an in-flight write.
+    overflow_records : dict
+        Dictionary of paths to the newest record waiting for room in a full
+        write queue, under the ``wait`` queue policy.
+    queued_writes : int
+        Number of writes waiting for a write slot.
+    queued_by_priority : dict
+        Dictionary of priorities to the number of writes of that priority
+        waiting for a write slot.
+    free_write_slots : int
+        Number of write slots not taken by a write.
+    archive_tasks : dict
+        Dictionary of outstanding archive tasks to the record each was started for.
+    scheduled_retries : dict
+        Dictionary of spool entries to the timeout handle and record of
+        spooled records waiting to be retried.
+    debounced_records : dict
+        Dictionary of paths to the timeout handle and latest record of saves
+        held back by ``archive_min_interval``.
+    last_archive_times : collections.OrderedDict
+        Loop time at which each recently saved path was last sent to be
+        archived, least recent first.
+    archived_digests : collections.OrderedDict
+        The SHA-256 digest of the last archived content of recently archived
+        paths, least recently archived first.
+    archived_sizes : collections.OrderedDict
+        The size in bytes of the last archived content of recently archived
+        paths, used to rank writes by size when ``archive_prioritize_small``
+        is set.
+    skipped_uploads : int
+        Count of writes skipped because the content was unchanged.
+    archived_blobs : collections.OrderedDict
+        Digests of blobs recently known to be in storage when archiving
+        manifests, least recently referenced first.
+    delta_states : collections.OrderedDict
+        The last archived version of recently archived paths when archiving
+        deltas, least recently archived first.
+    executor : concurrent.futures.ThreadPoolExecutor
+        Pool, sized by ``max_threads``, for serializing and hashing notebooks.
+    spool : bookstore.spool.ArchiveSpool or None
+        Local write-ahead spool of records, when ``archive_spool_dir`` is set.
+    metrics : bookstore.metrics.BookstoreMetrics
+        Recorder of archive latencies, sizes and queue depths, an instance of
+        ``metrics_class``; replaced by the process-wide metrics when the
+        bookstore server extension loads.
+    in_flight : int
+        Number of records currently being serialized or written.
     """
 
+    # number of paths whose last archived version is kept for computing deltas
+    max_delta_states = 128
+
+    # number of paths whose last archived digest and size are kept
+    max_archived_paths = 4096
+
+    # number of blob digests remembered as being in storage
+    max_archived_blobs = 16384
+
+    # seconds after an archive before digests are persisted, batching archives in between
+    digest_save_delay = 5.0
+
+    # bytes read at a time when hashing saved files
+    file_chunk_size = 1024 * 1024
+
     def __init__(self, *args, **kwargs):
         super(FileContentsManager, self).__init__(*args, **kwargs)
 
@@ -75,15 +219,316 @@ class BookstoreContentsArchiver(FileContentsManager):
         )
 
         try:
-            # create a session object from the current event loop
-            self.session = aiobotocore.get_session()
+            # the client itself is created lazily, on the first archive
+            self.client_manager = S3ClientManager(self.settings)
         except Exception:
             self.log.warn("Unable to create a session")
             raise
 
         # a collection of locks per path to suppress writing while the path may be in use
-        self.path_locks: Dict[str, Lock] = {}
-        self.path_lock_ready = Lock()
+        self.path_locks: WeakValueDictionary = WeakValueDictionary()
+
+        # the latest record per path that arrived while that path was being written
+        self.pending_records: Dict[str, ArchiveRecord] = {}
+        self.overflow_records: Dict[str, ArchiveRecord] = {}
+
+        # outstanding work, so it can be flushed when the server shuts down
+        self.archive_tasks: Dict[asyncio.Future, ArchiveRecord] = {}
+        self.scheduled_retries: Dict[str, Tuple[object, ArchiveRecord]] = {}
+
+        # saves held back so each path is archived at most once per archive_min_interval
+        self.debounced_records: Dict[str, Tuple[object, ArchiveRecord]] = {}
+        self.last_archive_times: OrderedDict = OrderedDict()
+
+        # bound concurrent writes by max_threads, handing free slots to waiting writes by priority
+        self.free_write_slots = self.settings.max_threads
+        self.queued_writes = 0
+        self.queued_by_priority: Dict[int, int] = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._slot_waiters: list = []
+        self._slot_waiter_entries: Dict[str, list] = {}
+        self._slot_sequence = itertools.count()
+        # created on first use within the event loop
+        self._queue_space: Optional[Condition] = None
+
+        # digests of the last archived content per path, to skip re-uploading unchanged notebooks
+        self.archived_digests: OrderedDict = self._load_digests()
+        self.archived_sizes: OrderedDict = OrderedDict()
+        self._digests_dirty = False
+        self._digest_save_handle = None
+        # created on first use within the event loop
+        self._digest_save_lock: Optional[Lock] = None
+        self.skipped_uploads = 0
+        self.archived_blobs: OrderedDict = OrderedDict()
+        self.delta_states: OrderedDict = OrderedDict()
+
+        # keep serialization and hashing of large notebooks off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=self.settings.max_threads)
+
+        self.metrics = self.settings.metrics_class()
+        self.in_flight = 0
+
+        self.spool = None
+        if self.settings.archive_spool_dir:
+            self.spool = ArchiveSpool(
+                self.settings.archive_spool_dir,
+                self.settings.archive_spool_max_bytes,
+                fsync=self.settings.archive_spool_fsync,
+            )
+            self._replay_spool()
+
+    def _replay_spool(self):
+        """Schedule archival of records left in the spool by a previous run."""
+        entries = self.spool.entries()
+        if entries:
+            self.log.info("Replaying %d spooled archive records", len(entries))
+
+        loop = ioloop.IOLoop.current()
+        for entry in entries:
+            try:
+                spooled = self.spool.read(entry)
+            except (OSError, ValueError) as e:
+                self.log.error("Unable to read spooled archive record %s: %s", entry, e)
+                continue
+            record = ArchiveRecord(
+                filepath=spooled["filepath"],
+                content=None,
+                # loop times are not comparable across processes, so queueing restarts now
+                queued_time=loop.time(),
+                spool_entry=entry,
+                os_path=self.spool.body_path(entry),
+                priority=BACKGROUND,
+            )
+            self._schedule_archive(record)
+
+    def _schedule_archive(self, record: ArchiveRecord):
+        """Archive a record in a task tracked until it completes."""
+        task = asyncio.ensure_future(self.archive(record))
+        self.archive_tasks[task] = record
+        task.add_done_callback(self._archive_done)
+        return task
+
+    def _submit(self, record: ArchiveRecord):
+        """Archive a saved notebook, at most once per ``archive_min_interval`` per path.
+
+        A save arriving within the interval of the last archive of its path is
+        held back, replacing any save already held; the latest is archived
+        when the interval ends.
+        """
+        interval = self.settings.archive_min_interval
+        if interval <= 0:
+            self._schedule_archive(record)
+            return
+
+        path = record.filepath
+        if path in self.debounced_records:
+            handle, held = self.debounced_records[path]
+            self.debounced_records[path] = (handle, _coalesce(held, record))
+            self.metrics.inc("bookstore_archive_skipped_total", reason="debounced")
+            return
+
+        loop = ioloop.IOLoop.current()
+        now = loop.time()
+        # forget paths whose interval has passed; the oldest are kept first
+        while self.last_archive_times:
+            oldest = next(iter(self.last_archive_times))
+            if now - self.last_archive_times[oldest] < interval:
+                break
+            del self.last_archive_times[oldest]
+
+        last = self.last_archive_times.get(path)
+        if last is None:
+            self._release(path, record)
+            return
+
+        handle = loop.call_at(last + interval, self._release_debounced, path)
+        self.debounced_records[path] = (handle, record)
+
+    def _release(self, path, record: ArchiveRecord):
+        """Archive a save now, starting a new interval for its path."""
+        self.last_archive_times[path] = ioloop.IOLoop.current().time()
+        self.last_archive_times.move_to_end(path)
+        self._schedule_archive(record)
+
+    def _release_debounced(self, path):
+        """Archive the save held back for a path, if any."""
+        debounced = self.debounced_records.pop(path, None)
+        if debounced is not None:
+            handle, record = debounced
+            ioloop.IOLoop.current().remove_timeout(handle)
+            self._release(path, record)
+
+    def create_checkpoint(self, path):
+        """Create a checkpoint, archiving the latest save of the path as an explicit save.
+
+        Frontends create a checkpoint when the user explicitly saves, so
+        explicit saves are never delayed by ``archive_min_interval`` and are
+        written ahead of autosaves.
+        """
+        checkpoint = super().create_checkpoint(path)
+        path = path.strip('/')
+        self._prioritize(path, EXPLICIT_SAVE)
+        self._release_debounced(path)
+        return checkpoint
+
+    def _prioritize(self, path, priority):
+        """Raise the priority of the records of a path held back or waiting to be written."""
+        for records in (self.pending_records, self.overflow_records):
+            if path in records and records[path].priority > priority:
+                records[path] = records[path]._replace(priority=priority)
+        if path in self.debounced_records:
+            handle, record = self.debounced_records[path]
+            self.debounced_records[path] = (
+                handle,
+                record._replace(priority=min(record.priority, priority)),
+            )
+
+        entry = self._slot_waiter_entries.get(path)
+        if entry is not None and entry[0] > priority:
+            # heap entries cannot be reordered in place, so queue the waiter again
+            _, size_rank, _, _, waiter = entry
+            self._dequeue_waiter(entry)
+            self._queue_waiter(path, priority, size_rank, waiter)
+
+    def _archive_done(self, task):
+        self.archive_tasks.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.log.error("Error while archiving file", exc_info=task.exception())
+
+    async def flush(self, timeout):
+        """Wait for outstanding archives to complete, up to a deadline.
+
+        Saves held back by ``archive_min_interval`` are archived, and spooled
+        records waiting to be retried are retried, immediately. Archive
+        tasks still running at the deadline are cancelled.
+
+        Parameters
+        ----------
+
+        timeout : float
+            Seconds to wait for archives to complete
+
+        Returns
+        -------
+
+        list
+            Paths whose latest save could not be archived in time
+        """
+        loop = ioloop.IOLoop.current()
+        for path in list(self.debounced_records):
+            self._release_debounced(path)
+        for handle, record in list(self.scheduled_retries.values()):
+            loop.remove_timeout(handle)
+            self._schedule_archive(record)
+        self.scheduled_retries.clear()
+
+        deadline = loop.time() + timeout
+        while self.archive_tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.wait(list(self.archive_tasks), timeout=remaining)
+
+        unflushed = {record.filepath for record in self.archive_tasks.values()}
+        unflushed.update(self.pending_records, self.overflow_records)
+        unflushed.update(record.filepath for _, record in self.scheduled_retries.values())
+        cancelled = list(self.archive_tasks)
+        for task in cancelled:
+            task.cancel()
+        if cancelled:
+            # let cancelled tasks unwind before the event loop stops
+            await asyncio.wait(cancelled)
+
+        if self._digest_save_handle is not None:
+            loop.remove_timeout(self._digest_save_handle)
+            self._digest_save_handle = None
+        await self._save_digests()
+
+        if unflushed:
+            self.log.warning(
+                "Unable to archive %d notebooks before shutdown: %s%s",
+                len(unflushed),
+                ", ".join(sorted(unflushed)),
+                "; spooled records will be archived on restart" if self.spool is not None else "",
+            )
+        return sorted(unflushed)
+
+    def _load_digests(self):
+        """Load persisted archive digests, if a digest file is configured and present.
+
+        Digests are saved least recently archived first, so only the most
+        recently archived ``max_archived_paths`` are kept. A digest file saved
+        for another bucket, workspace prefix or archive format is discarded,
+        as its paths were not archived where this archiver writes them.
+        """
+        digests = OrderedDict()
+        digest_file = self.settings.archive_digest_file
+        if not digest_file or not os.path.isfile(digest_file):
+            return digests
+        try:
+            with open(digest_file, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log.warning("Unable to load archive digests from %s: %s", digest_file, e)
+            return digests
+        if not isinstance(saved, dict) or saved.get("archive") != self._digests_archive():
+            self.log.info("Discarding archive digests saved for another archive: %s", digest_file)
+            return digests
+        digests.update(saved.get("digests", {}))
+        while len(digests) > self.max_archived_paths:
+            digests.popitem(last=False)
+        return digests
+
+    def _digests_archive(self):
+        """Where digests are archived: the bucket, workspace prefix and archive format."""
+        return {
+            "bucket": self.settings.s3_bucket,
+            "workspace_prefix": self.settings.workspace_prefix,
+            "archive_format": self.settings.archive_format,
+        }
+
+    def _remember_archived(self, path, digest, size):
+        """Record the digest and size of a path's archived content, persisting digests later."""
+        for archived, value in ((self.archived_digests, digest), (self.archived_sizes, size)):
+            archived[path] = value
+            archived.move_to_end(path)
+            while len(archived) > self.max_archived_paths:
+                archived.popitem(last=False)
+
+        self._digests_dirty = True
+        if self.settings.archive_digest_file and self._digest_save_handle is None:
+            self._digest_save_handle = ioloop.IOLoop.current().call_later(
+                self.digest_save_delay, self._save_digests_later
+            )
+
+    def _save_digests_later(self):
+        self._digest_save_handle = None
+        asyncio.ensure_future(self._save_digests())
+
+    async def _save_digests(self):
+        """Persist archive digests if they changed, writing the digest file on the executor."""
+        if self._digest_save_lock is None:
+            self._digest_save_lock = Lock()
+        # one save at a time, so writes of the digest file never interleave
+        async with self._digest_save_lock:
+            if not self._digests_dirty or not self.settings.archive_digest_file:
+                return
+            self._digests_dirty = False
+            await ioloop.IOLoop.current().run_in_executor(
+                self.executor,
+                self._write_digests,
+                self.settings.archive_digest_file,
+                dict(self.archived_digests),
+            )
+
+    def _write_digests(self, digest_file, digests):
+        """Write archive digests, replacing the digest file atomically."""
+        tmp_file = digest_file + '.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"archive": self._digests_archive(), "digests": digests}, f)
+            os.replace(tmp_file, digest_file)
+        except OSError as e:
+            self.log.warning("Unable to save archive digests to %s: %s", digest_file, e)
 
     async def archive(self, record: ArchiveRecord):
         """Process a record to write to storage.
@@ -92,50 +537,571 @@ class BookstoreContentsArchiver(FileContentsManager):
         allowed to a path if a valid `path_lock` is held and the path is not
         locked by another process.
 
+        If the path is already locked, the record replaces any pending record
+        for that path instead of being written. The lock holder writes the
+        newest pending record once its own write completes, so at most one
+        write per path is in flight and one is queued, and the final save is
+        always archived.
+
+        Writes across all paths share ``max_threads`` write slots, handed out
+        by record priority. A newer record replacing a pending one keeps the
+        more urgent of their priorities. When
+        ``archive_queue_size`` writes are already waiting for a slot, a record
+        for an idle path is dropped under the ``drop`` queue policy, or waits
+        for room under the ``wait`` policy, coalescing with newer records for
+        its path while it waits.
+
+        With a spool configured, the record is first written to the local
+        spool; it is removed from the spool once it (or a newer record for its
+        path) is in storage, and retried later if the write fails.
+
         Parameters
         ----------
 
         record : ArchiveRecord
             A notebook and where it should be written to storage
         """
-        async with self.path_lock_ready:
-            lock = self.path_locks.get(record.filepath)
+        if self.spool is not None and record.spool_entry is None:
+            record = await self._spool_record(record)
 
-            if lock is None:
-                lock = Lock()
-                self.path_locks[record.filepath] = lock
+        if record.filepath in self.overflow_records:
+            # an older record for the path is waiting for room, it will write this one instead
+            self.metrics.inc("bookstore_archive_skipped_total", reason="coalesced")
+            self.overflow_records[record.filepath] = _coalesce(
+                self.overflow_records[record.filepath], record
+            )
+            return
+
+        lock = self.path_locks.get(record.filepath)
+        if (lock is None or not lock.locked()) and self._queue_full():
+            if self.settings.archive_queue_full_policy == "drop":
+                self._drop(record)
+                return
+            record = await self._wait_for_queue_space(record)
+            if record is None:
+                return
 
-        # Skip writes when a given path is already locked
+        # No await between lookup and insertion, so no coroutine can race us to the table
+        lock = self.path_locks.get(record.filepath)
+        if lock is None:
+            lock = Lock()
+            self.path_locks[record.filepath] = lock
+
+        # Coalesce writes when a given path is already locked; only the latest record is kept
         if lock.locked():
-            self.log.info("Skipping archive of %s", record.filepath)
+            self.log.info("Queueing latest archive of %s", record.filepath)
+            pending = self.pending_records.get(record.filepath)
+            if pending is not None:
+                self.metrics.inc("bookstore_archive_skipped_total", reason="coalesced")
+                record = _coalesce(pending, record)
+            self.pending_records[record.filepath] = record
+            self._report_pending()
             return
 
         async with lock:
+            while record is not None:
+                if record.spool_entry is None:
+                    await self._write(record)
+                elif self.spool.contains(record.spool_entry):
+                    if await self._write(record):
+                        self.spool.remove_through(record.filepath, record.spool_entry)
+                    else:
+                        self._schedule_retry(record)
+                else:
+                    # a newer record for the path was archived and this one is superseded
+                    self.metrics.inc("bookstore_archive_skipped_total", reason="superseded")
+                record = self.pending_records.pop(record.filepath, None)
+                self._report_pending()
+
+    def _report_pending(self):
+        """Report the number of records waiting on an in-flight write of their path."""
+        self.metrics.set("bookstore_archive_pending_records", len(self.pending_records))
+
+    def _queue_full(self):
+        """Whether every write slot is taken and ``archive_queue_size`` writes are waiting."""
+        return self.free_write_slots == 0 and self.queued_writes >= self.settings.archive_queue_size
+
+    def _drop(self, record: ArchiveRecord):
+        """Drop a record arriving at a full write queue.
+
+        A spooled record stays in the spool and is retried later.
+        """
+        self.metrics.inc("bookstore_archive_dropped_total")
+        if record.spool_entry is not None:
+            self.log.warning("Archive queue is full, deferring archive of %s", record.filepath)
+            self._schedule_retry(record)
+        else:
+            self.log.warning("Archive queue is full, dropping archive of %s", record.filepath)
+
+    async def _wait_for_queue_space(self, record: ArchiveRecord):
+        """Wait for room in a full write queue.
+
+        Newer records for the path replace this one while it waits.
+
+        Returns
+        -------
+
+        ArchiveRecord
+            The newest record for the path once there is room
+        """
+        self.log.info("Archive queue is full, waiting to archive %s", record.filepath)
+        self.overflow_records[record.filepath] = record
+        self._init_write_slots()
+        async with self._queue_space:
+            await self._queue_space.wait_for(lambda: not self._queue_full())
+        return self.overflow_records.pop(record.filepath, None)
+
+    def _init_write_slots(self):
+        """Create the queue condition within the running event loop."""
+        if self._queue_space is None:
+            self._queue_space = Condition()
+
+    async def _acquire_write_slot(self, record: ArchiveRecord):
+        """Wait for one of the ``max_threads`` write slots, counting this write as queued.
+
+        Waiting writes are handed slots in order of priority, then size rank,
+        then arrival.
+        """
+        self._init_write_slots()
+        if self.free_write_slots > 0:
+            self.free_write_slots -= 1
+            return
+
+        path = record.filepath
+        waiter = asyncio.get_event_loop().create_future()
+        self._queue_waiter(path, record.priority, self._size_rank(record), waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            entry = self._slot_waiter_entries.get(path)
+            if entry is not None and entry[-1] is waiter:
+                self._dequeue_waiter(entry)
+            if not waiter.cancelled():
+                # the slot was handed to this write as it was cancelled, pass it on
+                self._hand_off_write_slot()
+            raise
+        finally:
+            await self._notify_queue_space()
+
+    def _queue_waiter(self, path, priority, size_rank, waiter):
+        entry = [priority, size_rank, next(self._slot_sequence), path, waiter]
+        heapq.heappush(self._slot_waiters, entry)
+        self._slot_waiter_entries[path] = entry
+        self.queued_writes += 1
+        self.queued_by_priority[priority] += 1
+        self._report_queued()
+
+    def _dequeue_waiter(self, entry):
+        """Remove a waiting write from the queue; its heap entry is discarded when popped."""
+        if entry[-1] is None:
+            return
+        entry[-1] = None
+        priority, _, _, path, _ = entry
+        if self._slot_waiter_entries.get(path) is entry:
+            del self._slot_waiter_entries[path]
+        self.queued_writes -= 1
+        self.queued_by_priority[priority] -= 1
+        self._report_queued()
+
+    def _hand_off_write_slot(self):
+        """Give a free write slot to the most urgent waiting write, if any."""
+        while self._slot_waiters:
+            entry = heapq.heappop(self._slot_waiters)
+            waiter = entry[-1]
+            if waiter is None:
+                continue
+            self._dequeue_waiter(entry)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.free_write_slots += 1
+
+    def _size_rank(self, record: ArchiveRecord):
+        """Rank of a record by the order of magnitude of its size, when prioritizing small ones.
+
+        The size is estimated without serializing the record: the saved
+        file's size, the length of serialized content, or else the size of
+        the last archive of the path.
+        """
+        if not self.settings.archive_prioritize_small:
+            return 0
+        if record.os_path is not None:
             try:
-                async with self.session.create_client(
-                    's3',
-                    aws_secret_access_key=self.settings.s3_secret_access_key,
-                    aws_access_key_id=self.settings.s3_access_key_id,
-                    endpoint_url=self.settings.s3_endpoint_url,
-                    region_name=self.settings.s3_region_name,
-                ) as client:
-                    self.log.info("Processing storage write of %s", record.filepath)
-                    file_key = s3_key(self.settings.workspace_prefix, record.filepath)
-                    await client.put_object(
-                        Bucket=self.settings.s3_bucket, Key=file_key, Body=record.content
-                    )
-                    self.log.info("Done with storage write of %s", record.filepath)
-            except Exception as e:
-                self.log.error(
-                    'Error while archiving file: %s %s', record.filepath, e, exc_info=True
+                size = os.stat(record.os_path).st_size
+            except OSError:
+                size = 0
+        elif isinstance(record.content, str):
+            size = len(record.content)
+        else:
+            size = self.archived_sizes.get(record.filepath, 0)
+        return size.bit_length()
+
+    def _report_queued(self):
+        for priority, name in PRIORITY_NAMES.items():
+            self.metrics.set(
+                "bookstore_archive_queued_writes",
+                self.queued_by_priority[priority],
+                priority=name,
+            )
+
+    async def _release_write_slot(self):
+        """Release a write slot, letting records waiting for room in the queue proceed."""
+        self._hand_off_write_slot()
+        await self._notify_queue_space()
+
+    async def _notify_queue_space(self):
+        async with self._queue_space:
+            self._queue_space.notify_all()
+
+    async def _spool_record(self, record: ArchiveRecord):
+        """Write a record to the spool, returning it along with its spool entry.
+
+        The spooled record is read from the spool's copy of its serialized
+        notebook, so it is serialized only once and later changes to a saved
+        file do not affect it. The record is returned unchanged if it could
+        not be spooled.
+        """
+        try:
+            entry = await ioloop.IOLoop.current().run_in_executor(
+                self.executor, self._spool, record
+            )
+        except Exception as e:
+            self.log.error('Error while spooling file: %s %s', record.filepath, e, exc_info=True)
+            return record
+        if entry is None:
+            self.log.warning(
+                "Archive spool is full, archiving %s without spooling", record.filepath
+            )
+            return record
+        return record._replace(content=None, os_path=self.spool.body_path(entry), spool_entry=entry)
+
+    def _spool(self, record: ArchiveRecord):
+        """Serialize a record into the spool, or copy its saved file there, on the executor."""
+        if record.content is None:
+            return self.spool.write(record.filepath, record.queued_time, source_path=record.os_path)
+        content = record.content
+        if not isinstance(content, str):
+            content = nbformat.writes(nbformat.from_dict(content))
+        return self.spool.write(record.filepath, record.queued_time, body=content.encode('utf-8'))
+
+    def _schedule_retry(self, record: ArchiveRecord):
+        """Retry a spooled record after ``archive_spool_retry_interval`` seconds."""
+        loop = ioloop.IOLoop.current()
+        self.log.info(
+            "Retrying archive of %s in %s seconds",
+            record.filepath,
+            self.settings.archive_spool_retry_interval,
+        )
+        handle = loop.call_later(self.settings.archive_spool_retry_interval, self._retry, record)
+        self.scheduled_retries[record.spool_entry] = (handle, record)
+
+    def _retry(self, record: ArchiveRecord):
+        if self.scheduled_retries.pop(record.spool_entry, None) is not None:
+            self._schedule_archive(record._replace(priority=BACKGROUND))
+
+    async def _write(self, record: ArchiveRecord):
+        """Write a single record to storage, logging rather than raising errors.
+
+        Parameters
+        ----------
+
+        record : ArchiveRecord
+            A notebook and where it should be written to storage
+
+        Returns
+        -------
+
+        bool
+            False if writing to storage failed and may be retried
+        """
+        await self._acquire_write_slot(record)
+        loop = ioloop.IOLoop.current()
+        self.metrics.observe("bookstore_archive_queue_seconds", loop.time() - record.queued_time)
+        self.in_flight += 1
+        self.metrics.set("bookstore_archive_in_flight", self.in_flight)
+        try:
+            return await self._write_prepared(record)
+        finally:
+            self.in_flight -= 1
+            self.metrics.set("bookstore_archive_in_flight", self.in_flight)
+            await self._release_write_slot()
+
+    async def _write_prepared(self, record: ArchiveRecord):
+        """Serialize a record and write it to storage, recording how long each stage takes."""
+        loop = ioloop.IOLoop.current()
+        start = loop.time()
+        try:
+            prepared = await loop.run_in_executor(self.executor, self._prepare, record)
+        except Exception as e:
+            # retrying cannot help content that does not serialize
+            self.log.error('Error while serializing file: %s %s', record.filepath, e, exc_info=True)
+            self.metrics.inc("bookstore_archive_failed_total", stage="serialize")
+            return True
+        self.metrics.observe("bookstore_archive_serialize_seconds", loop.time() - start)
+
+        try:
+            return await self._store(record, prepared)
+        finally:
+            if isinstance(prepared.body, FileBody):
+                prepared.body.close()
+
+    async def _store(self, record: ArchiveRecord, prepared: PreparedRecord):
+        """Write a prepared record to storage unless it is unchanged."""
+        loop = ioloop.IOLoop.current()
+        if (
+            self.settings.archive_skip_unchanged
+            and self.archived_digests.get(record.filepath) == prepared.digest
+        ):
+            self.skipped_uploads += 1
+            self.metrics.inc("bookstore_archive_skipped_total", reason="unchanged")
+            self.log.debug("Skipping unchanged archive of %s", record.filepath)
+            return True
+
+        start = loop.time()
+        try:
+            client = await self.client_manager.get_client()
+            self.log.info("Processing storage write of %s", record.filepath)
+            if self.settings.archive_format == "delta":
+                await self._write_version(client, record.filepath, prepared)
+            else:
+                # blobs go first so an archived manifest never references a missing blob
+                await self._write_blobs(client, prepared.blobs)
+                file_key = s3_key(self.settings.workspace_prefix, record.filepath)
+                await self._upload(client, file_key, prepared.body, prepared.content_encoding)
+            self.log.info("Done with storage write of %s", record.filepath)
+        except CircuitOpenError as e:
+            self.log.warning('Not archiving file while S3 is failing: %s %s', record.filepath, e)
+            self.metrics.inc("bookstore_archive_failed_total", stage="upload")
+            return False
+        except Exception as e:
+            self.log.error('Error while archiving file: %s %s', record.filepath, e, exc_info=True)
+            self.metrics.inc("bookstore_archive_failed_total", stage="upload")
+            return False
+        self.metrics.observe("bookstore_archive_upload_seconds", loop.time() - start)
+        self.metrics.inc("bookstore_archive_writes_total")
+
+        self._remember_archived(record.filepath, prepared.digest, len(prepared.body))
+        return True
+
+    async def _upload(self, client, key, body, content_encoding=None):
+        """Upload one object to the archive bucket, retrying transient failures."""
+        s3_kwargs = {"Bucket": self.settings.s3_bucket, "Key": key, "Body": body}
+        if content_encoding is not None:
+            s3_kwargs["ContentEncoding"] = content_encoding
+        await upload_object(client, self.settings, retry=self.client_manager.retry, **s3_kwargs)
+        self.metrics.observe("bookstore_archive_upload_bytes", len(body), buckets=SIZE_BUCKETS)
+
+    async def _write_version(self, client, path, prepared):
+        """Write the next version of a notebook as a base or a delta.
+
+        A base is written for the first version archived by this process and
+        whenever the chain of deltas reaches ``delta_max_chain``; otherwise a
+        delta against the previously archived version is written. The latest
+        pointer is then updated and, past ``delta_keep_bases`` bases, the
+        oldest base and its deltas are deleted.
+
+        Parameters
+        ----------
+
+        client : aiobotocore.client.AioBaseClient
+            S3 client used for the writes
+        path : str
+            The notebook's path
+        prepared : PreparedRecord
+            The prepared notebook, including its parsed content
+        """
+        prefix = self.settings.workspace_prefix
+        bucket = self.settings.s3_bucket
+        state = self.delta_states.get(path)
+        if state is None:
+            # continue the sequence of versions archived by earlier processes
+            latest = await self.client_manager.retry.call(read_latest, client, bucket, prefix, path)
+            if latest is not None:
+                sequence, bases = latest["sequence"] + 1, tuple(latest["bases"])
+            else:
+                # versions archived before latest pointers were written, if any
+                versions = await self.client_manager.retry.call(
+                    list_versions, client, bucket, prefix, path
+                )
+                sequence = versions[-1][0] + 1 if versions else 0
+                bases = tuple(number for number, kind, _ in versions if kind == BASE)
+        else:
+            sequence, bases = state.sequence + 1, state.bases
+
+        if state is None or state.chain_length >= self.settings.delta_max_chain:
+            kind, chain_length = BASE, 0
+            body, content_encoding = prepared.body, prepared.content_encoding
+            bases += (sequence,)
+        else:
+            kind, chain_length = DELTA, state.chain_length + 1
+            body, content_encoding = await ioloop.IOLoop.current().run_in_executor(
+                self.executor, self._prepare_delta, state.notebook, prepared.notebook
+            )
+
+        key = version_key(prefix, path, sequence, kind)
+        await self._upload(client, key, body, content_encoding)
+
+        keep = self.settings.delta_keep_bases
+        pruned, bases = bases[:-keep], bases[-keep:]
+        latest = json.dumps({"sequence": sequence, "bases": list(bases)}).encode('utf-8')
+        await self._upload(client, latest_key(prefix, path), latest)
+
+        self.delta_states[path] = DeltaState(sequence, chain_length, prepared.notebook, bases)
+        self.delta_states.move_to_end(path)
+        while len(self.delta_states) > self.max_delta_states:
+            self.delta_states.popitem(last=False)
+
+        if pruned:
+            await self._prune_versions(client, path, pruned, bases[0])
+
+    async def _prune_versions(self, client, path, pruned, kept):
+        """Delete the versions of a notebook from its oldest pruned base up to the oldest kept.
+
+        Failing to delete them is only logged: the latest pointer no longer
+        references them.
+        """
+        prefix = self.settings.workspace_prefix
+        keys = [
+            version_key(prefix, path, sequence, BASE if sequence in pruned else DELTA)
+            for sequence in range(pruned[0], kept)
+        ]
+        try:
+            # delete_objects takes up to 1000 keys
+            for start in range(0, len(keys), 1000):
+                objects = [{"Key": key} for key in keys[start : start + 1000]]
+                response = await self.client_manager.retry.call(
+                    client.delete_objects,
+                    Bucket=self.settings.s3_bucket,
+                    Delete={"Objects": objects, "Quiet": True},
                 )
+                for error in response.get("Errors", []):
+                    self.log.warning("Unable to delete version %s: %s", error.get("Key"), error)
+        except Exception as e:
+            self.log.warning("Unable to delete old versions of %s: %s", path, e)
+
+    def _prepare_delta(self, previous, current):
+        """Compute and compress the delta between two notebooks on the executor."""
+        delta = json.dumps(compute_delta(previous, current)).encode('utf-8')
+        return compress(delta, self.settings.compression)
+
+    async def _write_blobs(self, client, blobs):
+        """Write the blobs referenced by a manifest that are not yet in storage.
+
+        Blobs are content addressed, so one already present is never rewritten.
+        Whether a blob is present is unknown when its HEAD is forbidden, as
+        with credentials only allowed to put objects, so it is written.
+
+        Parameters
+        ----------
+
+        client : aiobotocore.client.AioBaseClient
+            S3 client used for the writes
+        blobs : dict
+            Dictionary of blob digests to blob bodies
+        """
+        prefix = blob_prefix(self.settings.workspace_prefix)
+
+        async def write_blob(digest, body):
+            key = blob_key(prefix, digest)
+            try:
+                await self.client_manager.retry.call(
+                    client.head_object, Bucket=self.settings.s3_bucket, Key=key
+                )
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code not in ('404', 'NoSuchKey', 'NotFound', '403', 'AccessDenied', 'Forbidden'):
+                    raise
+                await self._upload(client, key, body)
+            self._remember_blob(digest)
+
+        unseen = {}
+        for digest, body in blobs.items():
+            if digest in self.archived_blobs:
+                self.archived_blobs.move_to_end(digest)
+            else:
+                unseen[digest] = body
+        await asyncio.gather(*(write_blob(digest, body) for digest, body in unseen.items()))
+
+    def _remember_blob(self, digest):
+        """Record a blob as being in storage, forgetting the least recently referenced."""
+        self.archived_blobs[digest] = None
+        self.archived_blobs.move_to_end(digest)
+        while len(self.archived_blobs) > self.max_archived_blobs:
+            self.archived_blobs.popitem(last=False)
+
+    def _prepare(self, record: ArchiveRecord):
+        """Prepare a record's content, or the saved file it refers to, on the executor.
+
+        A saved file that needs no transformation (whole notebooks archived
+        uncompressed) is hashed in chunks and uploaded straight from disk.
+        """
+        if record.os_path is None:
+            return self._prepare_record(record.content)
+
+        if self.settings.archive_format != "notebook" or self.settings.compression != "none":
+            with open(record.os_path, 'rb') as f:
+                return self._prepare_record(f.read().decode('utf-8'))
+
+        body = FileBody(open(record.os_path, 'rb'))
+        try:
+            sha = hashlib.sha256()
+            for offset in range(0, len(body), self.file_chunk_size):
+                sha.update(body.read(offset, self.file_chunk_size))
+        except BaseException:
+            body.close()
+            raise
+        return PreparedRecord(body, None, sha.hexdigest(), {})
+
+    def _prepare_record(self, content):
+        """Serialize, hash and compress a record's content.
+
+        Runs on the archiver's executor rather than the event loop. When
+        archiving manifests, large outputs and attachments are extracted into
+        blobs first. When archiving deltas, the parsed notebook is kept so the
+        next delta can be computed against it.
+
+        Parameters
+        ----------
+
+        content : str or dict
+            Serialized notebook, or a notebook dict to be serialized
+
+        Returns
+        -------
+
+        PreparedRecord
+            The content ready to be written to storage
+        """
+        blobs: Dict[str, bytes] = {}
+        notebook = None
+        if self.settings.archive_format in ("manifest", "delta"):
+            if isinstance(content, str):
+                notebook = nbformat.reads(content, as_version=nbformat.NO_CONVERT)
+            else:
+                # from_dict copies the structure, leaving the saved model untouched
+                notebook = nbformat.from_dict(content)
+            if self.settings.archive_format == "manifest":
+                notebook, blobs = extract_blobs(
+                    notebook,
+                    self.settings.blob_threshold,
+                    blob_prefix(self.settings.workspace_prefix),
+                )
+            content = nbformat.writes(notebook)
+        elif not isinstance(content, str):
+            content = nbformat.writes(nbformat.from_dict(content))
+
+        data = content.encode('utf-8')
+        body, content_encoding = compress(data, self.settings.compression)
+        digest = hashlib.sha256(data).hexdigest()
+        return PreparedRecord(body, content_encoding, digest, blobs, notebook)
 
     def run_pre_save_hook(self, model, path, **kwargs):
         """Send request to store notebook to S3.
 
         This hook offloads the storage request to the event loop.
         When the event loop is available for execution of the request, the
-        storage of the notebook will be done and the write to storage occurs.
+        notebook is serialized on the archiver's executor and the write to
+        storage occurs. Used when ``archive_trigger`` is ``pre_save``.
 
         Parameters
         ----------
@@ -145,6 +1111,9 @@ class BookstoreContentsArchiver(FileContentsManager):
         path : str
             The storage location
         """
+        if self.settings.archive_trigger != "pre_save":
+            return
+
         if model["type"] != "notebook":
             self.log.debug(
                 "Bookstore only archives notebooks, "
@@ -152,14 +1121,49 @@ class BookstoreContentsArchiver(FileContentsManager):
             )
             return
 
-        content = nbformat.writes(nbformat.from_dict(model["content"]))
-
-        loop = ioloop.IOLoop.current()
+        # The contents API builds a fresh model per request and saving does not mutate it,
+        # so holding a reference is a safe snapshot; serialization happens in `archive`
+        content = model["content"]
 
         # Offload archival and schedule write to storage with the current event loop
-        loop.spawn_callback(
-            self.archive,
+        self._submit(
             ArchiveRecord(
                 content=content, filepath=path, queued_time=ioloop.IOLoop.current().time()
-            ),
+            )
+        )
+
+    def run_post_save_hook(self, model, os_path):
+        """Send request to store a saved notebook to S3, reading it from disk.
+
+        Used when ``archive_trigger`` is ``post_save``: only successful saves
+        are archived, and the file just written is uploaded as is rather than
+        serialized a second time.
+
+        Parameters
+        ----------
+
+        model : dict
+            The saved file's model, without content
+        os_path : str
+            The saved file's location on disk
+        """
+        super().run_post_save_hook(model=model, os_path=os_path)
+
+        if self.settings.archive_trigger != "post_save":
+            return
+
+        if model["type"] != "notebook":
+            self.log.debug(
+                "Bookstore only archives notebooks, "
+                f"request does not state that {model['path']} is a notebook."
+            )
+            return
+
+        self._submit(
+            ArchiveRecord(
+                content=None,
+                filepath=model["path"],
+                queued_time=ioloop.IOLoop.current().time(),
+                os_path=os_path,
+            )
         )
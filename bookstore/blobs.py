@@ -0,0 +1,143 @@
+"""Content-addressed storage of large notebook outputs and attachments.
+
+A notebook archived as a *manifest* has every large output payload and cell
+attachment replaced by a reference to a blob stored once under its SHA-256
+digest. Unchanged images are then not re-uploaded on every save.
+"""
+import hashlib
+from typing import Dict
+from typing import Tuple
+
+from .s3_paths import s3_key
+
+# Output and attachment values replaced by a blob start with this marker
+BLOB_REFERENCE_PREFIX = "bookstore-blob:sha256:"
+
+# Notebook metadata key describing where a manifest's blobs are stored
+MANIFEST_METADATA_KEY = "bookstore_manifest"
+
+
+def blob_prefix(prefix):
+    """Compute the key prefix under which blobs for a workspace are stored.
+
+    Parameters
+    ----------
+    prefix : str
+      prefix for workspace
+    """
+    return s3_key(prefix, ".bookstore/blobs")
+
+
+def blob_key(prefix, digest):
+    """Compute the key of a blob given the blob prefix and its digest.
+
+    Parameters
+    ----------
+    prefix : str
+      The blob prefix, see :func:`blob_prefix`
+    digest : str
+      SHA-256 hex digest of the blob
+    """
+    return s3_key(prefix, digest)
+
+
+def _mime_bundles(notebook):
+    """Yield every output mime bundle and attachment bundle in a notebook."""
+    for cell in notebook.get("cells", []):
+        for output in cell.get("outputs", []):
+            if "data" in output:
+                yield output["data"]
+        for bundle in cell.get("attachments", {}).values():
+            yield bundle
+
+
+def extract_blobs(notebook, threshold, prefix) -> Tuple[dict, Dict[str, bytes]]:
+    """Replace large output and attachment payloads with blob references.
+
+    The notebook is modified in place, so pass a copy (such as the result of
+    ``nbformat.from_dict``) when the original must be kept.
+
+    Parameters
+    ----------
+    notebook : dict
+      Notebook to turn into a manifest
+    threshold : int
+      Payloads of at least this many characters are extracted
+    prefix : str
+      The blob prefix recorded in the manifest, see :func:`blob_prefix`
+
+    Returns
+    --------
+    tuple
+      The manifest and a dictionary of blob digests to blob bodies
+    """
+    blobs: Dict[str, bytes] = {}
+    for bundle in _mime_bundles(notebook):
+        for mime, value in bundle.items():
+            if isinstance(value, list):
+                value = "".join(value)
+            if not isinstance(value, str) or len(value) < threshold:
+                continue
+            body = value.encode("utf-8")
+            digest = hashlib.sha256(body).hexdigest()
+            blobs[digest] = body
+            bundle[mime] = BLOB_REFERENCE_PREFIX + digest
+
+    if blobs:
+        notebook.setdefault("metadata", {})[MANIFEST_METADATA_KEY] = {"blob_prefix": prefix}
+    return notebook, blobs
+
+
+def is_manifest(notebook):
+    """Whether a notebook is a manifest referencing blobs."""
+    metadata = notebook.get("metadata")
+    if not isinstance(metadata, dict):
+        return False
+    entry = metadata.get(MANIFEST_METADATA_KEY)
+    return isinstance(entry, dict) and "blob_prefix" in entry
+
+
+def manifest_blob_prefix(manifest):
+    """The prefix under which a manifest's blobs are stored."""
+    return manifest["metadata"][MANIFEST_METADATA_KEY]["blob_prefix"]
+
+
+def blob_references(manifest):
+    """Collect the digests of every blob referenced by a manifest.
+
+    Returns
+    --------
+    set
+      SHA-256 hex digests
+    """
+    references = set()
+    for bundle in _mime_bundles(manifest):
+        for value in bundle.values():
+            if isinstance(value, str) and value.startswith(BLOB_REFERENCE_PREFIX):
+                references.add(value[len(BLOB_REFERENCE_PREFIX) :])
+    return references
+
+
+def reassemble(manifest, blobs):
+    """Replace blob references in a manifest with the blobs' content.
+
+    The manifest is modified in place and returned as a regular notebook.
+
+    Parameters
+    ----------
+    manifest : dict
+      Manifest produced by :func:`extract_blobs`
+    blobs : dict
+      Dictionary of blob digests to blob bodies
+
+    Returns
+    --------
+    dict
+      The full notebook
+    """
+    for bundle in _mime_bundles(manifest):
+        for mime, value in bundle.items():
+            if isinstance(value, str) and value.startswith(BLOB_REFERENCE_PREFIX):
+                bundle[mime] = blobs[value[len(BLOB_REFERENCE_PREFIX) :]].decode("utf-8")
+    manifest.get("metadata", {}).pop(MANIFEST_METADATA_KEY, None)
+    return manifest
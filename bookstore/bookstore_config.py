@@ -2,9 +2,11 @@
 import logging
 from pathlib import Path
 
-from traitlets import Integer, Unicode, Bool
+from traitlets import Integer, Unicode, Bool, Enum, Float, TraitError, Type, validate
 from traitlets.config import LoggingConfigurable
 
+from .compression import COMPRESSION_MODES, zstd_available
+
 log = logging.getLogger('bookstore_config')
 
 
@@ -37,11 +39,116 @@ class BookstoreSettings(LoggingConfigurable):
     s3_bucket : str(``""``)
                 Bucket name, environment variable ``JPYNB_S3_BUCKET``
     max_threads : int(``16``)
-                  Maximum threads from the threadpool available for S3 read/writes
+                  Maximum threads from the threadpool available for S3 read/writes,
+                  and maximum number of concurrent archive writes
     enable_s3_cloning : bool(``True``)
                         Enable cloning from s3.
     fs_cloning_basedir : str(``"/Users/jupyter"``)
                         Absolute path to base directory used to clone from the local file system
+    archive_skip_unchanged : bool(``True``)
+                        Skip archiving content identical to the last archived version of a path
+    archive_digest_file : str(``""``)
+                        Local file in which archived content digests are persisted across restarts
+    compression : str(``"none"``)
+                  Compression for archived and published notebooks: ``none``, ``gzip`` or ``zstd``
+    multipart_threshold : int(``67108864``)
+                  Object size in bytes at and above which multipart uploads are used
+    multipart_part_size : int(``16777216``)
+                  Size in bytes of each part of a multipart upload (at least 5 MiB)
+    multipart_concurrency : int(``4``)
+                  Maximum number of parts of one multipart upload uploaded concurrently
+    archive_trigger : str(``"pre_save"``)
+                  ``pre_save`` archives the model being saved, ``post_save`` archives the file
+                  just written to disk, only once it has been saved successfully
+    archive_min_interval : float(``0.0``)
+                  Minimum seconds between archives of the same path; later saves are held
+                  back and the latest archived when the interval ends, explicit saves
+                  (checkpoints) archive immediately
+    archive_format : str(``"notebook"``)
+                  ``notebook`` archives whole notebooks, ``manifest`` stores large outputs
+                  and attachments once as content-addressed blobs referenced from the notebook,
+                  ``delta`` stores cell-level deltas between periodic full base versions
+                  instead of writing to the notebook's workspace key, which stops updating;
+                  clones of workspace keys rebuild the latest version from the deltas
+    blob_threshold : int(``65536``)
+                  Size in characters at and above which outputs and attachments become blobs
+    delta_max_chain : int(``20``)
+                  Maximum number of deltas archived after a base before a new base is written
+    delta_keep_bases : int(``3``)
+                  Number of base versions kept per notebook, each with the deltas following it;
+                  older versions are deleted when a new base is written
+    archive_spool_dir : str(``""``)
+                  Local directory where archive records are spooled before being written to S3
+    archive_spool_max_bytes : int(``1073741824``)
+                  Maximum size of the archive spool, records are written directly once it is full
+    archive_spool_fsync : bool(``True``)
+                  Flush spooled records to disk before archiving them
+    archive_spool_retry_interval : float(``30.0``)
+                  Seconds to wait before retrying a spooled record whose write to S3 failed
+    archive_queue_size : int(``1024``)
+                  Maximum number of archive writes waiting for one of the ``max_threads`` slots
+    archive_queue_full_policy : str(``"wait"``)
+                  What happens to a save arriving at a full archive queue: ``wait`` holds the
+                  newest record per path until there is room, ``drop`` discards it
+    archive_prioritize_small : bool(``False``)
+                  Write smaller notebooks ahead of larger ones of the same priority when
+                  archive writes are waiting for a write slot
+    archive_shutdown_timeout : float(``10.0``)
+                  Seconds outstanding archives and checkpoint uploads are given to complete
+                  when the server shuts down
+    checkpoint_cache_max_bytes : int(``268435456``)
+                  Maximum size of the checkpoints cached locally by
+                  ``bookstore.checkpoints.BookstoreCheckpoints``
+    checkpoint_fetch_timeout : float(``2.0``)
+                  Seconds the checkpoints API waits for a checkpoint missing from the cache
+                  to be read from S3
+    s3_retry_max_attempts : int(``4``)
+                  Maximum attempts of an S3 operation failing with throttling, 5xx or
+                  connection errors
+    s3_retry_base_delay : float(``0.1``)
+                  Upper bound in seconds of the jittered delay before the first retry,
+                  doubling with every further retry
+    s3_retry_max_delay : float(``5.0``)
+                  Upper bound in seconds of the jittered delay before any retry
+    s3_breaker_failure_rate : float(``0.5``)
+                  Share of recent S3 operations failing transiently at which S3 calls
+                  start failing fast
+    s3_breaker_min_calls : int(``20``)
+                  Number of recent S3 operations required before calls may fail fast
+    s3_breaker_window : int(``50``)
+                  Number of recent S3 operations the failure rate is computed over
+    s3_breaker_reset_timeout : float(``30.0``)
+                  Seconds S3 calls fail fast before a trial call is let through
+    s3_adaptive_concurrency : bool(``False``)
+                  Adapt the number of concurrent S3 operations to S3's latency and throttling,
+                  between ``s3_concurrency_min`` and ``max_threads``; S3 operations are not
+                  limited when disabled
+    s3_concurrency_initial : int(``4``)
+                  Number of concurrent S3 operations allowed at startup
+    s3_concurrency_min : int(``1``)
+                  Lowest number of concurrent S3 operations throttling can reduce the limit to
+    s3_latency_target : float(``1.0``)
+                  S3 operations slower than this many seconds do not raise the concurrency limit
+    metrics_class : type(``bookstore.metrics.BookstoreMetrics``)
+                  Class recording bookstore's metrics, subclass it to forward them elsewhere
+    enable_metrics : bool(``False``)
+                  Serve metrics in Prometheus text format at ``/api/bookstore/metrics``
+    enable_stream_publish : bool(``False``)
+                  Accept notebooks streamed in the request body at
+                  ``/api/bookstore/publish-stream``
+    stream_publish_max_bytes : int(``1073741824``)
+                  Maximum size in bytes of a notebook streamed to ``/api/bookstore/publish-stream``
+    publish_skip_unchanged : bool(``False``)
+                  Skip uploading published notebooks identical to the ones already
+                  published, as if every publish request had ``If-None-Match: *``
+    publish_batch_concurrency : int(``8``)
+                  Maximum number of notebooks of a ``/api/bookstore/publish-batch`` request
+                  validated and uploaded concurrently
+    publish_batch_max_items : int(``1000``)
+                  Maximum number of notebooks in a ``/api/bookstore/publish-batch`` request
+    validation_offload_bytes : int(``1048576``)
+                  Size in bytes at and above which published and cloned notebooks are
+                  validated on a worker thread instead of the server's event loop
                   
     """
 
@@ -76,6 +183,259 @@ class BookstoreSettings(LoggingConfigurable):
         "", help=("Absolute path to base directory used to clone from the local file system")
     ).tag(config=True)
 
+    archive_skip_unchanged = Bool(
+        True, help="Skip archiving content identical to the last archived version of a path"
+    ).tag(config=True)
+    archive_digest_file = Unicode(
+        "",
+        help=(
+            "Local file in which archived content digests are persisted across restarts, "
+            "written a few seconds after archiving and at shutdown. Digests saved for another "
+            "bucket, workspace prefix or archive format are discarded on load. "
+            "Digests are only kept in memory when empty."
+        ),
+    ).tag(config=True)
+
+    compression = Enum(
+        COMPRESSION_MODES,
+        default_value="none",
+        help=(
+            "Compression applied to archived and published notebooks. "
+            "zstd requires the zstandard package."
+        ),
+    ).tag(config=True)
+
+    multipart_threshold = Integer(
+        64 * 1024 * 1024, help="Object size in bytes at and above which multipart uploads are used"
+    ).tag(config=True)
+    multipart_part_size = Integer(
+        16 * 1024 * 1024,
+        min=5 * 1024 * 1024,
+        help="Size in bytes of each part of a multipart upload, S3 requires at least 5 MiB",
+    ).tag(config=True)
+    multipart_concurrency = Integer(
+        4, min=1, help="Maximum number of parts of one multipart upload uploaded concurrently"
+    ).tag(config=True)
+
+    archive_trigger = Enum(
+        ["pre_save", "post_save"],
+        default_value="pre_save",
+        help=(
+            "When notebooks are archived: 'pre_save' archives the model about to be saved, "
+            "'post_save' archives the file just written to disk, so only successful saves are "
+            "archived and whole uncompressed notebooks are uploaded without re-serializing them"
+        ),
+    ).tag(config=True)
+
+    archive_min_interval = Float(
+        0.0,
+        min=0.0,
+        help=(
+            "Minimum seconds between archives of the same path. Saves within the interval are "
+            "held back, only the latest being archived when it ends; creating a checkpoint, as "
+            "frontends do on explicit saves, archives immediately. Held saves are not spooled."
+        ),
+    ).tag(config=True)
+
+    archive_format = Enum(
+        ["notebook", "manifest", "delta"],
+        default_value="notebook",
+        help=(
+            "How notebooks are archived: 'notebook' writes whole notebooks, 'manifest' stores "
+            "large outputs and attachments once as content-addressed blobs referenced from "
+            "the archived notebook, 'delta' writes cell-level deltas against the previously "
+            "archived version and periodically a full base version. With 'delta', notebooks "
+            "are no longer written to their workspace key, which stops updating; clones of "
+            "workspace keys rebuild the latest version from the deltas instead"
+        ),
+    ).tag(config=True)
+    blob_threshold = Integer(
+        64 * 1024,
+        help="Size in characters at and above which outputs and attachments are stored as blobs",
+    ).tag(config=True)
+
+    delta_max_chain = Integer(
+        20,
+        min=0,
+        help="Maximum number of deltas archived after a base before a new base is written",
+    ).tag(config=True)
+    delta_keep_bases = Integer(
+        3,
+        min=1,
+        help=(
+            "Number of base versions kept per notebook, each with the deltas following it. "
+            "Older versions are deleted when a new base is written."
+        ),
+    ).tag(config=True)
+
+    archive_spool_dir = Unicode(
+        "",
+        help=(
+            "Local directory where archive records are spooled before being written to S3, "
+            "and replayed from on startup. Spooling is disabled when empty."
+        ),
+    ).tag(config=True)
+    archive_spool_max_bytes = Integer(
+        1024 * 1024 * 1024,
+        help="Maximum size of the archive spool, records are written directly once it is full",
+    ).tag(config=True)
+    archive_spool_fsync = Bool(
+        True, help="Flush spooled records to disk before archiving them"
+    ).tag(config=True)
+    archive_spool_retry_interval = Float(
+        30.0, help="Seconds to wait before retrying a spooled record whose write to S3 failed"
+    ).tag(config=True)
+
+    archive_queue_size = Integer(
+        1024,
+        min=0,
+        help="Maximum number of archive writes waiting for one of the max_threads write slots",
+    ).tag(config=True)
+    archive_queue_full_policy = Enum(
+        ["wait", "drop"],
+        default_value="wait",
+        help=(
+            "What happens to a save arriving when the archive queue is full: 'wait' holds the "
+            "newest record per path until there is room, 'drop' discards it (spooled records "
+            "are retried later)"
+        ),
+    ).tag(config=True)
+    archive_prioritize_small = Bool(
+        False,
+        help=(
+            "Write smaller notebooks ahead of larger ones of the same priority when archive "
+            "writes are waiting for a write slot. Explicit saves always go before autosaves."
+        ),
+    ).tag(config=True)
+    archive_shutdown_timeout = Float(
+        10.0,
+        help=(
+            "Seconds outstanding archives and checkpoint uploads are given to complete when "
+            "the server shuts down"
+        ),
+    ).tag(config=True)
+
+    checkpoint_cache_max_bytes = Integer(
+        256 * 1024 * 1024,
+        min=0,
+        help=(
+            "Maximum size of the checkpoints cached locally by "
+            "bookstore.checkpoints.BookstoreCheckpoints, least recently used first out"
+        ),
+    ).tag(config=True)
+    checkpoint_fetch_timeout = Float(
+        2.0,
+        min=0,
+        help=(
+            "Seconds the checkpoints API waits for a checkpoint missing from the cache to be "
+            "read from S3. Listing and restoring checkpoints holds up the server meanwhile; a "
+            "checkpoint read later is listed once it arrives."
+        ),
+    ).tag(config=True)
+
+    s3_retry_max_attempts = Integer(
+        4,
+        min=1,
+        help="Maximum attempts of an S3 operation failing with throttling, 5xx or connection errors",
+    ).tag(config=True)
+    s3_retry_base_delay = Float(
+        0.1,
+        help=(
+            "Upper bound in seconds of the jittered delay before the first retry "
+            "of an S3 operation, doubling with every further retry"
+        ),
+    ).tag(config=True)
+    s3_retry_max_delay = Float(
+        5.0, help="Upper bound in seconds of the jittered delay before any retry"
+    ).tag(config=True)
+    s3_breaker_failure_rate = Float(
+        0.5,
+        help="Share of recent S3 operations failing transiently at which S3 calls start failing fast",
+    ).tag(config=True)
+    s3_breaker_min_calls = Integer(
+        20, min=1, help="Number of recent S3 operations required before calls may fail fast"
+    ).tag(config=True)
+    s3_breaker_window = Integer(
+        50, min=1, help="Number of recent S3 operations the failure rate is computed over"
+    ).tag(config=True)
+    s3_breaker_reset_timeout = Float(
+        30.0, help="Seconds S3 calls fail fast before a trial call is let through"
+    ).tag(config=True)
+
+    s3_adaptive_concurrency = Bool(
+        False,
+        help=(
+            "Adapt the number of concurrent S3 operations, between s3_concurrency_min and "
+            "max_threads, raising it while S3 is healthy and halving it on throttling or "
+            "timeouts. S3 operations are not limited when disabled"
+        ),
+    ).tag(config=True)
+    s3_concurrency_initial = Integer(
+        4, min=1, help="Number of concurrent S3 operations allowed at startup"
+    ).tag(config=True)
+    s3_concurrency_min = Integer(
+        1,
+        min=1,
+        help="Lowest number of concurrent S3 operations throttling can reduce the limit to",
+    ).tag(config=True)
+    s3_latency_target = Float(
+        1.0, help="S3 operations slower than this many seconds do not raise the concurrency limit"
+    ).tag(config=True)
+
+    metrics_class = Type(
+        default_value="bookstore.metrics.BookstoreMetrics",
+        klass="bookstore.metrics.BookstoreMetrics",
+        help="Class recording bookstore's counters, gauges and histograms",
+    ).tag(config=True)
+    enable_metrics = Bool(
+        False, help="Serve metrics in Prometheus text format at /api/bookstore/metrics"
+    ).tag(config=True)
+
+    enable_stream_publish = Bool(
+        False,
+        help=(
+            "Accept notebooks streamed in the request body at /api/bookstore/publish-stream, "
+            "spooled to a temporary file and uploaded from disk"
+        ),
+    ).tag(config=True)
+    stream_publish_max_bytes = Integer(
+        1024 * 1024 * 1024,
+        min=0,
+        help="Maximum size in bytes of a notebook streamed to /api/bookstore/publish-stream",
+    ).tag(config=True)
+    publish_skip_unchanged = Bool(
+        False,
+        help=(
+            "Skip uploading published notebooks identical to the ones already published, "
+            "as if every publish request had If-None-Match: *"
+        ),
+    ).tag(config=True)
+    publish_batch_concurrency = Integer(
+        8,
+        min=1,
+        help=(
+            "Maximum number of notebooks of a /api/bookstore/publish-batch request validated "
+            "and uploaded concurrently"
+        ),
+    ).tag(config=True)
+    publish_batch_max_items = Integer(
+        1000, min=1, help="Maximum number of notebooks in a /api/bookstore/publish-batch request"
+    ).tag(config=True)
+    validation_offload_bytes = Integer(
+        1024 * 1024,
+        min=0,
+        help=(
+            "Size in bytes at and above which published and cloned notebooks are validated "
+            "on a worker thread instead of the server's event loop"
+        ),
+    ).tag(config=True)
+
+    @validate("compression")
+    def _validate_compression(self, proposal):
+        if proposal["value"] == "zstd" and not zstd_available():
+            raise TraitError("zstd compression requires the zstandard package")
+        return proposal["value"]
+
 
 def validate_bookstore(settings: BookstoreSettings):
     """Check that settings exist.
@@ -95,6 +455,8 @@ def validate_bookstore(settings: BookstoreSettings):
     published_settings = [*general_settings, settings.published_prefix != ""]
     s3_cloning_settings = [settings.enable_s3_cloning]
     fs_cloning_settings = [Path(settings.fs_cloning_basedir).is_absolute()]
+    metrics_settings = [settings.enable_metrics]
+    stream_publish_settings = [*published_settings, settings.enable_stream_publish]
 
     validation_checks = {
         "bookstore_valid": all(general_settings),
@@ -102,6 +464,8 @@ def validate_bookstore(settings: BookstoreSettings):
         "publish_valid": all(published_settings),
         "s3_clone_valid": all(s3_cloning_settings),
         "fs_clone_valid": all(fs_cloning_settings),
+        "metrics_valid": all(metrics_settings),
+        "stream_publish_valid": all(stream_publish_settings),
     }
     if not validation_checks["fs_clone_valid"] and settings.fs_cloning_basedir != "":
         log.info(
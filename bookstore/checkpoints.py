@@ -0,0 +1,467 @@
+"""Notebook checkpoints stored in S3, with a local read cache.
+
+Jupyter keeps one checkpoint per file, which frontends create when the user
+explicitly saves and restore on "Revert to checkpoint". :class:`BookstoreCheckpoints`
+stores that checkpoint under the workspace prefix, so it can be restored from
+any server sharing the bucket::
+
+    c.FileContentsManager.checkpoints_class = "bookstore.checkpoints.BookstoreCheckpoints"
+
+Checkpoints are cached locally, least recently used first out, and written
+to S3 in the background. The Checkpoints API is synchronous and called on the
+server's event loop, so a checkpoint missing from the cache is read from S3 on
+a reader thread of its own, waited on for at most ``checkpoint_fetch_timeout``
+seconds. The result, including the absence of a checkpoint, is cached.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+
+from botocore.exceptions import ClientError
+from notebook.services.contents.checkpoints import Checkpoints
+from tornado.web import HTTPError
+
+from .bookstore_config import BookstoreSettings
+from .compression import compress, decompress
+from .metrics import SIZE_BUCKETS
+from .s3_client import S3ClientManager
+from .s3_paths import delimiter, s3_key
+from .s3_upload import upload_object
+
+# Jupyter frontends expect a single checkpoint per file
+CHECKPOINT_ID = "checkpoint"
+# Looked up checkpoints not cached yet
+NOT_CACHED = object()
+
+
+def checkpoint_key(prefix, path, checkpoint_id=CHECKPOINT_ID):
+    """Compute the key under which a file's checkpoint is stored.
+
+    Parameters
+    ----------
+    prefix : str
+      prefix for workspace
+    path : str
+      The file's path
+    checkpoint_id : str
+      The checkpoint's id
+    """
+    return s3_key(s3_key(prefix, ".bookstore/checkpoints"), path) + delimiter + checkpoint_id
+
+
+class CachedCheckpoint(NamedTuple):
+    """A file's checkpoint: when it was `last_modified` and its `body`."""
+
+    last_modified: datetime
+    body: bytes
+
+
+class BookstoreCheckpoints(Checkpoints):
+    """Stores the checkpoints of a FileContentsManager's files in S3.
+
+    Creating a checkpoint reads the saved file once, caches it and uploads
+    it in the background with the archiver's upload machinery: compression,
+    multipart uploads and retries. Listing and restoring checkpoints is
+    served from the cache; a path missing from it is read from S3 by the
+    reader, which runs its own event loop and client in a thread so that the
+    synchronous Checkpoints API can wait for it.
+
+    S3 operations on a path run one after the other, in the order they were
+    requested. A checkpoint upload not started yet is replaced by a newer
+    checkpoint of the path.
+
+    Attributes
+    ----------
+
+    settings : bookstore.bookstore_config.BookstoreSettings
+        Settings for S3 and the size of the cache.
+    client_manager : bookstore.s3_client.S3ClientManager
+        Owner of the pooled S3 client used for background writes; replaced by
+        the process-wide manager when the bookstore server extension loads.
+    reader_client_manager : bookstore.s3_client.S3ClientManager
+        Owner of the S3 client reading checkpoints missing from the cache, on
+        the reader thread's event loop.
+    metrics : bookstore.metrics.BookstoreMetrics
+        Recorder of cache hits and checkpoint uploads; replaced by the
+        process-wide metrics when the bookstore server extension loads.
+    cache : collections.OrderedDict
+        Dictionary of paths to their `CachedCheckpoint`, or None for paths
+        known to have no checkpoint, least recently used first.
+    cached_bytes : int
+        Size of the checkpoint bodies in the cache.
+    pending_uploads : dict
+        Dictionary of paths to the checkpoint body waiting to be uploaded.
+    operations : dict
+        Dictionary of paths to the last S3 operation requested on them.
+    fetching : dict
+        Dictionary of paths to the `concurrent.futures.Future` of their
+        checkpoint being read from S3.
+    """
+
+    # number of paths whose checkpoint, or lack of one, is cached
+    max_cached_paths = 4096
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.settings = BookstoreSettings(parent=self)
+        self.client_manager = S3ClientManager(self.settings)
+        self.metrics = self.settings.metrics_class()
+
+        self.cache: OrderedDict = OrderedDict()
+        self.cached_bytes = 0
+        self.pending_uploads: Dict[str, bytes] = {}
+        self.operations: Dict[str, asyncio.Future] = {}
+        self.fetching: Dict[str, concurrent.futures.Future] = {}
+
+        self.reader_client_manager = S3ClientManager(self.settings)
+        self._reader_loop = None
+        self._reader_thread = None
+
+    def create_checkpoint(self, contents_mgr, path):
+        """Create a checkpoint of a saved file, uploading it in the background."""
+        path = path.strip('/')
+        os_path = contents_mgr._get_os_path(path)
+        with contents_mgr.perm_to_403():
+            with open(os_path, 'rb') as f:
+                body = f.read()
+
+        checkpoint = CachedCheckpoint(datetime.now(timezone.utc), body)
+        self._cache_put(path, checkpoint)
+        if path not in self.pending_uploads:
+            self._enqueue([path], self._upload, path)
+        self.pending_uploads[path] = body
+        return self._model(checkpoint)
+
+    def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        """Restore a file from its checkpoint.
+
+        A checkpoint not read from S3 within ``checkpoint_fetch_timeout``
+        seconds is answered with a 503 asking to try again.
+        """
+        path = path.strip('/')
+        checkpoint = self._lookup(path)
+        if checkpoint is NOT_CACHED:
+            raise HTTPError(503, f"Checkpoint of {path} is being read from S3, try again shortly")
+        if checkpoint is None:
+            self.no_such_checkpoint(path, checkpoint_id)
+
+        os_path = contents_mgr._get_os_path(path)
+        with contents_mgr.perm_to_403():
+            with contents_mgr.atomic_writing(os_path, text=False) as f:
+                f.write(checkpoint.body)
+
+    def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        """Rename a file's checkpoint.
+
+        A checkpoint not cached is renamed in S3 if it exists there.
+        """
+        old_path = old_path.strip('/')
+        new_path = new_path.strip('/')
+        checkpoint = self.cache.get(old_path, NOT_CACHED)
+        if checkpoint is None:
+            return
+        if checkpoint is NOT_CACHED:
+            # whether the new path has a checkpoint is known once the rename is done
+            self._cache_forget(new_path)
+        else:
+            self._cache_put(new_path, checkpoint)
+        self._cache_put(old_path, None)
+        self._enqueue([old_path, new_path], self._rename, old_path, new_path)
+
+    def rename_all_checkpoints(self, old_path, new_path):
+        """Rename a file's checkpoint, whether or not it is cached."""
+        self.rename_checkpoint(CHECKPOINT_ID, old_path, new_path)
+
+    def delete_checkpoint(self, checkpoint_id, path):
+        """Delete a file's checkpoint.
+
+        A checkpoint not cached is deleted from S3 if it exists there.
+        """
+        path = path.strip('/')
+        if self.cache.get(path, NOT_CACHED) is None:
+            self.no_such_checkpoint(path, checkpoint_id)
+        self._cache_put(path, None)
+        self.pending_uploads.pop(path, None)
+        self._enqueue([path], self._delete, path)
+
+    def delete_all_checkpoints(self, path):
+        """Delete a file's checkpoint, whether or not it is cached."""
+        path = path.strip('/')
+        if self.cache.get(path, NOT_CACHED) is not None:
+            self.delete_checkpoint(CHECKPOINT_ID, path)
+
+    def list_checkpoints(self, path):
+        """List a file's checkpoint, if it has one.
+
+        A checkpoint not read from S3 within ``checkpoint_fetch_timeout``
+        seconds is not listed until the read completes.
+        """
+        path = path.strip('/')
+        checkpoint = self._lookup(path)
+        if checkpoint is None or checkpoint is NOT_CACHED:
+            return []
+        return [self._model(checkpoint)]
+
+    def no_such_checkpoint(self, path, checkpoint_id):
+        raise HTTPError(404, f'Checkpoint does not exist: {path}@{checkpoint_id}')
+
+    def _model(self, checkpoint: CachedCheckpoint):
+        return {"id": CHECKPOINT_ID, "last_modified": checkpoint.last_modified}
+
+    def _lookup(self, path):
+        """Find a path's checkpoint in the cache, or else read it from S3.
+
+        Parameters
+        ----------
+
+        path : str
+            The file's path
+
+        Returns
+        -------
+
+        CachedCheckpoint, None or NOT_CACHED
+            The checkpoint, None if the file has none, or NOT_CACHED if it
+            could not be read from S3 in time
+        """
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            self.metrics.inc("bookstore_checkpoint_cache_total", result="hit")
+            return self.cache[path]
+        self.metrics.inc("bookstore_checkpoint_cache_total", result="miss")
+
+        if path in self.operations:
+            # the target of a rename not applied in S3 yet: S3 does not know its checkpoint
+            return NOT_CACHED
+
+        future = self.fetching.get(path)
+        if future is None:
+            future = asyncio.run_coroutine_threadsafe(self._read(path), self._reader())
+            self.fetching[path] = future
+            loop = asyncio.get_event_loop()
+            future.add_done_callback(functools.partial(self._read_done, loop, path))
+        try:
+            future.result(timeout=self.settings.checkpoint_fetch_timeout)
+        except concurrent.futures.TimeoutError:
+            self.log.warning("Checkpoint of %s is still being read from S3", path)
+            return NOT_CACHED
+        except Exception:
+            # logged once the read is done
+            pass
+        self._fetched(path, future)
+        return self.cache.get(path, NOT_CACHED)
+
+    def _reader(self):
+        """The reader thread's event loop, started on first use."""
+        if self._reader_loop is None:
+            self._reader_loop = asyncio.new_event_loop()
+            self._reader_thread = threading.Thread(
+                target=self._reader_loop.run_forever, name="bookstore-checkpoints", daemon=True
+            )
+            self._reader_thread.start()
+        return self._reader_loop
+
+    async def _read(self, path):
+        """Read a path's checkpoint from S3, on the reader thread.
+
+        Returns
+        -------
+
+        CachedCheckpoint or None
+            The checkpoint, or None if the file has none
+        """
+        s3_kwargs = {
+            "Bucket": self.settings.s3_bucket,
+            "Key": checkpoint_key(self.settings.workspace_prefix, path),
+        }
+        client_manager = self.reader_client_manager
+        client = await client_manager.get_client()
+        try:
+            obj = await client_manager.retry.call(client.get_object, **s3_kwargs)
+            body = await obj['Body'].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+                raise
+            return None
+        body = decompress(body, obj.get('ContentEncoding'))
+        return CachedCheckpoint(obj['LastModified'], body)
+
+    def _read_done(self, loop, path, future):
+        """Hand a read finished after its caller stopped waiting back to the server's event loop."""
+        try:
+            loop.call_soon_threadsafe(self._fetched, path, future)
+        except RuntimeError:
+            # the server's event loop is closed
+            pass
+
+    def _fetched(self, path, future):
+        """Cache a checkpoint read from S3, unless it was cached meanwhile."""
+        if self.fetching.get(path) is not future:
+            return
+        del self.fetching[path]
+        error = future.exception()
+        if error is not None:
+            self.metrics.inc("bookstore_checkpoint_failed_total", operation="_read")
+            self.log.error("Error while reading checkpoint: %s", path, exc_info=error)
+            return
+        # checkpoints created, renamed or deleted meanwhile are newer
+        if path not in self.cache:
+            self._cache_put(path, future.result())
+
+    def _cache_put(self, path, checkpoint: Optional[CachedCheckpoint]):
+        """Cache a path's checkpoint, evicting the least recently used paths over the limits.
+
+        Paths with S3 operations outstanding stay cached, as S3 does not
+        reflect them yet.
+        """
+        previous = self.cache.pop(path, None)
+        if previous is not None:
+            self.cached_bytes -= len(previous.body)
+        self.cache[path] = checkpoint
+        if checkpoint is not None:
+            self.cached_bytes += len(checkpoint.body)
+        if not self._cache_full():
+            return
+
+        for cached in list(self.cache):
+            if not self._cache_full():
+                break
+            if cached == path or cached in self.operations:
+                continue
+            evicted = self.cache.pop(cached)
+            if evicted is not None:
+                self.cached_bytes -= len(evicted.body)
+
+    def _cache_forget(self, path):
+        """Remove a path from the cache, so that its checkpoint is read from S3 when needed."""
+        previous = self.cache.pop(path, None)
+        if previous is not None:
+            self.cached_bytes -= len(previous.body)
+
+    def _cache_full(self):
+        return (
+            self.cached_bytes > self.settings.checkpoint_cache_max_bytes
+            or len(self.cache) > self.max_cached_paths
+        )
+
+    def _enqueue(self, paths, operation, *args):
+        """Run an S3 operation once the operations already requested on its paths are done."""
+        previous = {self.operations[path] for path in paths if path in self.operations}
+        task = asyncio.ensure_future(self._run_after(previous, operation, *args))
+        for path in paths:
+            self.operations[path] = task
+        task.add_done_callback(functools.partial(self._operation_done, paths))
+
+    def _operation_done(self, paths, task):
+        for path in paths:
+            if self.operations.get(path) is task:
+                del self.operations[path]
+
+    async def _run_after(self, previous, operation, *args):
+        if previous:
+            await asyncio.wait(previous)
+        try:
+            await operation(*args)
+        except Exception:
+            self.metrics.inc("bookstore_checkpoint_failed_total", operation=operation.__name__)
+            self.log.error("Error while storing checkpoint: %s", args, exc_info=True)
+
+    async def _upload(self, path):
+        body = self.pending_uploads.pop(path, None)
+        if body is None:
+            # the checkpoint was deleted before it was uploaded
+            return
+        body, content_encoding = await asyncio.get_event_loop().run_in_executor(
+            None, compress, body, self.settings.compression
+        )
+        s3_kwargs = {
+            "Bucket": self.settings.s3_bucket,
+            "Key": checkpoint_key(self.settings.workspace_prefix, path),
+            "Body": body,
+        }
+        if content_encoding is not None:
+            s3_kwargs["ContentEncoding"] = content_encoding
+        client = await self.client_manager.get_client()
+        await upload_object(client, self.settings, retry=self.client_manager.retry, **s3_kwargs)
+        self.metrics.observe("bookstore_checkpoint_upload_bytes", len(body), buckets=SIZE_BUCKETS)
+
+    async def _rename(self, old_path, new_path):
+        client = await self.client_manager.get_client()
+        bucket = self.settings.s3_bucket
+        old_key = checkpoint_key(self.settings.workspace_prefix, old_path)
+        try:
+            await self.client_manager.retry.call(
+                client.copy_object,
+                Bucket=bucket,
+                Key=checkpoint_key(self.settings.workspace_prefix, new_path),
+                CopySource={"Bucket": bucket, "Key": old_key},
+            )
+        except ClientError as e:
+            # a checkpoint renamed without being cached may not exist
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+                raise
+            return
+        await self.client_manager.retry.call(client.delete_object, Bucket=bucket, Key=old_key)
+
+    async def _delete(self, path):
+        client = await self.client_manager.get_client()
+        await self.client_manager.retry.call(
+            client.delete_object,
+            Bucket=self.settings.s3_bucket,
+            Key=checkpoint_key(self.settings.workspace_prefix, path),
+        )
+
+    async def flush(self, timeout):
+        """Wait for outstanding S3 operations to complete, up to a deadline.
+
+        Operations still running at the deadline are cancelled.
+
+        Parameters
+        ----------
+
+        timeout : float
+            Seconds to wait for operations to complete
+
+        Returns
+        -------
+
+        list
+            Paths whose checkpoints could not be stored in time
+        """
+        tasks = set(self.operations.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        unflushed = sorted(path for path, task in self.operations.items() if not task.done())
+        cancelled = [task for task in tasks if not task.done()]
+        for task in cancelled:
+            task.cancel()
+        if cancelled:
+            await asyncio.wait(cancelled)
+        if unflushed:
+            self.log.warning(
+                "Unable to store %d checkpoints before shutdown: %s",
+                len(unflushed),
+                ", ".join(unflushed),
+            )
+        return unflushed
+
+    async def close(self):
+        """Close the reader's S3 client and stop its thread."""
+        loop = self._reader_loop
+        if loop is None:
+            return
+        self._reader_loop = None
+        try:
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self.reader_client_manager.close(), loop)
+            )
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            await asyncio.get_event_loop().run_in_executor(None, self._reader_thread.join)
+            loop.close()
@@ -1,21 +1,30 @@
 """Handler to clone notebook from storage."""
+import asyncio
 import json
 import os
 
 from copy import deepcopy
 from pathlib import Path
 
-import aiobotocore
-
 from botocore.exceptions import ClientError
 from jinja2 import FileSystemLoader
+from nbformat import ValidationError
 from notebook.base.handlers import IPythonHandler, APIHandler
+from tornado import ioloop
 from tornado import web
 
 from . import PACKAGE_DIR
+from .blobs import BLOB_REFERENCE_PREFIX
+from .blobs import blob_key, blob_references, is_manifest, manifest_blob_prefix, reassemble
 from .bookstore_config import BookstoreSettings
-from .s3_paths import s3_path, s3_display_path
+from .compression import decompress
+from .deltas import restore_version
+from .metrics import RequestMetricsMixin
+from .retry import CircuitOpenError
+from .s3_client import get_client_manager
+from .s3_paths import delimiter, s3_key, s3_path, s3_display_path
 from .utils import url_path_join
+from .validation import get_validator
 
 BOOKSTORE_FILE_LOADER = FileSystemLoader(PACKAGE_DIR)
 
@@ -154,7 +163,7 @@ class BookstoreCloneHandler(IPythonHandler):
         return BOOKSTORE_FILE_LOADER.load(self.settings['jinja2_env'], name)
 
 
-class BookstoreCloneAPIHandler(APIHandler):
+class BookstoreCloneAPIHandler(RequestMetricsMixin, APIHandler):
     """Handle notebook clone from storage.
 
     Provides API handling for ``POST`` and clones a notebook
@@ -176,11 +185,13 @@ class BookstoreCloneAPIHandler(APIHandler):
     `Jupyter Notebook reference on Custom Handlers <https://jupyter-notebook.readthedocs.io/en/stable/extending/handlers.html#registering-custom-handlers>`_
     """
 
+    metrics_endpoint = "clone"
+
     def initialize(self):
-        """Helper to retrieve bookstore setting for the session."""
+        """Helper to retrieve bookstore setting and the shared S3 client for the session."""
         self.bookstore_settings = BookstoreSettings(config=self.config)
 
-        self.session = aiobotocore.get_session()
+        self.client_manager = get_client_manager(self.settings, self.bookstore_settings)
 
     def _build_s3_request_object(self, s3_bucket, s3_object_key, s3_version_id=None):
         """Helper to build object request with the appropriate keys for S3 APIs.
@@ -215,26 +226,119 @@ class BookstoreCloneAPIHandler(APIHandler):
         self.log.info(f"bucket: {s3_bucket}")
         self.log.info(f"key: {s3_object_key}")
 
-        async with self.session.create_client(
-            's3',
-            aws_secret_access_key=self.bookstore_settings.s3_secret_access_key,
-            aws_access_key_id=self.bookstore_settings.s3_access_key_id,
-            endpoint_url=self.bookstore_settings.s3_endpoint_url,
-            region_name=self.bookstore_settings.s3_region_name,
-        ) as client:
-            self.log.info(f"Processing clone of {s3_object_key}")
-            try:
-                s3_kwargs = self._build_s3_request_object(s3_bucket, s3_object_key, s3_version_id)
-                obj = await client.get_object(**s3_kwargs)
-                content = (await obj['Body'].read()).decode('utf-8')
-            except ClientError as e:
-                status_code = e.response['ResponseMetadata'].get('HTTPStatusCode')
-                raise web.HTTPError(status_code, e.args[0])
-
-            self.log.info(f"Obtained contents for {s3_object_key}")
+        client = await self.client_manager.get_client()
+        self.log.info(f"Processing clone of {s3_object_key}")
+        try:
+            path = self._delta_archived_path(s3_bucket, s3_object_key, s3_version_id)
+            if path is not None:
+                restored = await self._restore_delta_archived(client, s3_bucket, path)
+                if restored is not None:
+                    return restored
+            s3_kwargs = self._build_s3_request_object(s3_bucket, s3_object_key, s3_version_id)
+            obj, body = await self.client_manager.retry.call(self._read_object, client, s3_kwargs)
+            content = decompress(body, obj.get('ContentEncoding')).decode('utf-8')
+            if BLOB_REFERENCE_PREFIX in content:
+                content = await self._reassemble(client, s3_bucket, content)
+        except ClientError as e:
+            status_code = e.response['ResponseMetadata'].get('HTTPStatusCode')
+            raise web.HTTPError(status_code, e.args[0])
+        except CircuitOpenError as e:
+            raise web.HTTPError(503, str(e))
+
+        self.log.info(f"Obtained contents for {s3_object_key}")
 
         return obj, content
 
+    def _delta_archived_path(self, s3_bucket, s3_object_key, s3_version_id=None):
+        """Helper that finds the workspace path of a key whose notebook may be archived as deltas.
+
+        With ``archive_format`` set to ``"delta"`` the archiver stops writing
+        notebooks to their workspace key, so the latest version of a workspace
+        notebook is rebuilt from its deltas rather than read from the key.
+
+        Parameters
+        ----------
+        s3_bucket: str
+            The S3 bucket to clone from.
+        s3_object_key: str
+            The key to clone.
+        s3_version_id: str, optional
+            The S3 version id requested, which is always read from the key itself.
+
+        Returns
+        --------
+        str or None
+            The notebook's path relative to ``workspace_prefix``, or None if the
+            key is not read from delta archives
+        """
+        settings = self.bookstore_settings
+        if (
+            settings.archive_format != "delta"
+            or s3_version_id is not None
+            or s3_bucket != settings.s3_bucket
+        ):
+            return None
+        key = s3_key(s3_object_key)
+        workspace = s3_key(settings.workspace_prefix)
+        if workspace:
+            workspace += delimiter
+        if not key.startswith(workspace) or key == workspace:
+            return None
+        return key[len(workspace) :]
+
+    async def _restore_delta_archived(self, client, s3_bucket, path):
+        """Helper that rebuilds the latest delta archived version of a workspace notebook.
+
+        Returns
+        --------
+        tuple or None
+            A response-like object and the notebook's content, or None if the
+            path has no delta archived versions
+        """
+        try:
+            notebook = await self.client_manager.retry.call(
+                restore_version, client, s3_bucket, self.bookstore_settings.workspace_prefix, path
+            )
+        except LookupError:
+            return None
+        self.log.info(f"Restored {path} from its delta archived versions")
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}, json.dumps(notebook)
+
+    async def _read_object(self, client, s3_kwargs):
+        """Helper that gets an object and reads its body, so both are retried together."""
+        obj = await client.get_object(**s3_kwargs)
+        return obj, await obj['Body'].read()
+
+    async def _reassemble(self, client, s3_bucket, content):
+        """Helper that rebuilds a full notebook from an archived manifest and its blobs.
+
+        Parameters
+        ----------
+        client: aiobotocore.client.AioBaseClient
+            The S3 client used to read blobs.
+        s3_bucket: str
+            The S3 bucket the manifest was cloned from.
+        content: str
+            The cloned content, returned unchanged if it is not a manifest.
+        """
+        try:
+            manifest = json.loads(content)
+        except ValueError:
+            return content
+        if not isinstance(manifest, dict) or not is_manifest(manifest):
+            return content
+
+        prefix = manifest_blob_prefix(manifest)
+
+        async def read_blob(digest):
+            s3_kwargs = {"Bucket": s3_bucket, "Key": blob_key(prefix, digest)}
+            _, body = await self.client_manager.retry.call(self._read_object, client, s3_kwargs)
+            return digest, body
+
+        blobs = dict(await asyncio.gather(*map(read_blob, blob_references(manifest))))
+        self.log.info(f"Reassembled notebook from {len(blobs)} blobs")
+        return json.dumps(reassemble(manifest, blobs))
+
     @web.authenticated
     async def post(self):
         """POST /api/bookstore/clone
@@ -441,7 +545,7 @@ class BookstoreFSCloneHandler(IPythonHandler):
         return BOOKSTORE_FILE_LOADER.load(self.settings['jinja2_env'], name)
 
 
-class BookstoreFSCloneAPIHandler(APIHandler):
+class BookstoreFSCloneAPIHandler(RequestMetricsMixin, APIHandler):
     """Handle notebook clone from an accessible file system (local or cloud).
 
     Provides API handling for ``POST`` and clones a notebook
@@ -450,20 +554,27 @@ class BookstoreFSCloneAPIHandler(APIHandler):
     Methods
     -------
     initialize(self)
-        Helper to access bookstore settings.
+        Helper to access bookstore settings and the notebook validator.
     post(self)
         Clone a notebook from the filesystem location specified by the payload.
     build_content_model(self, content, path)
         Helper for creating a Jupyter ContentsAPI compatible model.
+    build_model(self, content, path)
+        Helper for building a model at an already incremented path.
+    validate_notebook_model(self, model)
+        Helper adding a failed-validation message to a notebook model.
 
     See also
     --------
     `Jupyter Notebook reference on Custom Handlers <https://jupyter-notebook.readthedocs.io/en/stable/extending/handlers.html#registering-custom-handlers>`_
     """
 
+    metrics_endpoint = "fs-clone"
+
     def initialize(self):
-        """Helper to retrieve bookstore setting for the session."""
+        """Helper to retrieve bookstore setting and the shared notebook validator for the session."""
         self.bookstore_settings = BookstoreSettings(config=self.config)
+        self.validator = get_validator(self.settings, self.bookstore_settings)
 
     def _get_content(self, path):
         """Helper for getting content from a specified filepath.
@@ -504,7 +615,15 @@ class BookstoreFSCloneAPIHandler(APIHandler):
         target_path = model.get("target_path", "") or os.path.basename(os.path.relpath(relpath))
 
         nb = self._get_content(str(fs_clonepath))
-        content_model = self.build_content_model(json.dumps(nb), target_path)
+        content = json.dumps(nb)
+        # The contents manager is not thread-safe: only building the model is offloaded
+        path = self.contents_manager.increment_filename(target_path, insert='-')
+        if self.validator.offloaded(len(content)):
+            content_model = await ioloop.IOLoop.current().run_in_executor(
+                None, self.build_model, content, path
+            )
+        else:
+            content_model = self.build_model(content, path)
 
         self.log.info(f"Completing clone from {fs_clonepath} to {target_path}")
         self.contents_manager.save(content_model, content_model['path'])
@@ -531,9 +650,51 @@ class BookstoreFSCloneAPIHandler(APIHandler):
             `Jupyter Contents API compatible model <https://jupyter-notebook.readthedocs.io/en/stable/extending/contents.html>`_
         """
         path = self.contents_manager.increment_filename(target_path, insert='-')
+        return self.build_model(content, path)
+
+    def build_model(self, content, path):
+        """Helper that builds and validates a ContentsAPI compatible model for a path.
+
+        Unlike build_content_model, this does not use the contents manager, so it
+        may run off the event loop.
+
+        Parameters
+        ----------
+        content : dict or string
+            dict or string encoded file content
+        path : str
+            The path the model will be saved to
+
+        Returns
+        --------
+        dict
+            `Jupyter Contents API compatible model <https://jupyter-notebook.readthedocs.io/en/stable/extending/contents.html>`_
+        """
         if os.path.splitext(path)[1] in [".ipynb", ".jpynb"]:
             model = build_notebook_model(content, path)
-            self.contents_manager.validate_notebook_model(model)
+            self.validate_notebook_model(model)
         else:
             model = build_file_model(content, path)
         return model
+
+    def validate_notebook_model(self, model):
+        """Add a failed-validation message to a notebook model, as the contents manager does.
+
+        Parameters
+        ----------
+        model : dict
+            Jupyter Contents API model of a notebook
+
+        Returns
+        --------
+        dict
+            The model, with a ``message`` if the notebook is not valid
+        """
+        try:
+            self.validator.validate(model['content'])
+        except ValidationError as e:
+            model['message'] = (
+                f'Notebook validation failed: {e.message}:\n'
+                f'{json.dumps(e.instance, indent=1, default=lambda obj: "<UNKNOWN>")}'
+            )
+        return model
@@ -0,0 +1,98 @@
+"""Compression of stored notebook objects"""
+import gzip
+import shutil
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compression modes accepted by BookstoreSettings.compression
+COMPRESSION_MODES = ("none", "gzip", "zstd")
+
+
+def zstd_available():
+    """Whether the optional ``zstandard`` package is installed."""
+    return zstandard is not None
+
+
+def compress(body, mode):
+    """Compress an object body before it is written to storage.
+
+    Parameters
+    ----------
+    body : bytes
+      The uncompressed object body
+    mode : str
+      One of ``"none"``, ``"gzip"`` or ``"zstd"``
+
+    Returns
+    --------
+    tuple
+      The (possibly) compressed body and the ``Content-Encoding`` to store
+      alongside it, which is ``None`` when the body is left uncompressed.
+    """
+    if mode == "gzip":
+        return gzip.compress(body), "gzip"
+    if mode == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(body), "zstd"
+    return body, None
+
+
+def compress_file(source, destination, mode):
+    """Compress a file into another a chunk at a time, never holding either whole in memory.
+
+    Parameters
+    ----------
+    source : file object
+      The uncompressed file, open in binary mode and positioned at its start
+    destination : file object
+      The file the compressed body is written to, open in binary mode
+    mode : str
+      One of ``"none"``, ``"gzip"`` or ``"zstd"``
+
+    Returns
+    --------
+    str
+      The ``Content-Encoding`` to store alongside the compressed body, which
+      is ``None`` when the body is copied uncompressed.
+    """
+    if mode == "gzip":
+        with gzip.GzipFile(fileobj=destination, mode="wb") as compressed:
+            shutil.copyfileobj(source, compressed)
+        return "gzip"
+    if mode == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        zstandard.ZstdCompressor().copy_stream(source, destination)
+        return "zstd"
+    shutil.copyfileobj(source, destination)
+    return None
+
+
+def decompress(body, content_encoding=None):
+    """Decompress an object body read from storage.
+
+    Parameters
+    ----------
+    body : bytes
+      The object body as stored
+    content_encoding : str, optional
+      The object's ``Content-Encoding``. Bodies without a recognized
+      encoding are returned unchanged.
+
+    Returns
+    --------
+    bytes
+      The uncompressed body
+    """
+    if content_encoding == "gzip":
+        return gzip.decompress(body)
+    if content_encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd encoded objects require the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body
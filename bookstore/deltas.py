@@ -0,0 +1,260 @@
+"""Delta archiving: storing cell-level differences between successive saves.
+
+Each archived version of a notebook is stored under its path and a sequence
+number. A version is either a *base*, a full notebook, or a *delta* against
+the version before it. Any version can be restored by applying the deltas
+that follow the closest base.
+
+Next to the versions, a *latest* pointer records the last sequence number
+and the sequence numbers of the bases kept, so the latest version is
+restored, and the next one numbered, without listing the versions.
+"""
+import asyncio
+import json
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from botocore.exceptions import ClientError
+
+from .compression import decompress
+from .s3_paths import delimiter, s3_key
+
+BASE = "base"
+DELTA = "delta"
+# Name of the pointer to the latest version, stored among the versions
+LATEST = "latest.json"
+
+
+def delta_prefix(prefix, path):
+    """Compute the key prefix under which the versions of a notebook are stored.
+
+    Parameters
+    ----------
+    prefix : str
+      prefix for workspace
+    path : str
+      The notebook's path
+    """
+    return s3_key(s3_key(prefix, ".bookstore/deltas"), path) + delimiter
+
+
+def version_key(prefix, path, sequence, kind):
+    """Compute the key of one version of a notebook.
+
+    Parameters
+    ----------
+    prefix : str
+      prefix for workspace
+    path : str
+      The notebook's path
+    sequence : int
+      The version's sequence number
+    kind : str
+      ``"base"`` or ``"delta"``
+    """
+    return f"{delta_prefix(prefix, path)}{sequence:010d}.{kind}.json"
+
+
+def latest_key(prefix, path):
+    """Compute the key of the pointer to the latest version of a notebook.
+
+    Parameters
+    ----------
+    prefix : str
+      prefix for workspace
+    path : str
+      The notebook's path
+    """
+    return delta_prefix(prefix, path) + LATEST
+
+
+def parse_version_key(key):
+    """Split a version key into its sequence number and kind.
+
+    Returns
+    --------
+    tuple
+      The sequence number and ``"base"`` or ``"delta"``
+    """
+    sequence, kind, _ = key.rsplit(delimiter, 1)[-1].split(".")
+    return int(sequence), kind
+
+
+def _cell_key(cell):
+    return json.dumps(cell, sort_keys=True)
+
+
+def compute_delta(previous, current):
+    """Compute a cell-level delta from one notebook to the next.
+
+    Cells unchanged from the previous version are stored as their index in
+    it, every other cell is stored in full. Notebook metadata is small and is
+    always stored in full.
+
+    Parameters
+    ----------
+    previous : dict
+      The previously archived notebook
+    current : dict
+      The notebook being archived
+
+    Returns
+    --------
+    dict
+      The delta
+    """
+    previous_cells = {}
+    for index, cell in enumerate(previous.get("cells", [])):
+        previous_cells.setdefault(_cell_key(cell), index)
+
+    return {
+        "nbformat": current.get("nbformat"),
+        "nbformat_minor": current.get("nbformat_minor"),
+        "metadata": current.get("metadata", {}),
+        "cells": [previous_cells.get(_cell_key(cell), cell) for cell in current.get("cells", [])],
+    }
+
+
+def apply_delta(previous, delta):
+    """Apply a delta to the notebook it was computed against.
+
+    Parameters
+    ----------
+    previous : dict
+      The notebook the delta was computed against
+    delta : dict
+      Delta produced by :func:`compute_delta`
+
+    Returns
+    --------
+    dict
+      The notebook the delta was computed from
+    """
+    previous_cells = previous.get("cells", [])
+    return {
+        "nbformat": delta["nbformat"],
+        "nbformat_minor": delta["nbformat_minor"],
+        "metadata": delta["metadata"],
+        "cells": [
+            previous_cells[cell] if isinstance(cell, int) else cell for cell in delta["cells"]
+        ],
+    }
+
+
+def restore_notebook(versions):
+    """Rebuild a notebook from a base and the deltas following it.
+
+    Parameters
+    ----------
+    versions : list
+      ``(kind, document)`` pairs in sequence order, starting with a base
+
+    Returns
+    --------
+    dict
+      The notebook as of the last version
+    """
+    notebook = None
+    for kind, document in versions:
+        notebook = document if kind == BASE else apply_delta(notebook, document)
+    return notebook
+
+
+async def list_versions(client, bucket, prefix, path) -> List[Tuple[int, str, str]]:
+    """List the archived versions of a notebook.
+
+    Returns
+    --------
+    list
+      ``(sequence, kind, key)`` triples in sequence order
+    """
+    versions = []
+    paginator = client.get_paginator('list_objects_v2')
+    async for page in paginator.paginate(Bucket=bucket, Prefix=delta_prefix(prefix, path)):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(delimiter + LATEST):
+                continue
+            versions.append((*parse_version_key(obj['Key']), obj['Key']))
+    return sorted(versions)
+
+
+async def read_latest(client, bucket, prefix, path) -> Optional[dict]:
+    """Read the pointer to the latest version of a notebook.
+
+    Returns
+    --------
+    dict or None
+      The last version's ``sequence`` and the sequence numbers of the
+      ``bases`` kept, oldest first, or None if the notebook has no pointer
+    """
+    try:
+        obj = await client.get_object(Bucket=bucket, Key=latest_key(prefix, path))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+            raise
+        return None
+    return json.loads((await obj['Body'].read()).decode('utf-8'))
+
+
+def latest_versions(prefix, path, latest) -> List[Tuple[int, str, str]]:
+    """List the versions from the last base to the latest version, from its pointer.
+
+    Returns
+    --------
+    list
+      ``(sequence, kind, key)`` triples in sequence order
+    """
+    base = latest["bases"][-1]
+    return [(base, BASE, version_key(prefix, path, base, BASE))] + [
+        (sequence, DELTA, version_key(prefix, path, sequence, DELTA))
+        for sequence in range(base + 1, latest["sequence"] + 1)
+    ]
+
+
+async def _read_version(client, bucket, kind, key):
+    obj = await client.get_object(Bucket=bucket, Key=key)
+    body = decompress(await obj['Body'].read(), obj.get('ContentEncoding'))
+    return kind, json.loads(body.decode('utf-8'))
+
+
+async def restore_version(client, bucket, prefix, path, sequence: Optional[int] = None):
+    """Restore an archived version of a notebook from storage.
+
+    Parameters
+    ----------
+    client : aiobotocore.client.AioBaseClient
+      S3 client used for reads
+    bucket : str
+      S3 bucket name
+    prefix : str
+      prefix for workspace
+    path : str
+      The notebook's path
+    sequence : int, optional
+      The version to restore. Default is None, which restores the latest
+      version, found from its pointer when there is one.
+
+    Returns
+    --------
+    dict
+      The restored notebook
+    """
+    latest = None
+    if sequence is None:
+        latest = await read_latest(client, bucket, prefix, path)
+    if latest is not None:
+        versions = latest_versions(prefix, path, latest)
+    else:
+        versions = await list_versions(client, bucket, prefix, path)
+        if sequence is not None:
+            versions = [v for v in versions if v[0] <= sequence]
+        bases = [index for index, (_, kind, _) in enumerate(versions) if kind == BASE]
+        if not bases:
+            raise LookupError(f"No archived base version of {path}")
+        versions = versions[bases[-1] :]
+
+    documents = await asyncio.gather(
+        *(_read_version(client, bucket, kind, key) for _, kind, key in versions)
+    )
+    return restore_notebook(documents)
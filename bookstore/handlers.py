@@ -1,4 +1,5 @@
 """Handlers for Bookstore API"""
+import atexit
 import json
 
 from notebook.base.handlers import APIHandler
@@ -7,9 +8,18 @@ from .utils import url_path_join
 from tornado import web
 
 from ._version import __version__
+from .archive import BookstoreContentsArchiver
 from .bookstore_config import BookstoreSettings
 from .bookstore_config import validate_bookstore
-from .publish import BookstorePublishAPIHandler
+from .checkpoints import BookstoreCheckpoints
+from .metrics import METRICS_KEY, format_prometheus, get_metrics
+from .publish import (
+    BookstoreBatchPublishAPIHandler,
+    BookstorePublishAPIHandler,
+    BookstoreStreamPublishAPIHandler,
+)
+from .s3_client import CLIENT_MANAGER_KEY, S3ClientManager
+from .validation import VALIDATOR_KEY, NotebookValidator
 from .clone import (
     BookstoreCloneHandler,
     BookstoreCloneAPIHandler,
@@ -50,6 +60,26 @@ class BookstoreVersionHandler(APIHandler):
         }
 
 
+class BookstoreMetricsHandler(APIHandler):
+    """Handler exposing bookstore's metrics in the Prometheus text format.
+
+    Methods
+    -------
+    get(self)
+        Provides the current value of every counter, gauge and histogram.
+    """
+
+    @web.authenticated
+    def get(self):
+        """GET /api/bookstore/metrics
+
+        Returns request, archive and S3 operation metrics for scraping by Prometheus.
+        """
+        metrics = get_metrics(self.settings, BookstoreSettings(config=self.config))
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(format_prometheus(metrics.snapshot()))
+
+
 def build_settings_dict(validation):
     """Helper for building the settings info that will be assigned to the web_app."""
     return {"release": version, "features": validation}
@@ -64,10 +94,81 @@ def load_jupyter_server_extension(nb_app):
     bookstore_settings = BookstoreSettings(parent=nb_app)
     validation = validate_bookstore(bookstore_settings)
     web_app.settings['bookstore'] = build_settings_dict(validation)
+
+    # One metrics registry and one pooled S3 client for the whole process,
+    # shared by handlers and the archiver
+    archiver = nb_app.contents_manager
+    if isinstance(archiver, BookstoreContentsArchiver):
+        metrics = archiver.metrics
+    else:
+        metrics = bookstore_settings.metrics_class()
+    web_app.settings[METRICS_KEY] = metrics
+
+    client_manager = S3ClientManager(bookstore_settings, metrics=metrics)
+    web_app.settings[CLIENT_MANAGER_KEY] = client_manager
+    if isinstance(archiver, BookstoreContentsArchiver):
+        archiver.client_manager = client_manager
+    checkpoints = getattr(archiver, 'checkpoints', None)
+    if isinstance(checkpoints, BookstoreCheckpoints):
+        checkpoints.client_manager = client_manager
+        checkpoints.metrics = metrics
+    atexit.register(shutdown_bookstore, nb_app, client_manager)
+
+    # Notebook schemas are compiled once, before the first publish or clone
+    validator = NotebookValidator.from_settings(bookstore_settings)
+    validator.warm()
+    web_app.settings[VALIDATOR_KEY] = validator
+
     handlers = collect_handlers(nb_app.log, base_url, validation)
     web_app.add_handlers(host_pattern, handlers)
 
 
+def shutdown_bookstore(nb_app, client_manager):
+    """Flush outstanding archives and checkpoints and release bookstore's S3 resources.
+
+    Runs once the notebook server's event loop has stopped. Archives and
+    checkpoint uploads are each given ``archive_shutdown_timeout`` seconds
+    to complete.
+
+    Parameters
+    ----------
+    nb_app : notebook.notebookapp.NotebookApp
+      The notebook application bookstore was loaded into.
+    client_manager : bookstore.s3_client.S3ClientManager
+      The shared client manager to be closed.
+    """
+    io_loop = getattr(nb_app, 'io_loop', None)
+    if io_loop is None:
+        return
+
+    archiver = nb_app.contents_manager
+    if isinstance(archiver, BookstoreContentsArchiver):
+        try:
+            io_loop.run_sync(lambda: archiver.flush(archiver.settings.archive_shutdown_timeout))
+        except Exception as e:
+            nb_app.log.warning(f"[bookstore] Unable to flush archives: {e}")
+
+    checkpoints = getattr(archiver, 'checkpoints', None)
+    if isinstance(checkpoints, BookstoreCheckpoints):
+        try:
+            io_loop.run_sync(
+                lambda: checkpoints.flush(checkpoints.settings.archive_shutdown_timeout)
+            )
+        except Exception as e:
+            nb_app.log.warning(f"[bookstore] Unable to flush checkpoints: {e}")
+        try:
+            io_loop.run_sync(checkpoints.close)
+        except Exception as e:
+            nb_app.log.warning(f"[bookstore] Unable to close checkpoints reader cleanly: {e}")
+
+    if client_manager.closed:
+        return
+    try:
+        io_loop.run_sync(client_manager.close)
+    except Exception as e:
+        nb_app.log.warning(f"[bookstore] Unable to close S3 client cleanly: {e}")
+
+
 def collect_handlers(log, base_url, validation):
     """Utility that collects bookstore endpoints & handlers to be added to the webapp.
 
@@ -104,9 +205,24 @@ def collect_handlers(log, base_url, validation):
                 BookstorePublishAPIHandler,
             )
         )
+        handlers.append(
+            (
+                url_path_join(base_bookstore_api_pattern, r"/publish-batch(?:/?)*"),
+                BookstoreBatchPublishAPIHandler,
+            )
+        )
     else:
         log.info("[bookstore] Publishing disabled. s3_bucket or endpoint are not configured.")
 
+    if validation['stream_publish_valid']:
+        log.info(f"[bookstore] Enabling bookstore streamed publishing, version: {version}")
+        handlers.append(
+            (
+                url_path_join(base_bookstore_api_pattern, r"/publish-stream%s" % path_regex),
+                BookstoreStreamPublishAPIHandler,
+            )
+        )
+
     if validation['s3_clone_valid']:
         log.info(f"[bookstore] Enabling bookstore cloning, version: {version}")
         handlers.append(
@@ -131,4 +247,10 @@ def collect_handlers(log, base_url, validation):
         ),
     else:
         log.info(f"[bookstore] bookstore cloning disabled, version: {version}")
+
+    if validation['metrics_valid']:
+        log.info(f"[bookstore] Enabling bookstore metrics, version: {version}")
+        handlers.append(
+            (url_path_join(base_bookstore_api_pattern, r"/metrics"), BookstoreMetricsHandler)
+        )
     return handlers
@@ -0,0 +1,176 @@
+"""Parsing publish request bodies without serializing the notebook again.
+
+A publish request carries a contents model whose ``content`` is the
+notebook. The model must be parsed to validate the notebook, but the
+notebook that is stored can be the JSON the client sent: :func:`parse_model`
+returns the model along with the notebook's JSON, either sliced out of the
+request body or, when the optional ``orjson`` package is installed,
+re-encoded by it, which is faster than the standard library's decoder.
+As the stored JSON depends on how it was sent and on whether ``orjson`` is
+installed, :func:`content_digest` identifies a notebook by its content.
+"""
+import hashlib
+import json
+import re
+from typing import Optional
+from typing import Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def orjson_available():
+    """Whether the optional ``orjson`` package is installed."""
+    return orjson is not None
+
+
+def encode(value) -> bytes:
+    """Serialize a decoded JSON value to UTF-8, with orjson when it is installed.
+
+    Parameters
+    ----------
+    value : object
+      A value decoded from JSON, e.g. a notebook
+
+    Returns
+    --------
+    bytes
+      The value's JSON encoded in UTF-8
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which json serializes
+            pass
+    return json.dumps(value).encode('utf-8')
+
+
+def content_digest(value) -> str:
+    """Compute the SHA-256 of a decoded JSON value's canonical encoding.
+
+    The value is encoded with sorted keys and no whitespace by the standard
+    library, whether or not ``orjson`` is installed, so the digest of a
+    notebook does not depend on the JSON it was decoded from.
+
+    Parameters
+    ----------
+    value : object
+      A value decoded from JSON, e.g. a notebook
+
+    Returns
+    --------
+    str
+      SHA-256 hex digest
+    """
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _skip_whitespace(text, pos):
+    return _whitespace.match(text, pos).end()
+
+
+def decode_object(text):
+    """Decode a JSON object, recording where each of its members' values is in the text.
+
+    Parameters
+    ----------
+    text : str
+      The JSON text of an object
+
+    Returns
+    --------
+    tuple
+      The decoded object and a dictionary of its keys to the ``(start, end)``
+      span of their value in ``text``
+
+    Raises
+    ------
+    json.JSONDecodeError
+      The text is not a JSON object
+    """
+    members = {}
+    spans = {}
+    pos = _skip_whitespace(text, 0)
+    if text[pos : pos + 1] != '{':
+        raise json.JSONDecodeError("Expecting a JSON object", text, pos)
+    pos = _skip_whitespace(text, pos + 1)
+    if text[pos : pos + 1] == '}':
+        pos += 1
+    else:
+        while True:
+            if text[pos : pos + 1] != '"':
+                raise json.JSONDecodeError(
+                    "Expecting property name enclosed in double quotes", text, pos
+                )
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip_whitespace(text, pos)
+            if text[pos : pos + 1] != ':':
+                raise json.JSONDecodeError("Expecting ':' delimiter", text, pos)
+            start = _skip_whitespace(text, pos + 1)
+            members[key], pos = _decoder.raw_decode(text, start)
+            spans[key] = (start, pos)
+
+            pos = _skip_whitespace(text, pos)
+            delimiter = text[pos : pos + 1]
+            pos = _skip_whitespace(text, pos + 1)
+            if delimiter == '}':
+                break
+            if delimiter != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+
+    pos = _skip_whitespace(text, pos)
+    if pos != len(text):
+        raise json.JSONDecodeError("Extra data", text, pos)
+    return members, spans
+
+
+def parse_model(body: bytes) -> Tuple[Optional[dict], Optional[bytes]]:
+    """Parse a contents model, keeping the JSON of its ``content``.
+
+    Parameters
+    ----------
+    body : bytes
+      The request body, a JSON object encoded in UTF-8
+
+    Returns
+    --------
+    tuple
+      The model, or None for an empty body, and the JSON of its ``content``
+      encoded in UTF-8, or None if it has none
+
+    Raises
+    ------
+    ValueError
+      The body is not a JSON object encoded in UTF-8
+    """
+    body = body.strip()
+    if not body:
+        return None, None
+
+    if orjson is not None:
+        try:
+            model = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than json, e.g. about integers beyond 64 bits
+            pass
+        else:
+            if not isinstance(model, dict):
+                raise ValueError("Expecting a JSON object")
+            if "content" not in model:
+                return model, None
+            return model, orjson.dumps(model["content"])
+
+    text = body.decode('utf-8')
+    model, spans = decode_object(text)
+    if "content" not in spans:
+        return model, None
+    start, end = spans["content"]
+    return model, text[start:end].encode('utf-8')
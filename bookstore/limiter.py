@@ -0,0 +1,177 @@
+"""Adaptive limit on the number of concurrent S3 operations."""
+import asyncio
+import time
+from collections import deque
+
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
+
+# S3 error codes signalling that requests should slow down
+THROTTLING_ERROR_CODES = frozenset(
+    [
+        "SlowDown",
+        "Throttling",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+        "TooManyRequestsException",
+        "ServiceUnavailable",
+        "RequestTimeout",
+    ]
+)
+
+TIMEOUT_ERRORS = (asyncio.TimeoutError, ConnectTimeoutError, ReadTimeoutError)
+
+
+def is_throttling(error):
+    """Whether an error from S3 signals overload: throttling, a 503 or a timeout.
+
+    Parameters
+    ----------
+    error : Exception
+        The error raised by an S3 operation
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in THROTTLING_ERROR_CODES or status in (429, 503)
+    return isinstance(error, TIMEOUT_ERRORS)
+
+
+class AdaptiveLimiter:
+    """Additive-increase/multiplicative-decrease limit on concurrent S3 operations.
+
+    Every operation completing within ``latency_target`` raises the limit by
+    ``1 / limit``, so a full window of healthy operations adds one slot.
+    Throttling and timeouts multiply the limit by ``decrease_factor``, at
+    most once per ``cooldown`` seconds so that a burst of failures from one
+    overload counts once. The limit stays between ``min_limit`` and
+    ``max_limit``.
+
+    Attributes
+    ----------
+    limit : float
+        The current limit; ``int(limit)`` operations may run at once.
+    in_flight : int
+        Number of operations currently running.
+    min_limit : int
+        Lowest limit.
+    max_limit : int
+        Highest limit.
+    latency_target : float
+        Operations slower than this many seconds do not raise the limit.
+    decrease_factor : float
+        Factor applied to the limit on throttling.
+    cooldown : float
+        Minimum seconds between two decreases.
+    metrics : bookstore.metrics.BookstoreMetrics or None
+        Where the limit and the number of operations in flight are reported.
+    """
+
+    def __init__(
+        self,
+        initial_limit,
+        min_limit,
+        max_limit,
+        latency_target=1.0,
+        decrease_factor=0.5,
+        cooldown=1.0,
+        metrics=None,
+        clock=None,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.metrics = metrics
+        self.clock = clock or time.monotonic
+
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = None
+        self._report()
+
+    @classmethod
+    def from_settings(cls, settings, metrics=None):
+        """Build a limiter from bookstore settings, bounded above by ``max_threads``."""
+        return cls(
+            initial_limit=settings.s3_concurrency_initial,
+            min_limit=settings.s3_concurrency_min,
+            max_limit=settings.max_threads,
+            latency_target=settings.s3_latency_target,
+            metrics=metrics,
+        )
+
+    @property
+    def current_limit(self):
+        """Number of operations that may currently run at once."""
+        return int(self.limit)
+
+    async def run(self, operation, *args, **kwargs):
+        """Await ``operation(*args, **kwargs)`` once a slot is free, adapting the limit.
+
+        Errors from the operation are raised unchanged.
+        """
+        await self._acquire()
+        start = self.clock()
+        try:
+            result = await operation(*args, **kwargs)
+        except Exception as e:
+            if is_throttling(e):
+                self._decrease()
+            raise
+        finally:
+            self._release()
+        if self.clock() - start <= self.latency_target:
+            self._increase()
+        return result
+
+    async def _acquire(self):
+        while self.in_flight >= self.current_limit:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # pass the wake-up on to the next waiter
+                    self._wake()
+                raise
+        self.in_flight += 1
+        self._report()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._report()
+        self._wake()
+
+    def _wake(self):
+        """Wake as many waiters as there are free slots."""
+        free = self.current_limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _increase(self):
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._report()
+            self._wake()
+
+    def _decrease(self):
+        now = self.clock()
+        if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self._report()
+
+    def _report(self):
+        if self.metrics is not None:
+            self.metrics.set("bookstore_s3_concurrency_limit", self.current_limit)
+            self.metrics.set("bookstore_s3_in_flight", self.in_flight)
@@ -0,0 +1,273 @@
+"""Operational metrics for bookstore.
+
+Bookstore reports counters, gauges and histograms through a metrics object
+whose class is configured by ``BookstoreSettings.metrics_class``. The default,
+:class:`BookstoreMetrics`, keeps everything in memory; subclasses can forward
+measurements to another system by overriding :meth:`BookstoreMetrics.inc`,
+:meth:`BookstoreMetrics.set` and :meth:`BookstoreMetrics.observe`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+from tornado.escape import json_encode, utf8
+
+# Key under which the web application's settings hold the shared metrics
+METRICS_KEY = "bookstore_metrics"
+
+# Upper bounds of histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Upper bounds of histogram buckets, in bytes
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(11))
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram(NamedTuple):
+    """A snapshot of a histogram's cumulative bucket counts, sum and count."""
+
+    buckets: Tuple[float, ...]
+    counts: List[int]
+    sum: float
+    count: int
+
+
+def _label_set(labels) -> LabelSet:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class BookstoreMetrics:
+    """In-memory registry of bookstore's counters, gauges and histograms.
+
+    Every measurement is identified by a metric name and a set of labels.
+
+    Attributes
+    ----------
+    counters : dict
+        Dictionary of metric names to dictionaries of label sets to counts.
+    gauges : dict
+        Dictionary of metric names to dictionaries of label sets to values.
+    histograms : dict
+        Dictionary of metric names to dictionaries of label sets to
+        :class:`Histogram` snapshots.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[LabelSet, float]] = {}
+        self.gauges: Dict[str, Dict[LabelSet, float]] = {}
+        self.histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """Increment a counter."""
+        key = _label_set(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge to a value."""
+        with self._lock:
+            self.gauges.setdefault(name, {})[_label_set(labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Record a value in a histogram.
+
+        Parameters
+        ----------
+        name : str
+            The histogram's name
+        value : float
+            The observed value
+        buckets : tuple
+            Upper bounds of the histogram's buckets, used on first observation
+        """
+        key = _label_set(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = Histogram(tuple(buckets), [0] * len(buckets), 0.0, 0)
+            counts = [
+                count + (1 if value <= bound else 0)
+                for count, bound in zip(histogram.counts, histogram.buckets)
+            ]
+            series[key] = Histogram(
+                histogram.buckets, counts, histogram.sum + value, histogram.count + 1
+            )
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Context manager that records its duration, in seconds, in a histogram."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def snapshot(self):
+        """A consistent copy of every metric.
+
+        Returns
+        --------
+        dict
+            The ``counters``, ``gauges`` and ``histograms``
+        """
+        with self._lock:
+            return {
+                "counters": {name: dict(series) for name, series in self.counters.items()},
+                "gauges": {name: dict(series) for name, series in self.gauges.items()},
+                "histograms": {name: dict(series) for name, series in self.histograms.items()},
+            }
+
+
+def get_metrics(app_settings, bookstore_settings):
+    """Retrieve the shared metrics from the web application's settings.
+
+    ``load_jupyter_server_extension`` registers metrics for the whole
+    process. When none are registered (e.g. a handler used outside the
+    extension) an instance of ``metrics_class`` is created and stored.
+
+    Parameters
+    ----------
+    app_settings : dict
+        The tornado web application's settings.
+    bookstore_settings : bookstore.bookstore_config.BookstoreSettings
+        Settings used if new metrics must be created.
+
+    Returns
+    --------
+    BookstoreMetrics
+        The shared metrics.
+    """
+    metrics = app_settings.get(METRICS_KEY)
+    if metrics is None:
+        metrics = bookstore_settings.metrics_class()
+        app_settings[METRICS_KEY] = metrics
+    return metrics
+
+
+def instrument_s3_client(client, metrics):
+    """Record the count, latency, request bytes and errors of an S3 client's operations.
+
+    Parameters
+    ----------
+    client : aiobotocore.client.AioBaseClient
+        The S3 client to instrument
+    metrics : BookstoreMetrics
+        Where operations are recorded
+    """
+
+    def before_call(model, params, context, **kwargs):
+        context["bookstore_start"] = time.monotonic()
+        body = params.get("body")
+        if isinstance(body, (bytes, bytearray)):
+            metrics.inc("bookstore_s3_request_bytes_total", len(body), operation=model.name)
+
+    def after_call(http_response, model, context, **kwargs):
+        status = getattr(http_response, "status_code", 0)
+        metrics.inc("bookstore_s3_operations_total", operation=model.name, status=status)
+        start = context.get("bookstore_start")
+        if start is not None:
+            metrics.observe(
+                "bookstore_s3_operation_seconds", time.monotonic() - start, operation=model.name
+            )
+
+    def after_call_error(exception, context, event_name, **kwargs):
+        operation = event_name.rsplit(".", 1)[-1]
+        metrics.inc("bookstore_s3_operations_total", operation=operation, status="error")
+
+    client.meta.events.register("before-call.s3", before_call)
+    client.meta.events.register("after-call.s3", after_call)
+    client.meta.events.register("after-call-error.s3", after_call_error)
+
+
+class RequestMetricsMixin:
+    """Handler mixin recording request counts, latency and bytes per bookstore endpoint.
+
+    Handlers name their endpoint in ``metrics_endpoint``; requests are
+    recorded in the metrics registered in the application's settings.
+    """
+
+    metrics_endpoint = None
+
+    def write(self, chunk):
+        if isinstance(chunk, dict):
+            chunk = json_encode(chunk)
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self._bookstore_response_bytes = getattr(self, "_bookstore_response_bytes", 0) + len(
+            utf8(chunk)
+        )
+        super().write(chunk)
+
+    def on_finish(self):
+        metrics = self.settings.get(METRICS_KEY)
+        if metrics is not None and self.metrics_endpoint is not None:
+            labels = {"endpoint": self.metrics_endpoint, "method": self.request.method}
+            metrics.inc("bookstore_requests_total", status=self.get_status(), **labels)
+            metrics.observe("bookstore_request_seconds", self.request.request_time(), **labels)
+            metrics.inc("bookstore_request_bytes_total", self.request_body_size(), **labels)
+            metrics.inc(
+                "bookstore_response_bytes_total",
+                getattr(self, "_bookstore_response_bytes", 0),
+                **labels,
+            )
+        super().on_finish()
+
+    def request_body_size(self):
+        """Size in bytes of the request body."""
+        return len(self.request.body or b"")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_prometheus(snapshot):
+    """Render a metrics snapshot in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    snapshot : dict
+        A snapshot from :meth:`BookstoreMetrics.snapshot`
+
+    Returns
+    --------
+    str
+        The metrics, one sample per line
+    """
+    lines = []
+    for kind, group in (("counter", "counters"), ("gauge", "gauges")):
+        for name, series in sorted(snapshot[group].items()):
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for name, series in sorted(snapshot["histograms"].items()):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in sorted(series.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_format_labels(inf_labels)} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
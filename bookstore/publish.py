@@ -1,28 +1,98 @@
+import asyncio
 import json
-
-import aiobotocore
+import tempfile
+from collections import OrderedDict
 
 from botocore.exceptions import ClientError
 from nbformat import ValidationError
-from nbformat import validate as validate_nb
 from notebook.base.handlers import APIHandler, path_regex
 from notebook.services.contents.handlers import validate_model
+from tornado import ioloop
 from tornado import web
 
 from .bookstore_config import BookstoreSettings
+from .compression import compress, compress_file
+from .json_body import content_digest, encode, parse_model
+from .metrics import RequestMetricsMixin, get_metrics
+from .retry import CircuitOpenError
+from .s3_client import get_client_manager
 from .s3_paths import s3_path
 from .s3_paths import s3_key
 from .s3_paths import s3_display_path
+from .s3_upload import FileBody, upload_object
 from .utils import url_path_join
+from .validation import get_validator
+
+
+# Object metadata holding the sha256 of a published notebook's canonical JSON
+DIGEST_METADATA_KEY = "bookstore-sha256"
+# Key under which the web application's settings hold the published digests
+PUBLISHED_DIGESTS_KEY = "bookstore_published_digests"
+
+
+class PublishedDigests:
+    """The digests this server last published or found at S3 keys, least recently used first.
+
+    A known digest differing from a notebook's shows that the notebook
+    changed without asking S3. An equal digest is not trusted on its own:
+    another writer may have replaced the object since.
+    """
+
+    max_entries = 4096
+
+    def __init__(self):
+        self.digests = OrderedDict()
+
+    def get(self, key):
+        digest = self.digests.get(key)
+        if digest is not None:
+            self.digests.move_to_end(key)
+        return digest
+
+    def put(self, key, digest):
+        self.digests[key] = digest
+        self.digests.move_to_end(key)
+        while len(self.digests) > self.max_entries:
+            self.digests.popitem(last=False)
+
 
+def get_published_digests(app_settings):
+    """Retrieve the published digests shared by the publish handlers, creating them if needed."""
+    return app_settings.setdefault(PUBLISHED_DIGESTS_KEY, PublishedDigests())
 
-class BookstorePublishAPIHandler(APIHandler):
+
+def parse_if_none_match(value):
+    """The entity tags of an ``If-None-Match`` header, without quotes or weak prefixes.
+
+    Returns
+    --------
+    set or None
+        The tags, ``{"*"}`` for any, or None if the header is absent
+    """
+    if value is None:
+        return None
+    tags = set()
+    for tag in value.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tags.add(tag.strip('"'))
+    tags.discard('')
+    return tags
+
+
+class BookstorePublishAPIHandler(RequestMetricsMixin, APIHandler):
     """Publish a notebook to the publish path"""
 
+    metrics_endpoint = "publish"
+
     def initialize(self):
-        """Initialize a helper to get bookstore settings and session information quickly"""
+        """Initialize helpers for bookstore settings, the shared S3 client and notebook validator"""
         self.bookstore_settings = BookstoreSettings(config=self.config)
-        self.session = aiobotocore.get_session()
+        self.client_manager = get_client_manager(self.settings, self.bookstore_settings)
+        self.validator = get_validator(self.settings, self.bookstore_settings)
+        self.published_digests = get_published_digests(self.settings)
+        self.metrics = get_metrics(self.settings, self.bookstore_settings)
 
     @web.authenticated
     async def put(self, path):
@@ -32,6 +102,12 @@ class BookstorePublishAPIHandler(APIHandler):
 
         The payload directly matches the contents API for PUT.
 
+        The response's ``ETag`` is the sha256 of the published notebook's
+        canonical JSON, see :func:`bookstore.json_body.content_digest`. When ``publish_skip_unchanged`` is set, or the request has an
+        ``If-None-Match`` header listing the published notebook's tag or
+        ``*``, a notebook identical to the published one is not uploaded
+        again and the response is marked ``not_modified``.
+
         Parameters
         ----------
         path: str
@@ -43,20 +119,46 @@ class BookstorePublishAPIHandler(APIHandler):
 
         s3_object_key = s3_key(self.bookstore_settings.published_prefix, path)
 
-        model = self.get_json_body()
-        self.validate_model(model)
+        model, content_json = self.parse_body()
+        if self.validator.offloaded(len(self.request.body)):
+            content_json, digest = await ioloop.IOLoop.current().run_in_executor(
+                None, self.validated_json, model, content_json
+            )
+        else:
+            content_json, digest = self.validated_json(model, content_json)
 
         full_s3_path = s3_display_path(
             self.bookstore_settings.s3_bucket, self.bookstore_settings.published_prefix, path
         )
         self.log.info(f"Publishing to {full_s3_path}")
 
-        obj = await self._publish(model['content'], s3_object_key)
-        resp_content = self.prepare_response(obj, full_s3_path)
+        obj = await self._publish(content_json, s3_object_key, digest)
+        resp_content = self.prepare_response(obj, full_s3_path, digest)
 
         self.set_status(obj['ResponseMetadata']['HTTPStatusCode'])
+        self.set_header("ETag", f'"{digest}"')
         self.finish(json.dumps(resp_content))
 
+    def parse_body(self):
+        """Parse the request's contents model, keeping the JSON of the notebook to publish.
+
+        Returns
+        --------
+        tuple
+            The model, or None for an empty body, and the notebook's JSON as bytes
+
+        Raises
+        ------
+        tornado.web.HTTPError
+            The body is not a JSON object
+        """
+        try:
+            return parse_model(self.request.body)
+        except ValueError as e:
+            self.log.debug("Bad JSON: %r", self.request.body)
+            self.log.error("Couldn't parse JSON", exc_info=True)
+            raise web.HTTPError(400, 'Invalid JSON in body of request') from e
+
     def validate_model(self, model):
         """Checks that the model given to the API handler meets bookstore's expected structure for a notebook.
 
@@ -68,6 +170,12 @@ class BookstorePublishAPIHandler(APIHandler):
         model: dict
             Request model for publishing describing the type and content of the object.
 
+        Returns
+        --------
+        bool
+            Whether validation repaired the notebook in place, see
+            :meth:`bookstore.validation.NotebookValidator.validate`
+
         Raises
         ------
         tornado.web.HTTPError
@@ -82,7 +190,7 @@ class BookstorePublishAPIHandler(APIHandler):
         if content == {}:
             raise web.HTTPError(422, "Bookstore cannot publish empty contents")
         try:
-            validate_nb(content)
+            return self.validator.validate(content)
         except ValidationError as e:
             raise web.HTTPError(
                 422,
@@ -91,37 +199,160 @@ class BookstorePublishAPIHandler(APIHandler):
                 f"{e.message} {json.dumps(e.instance, indent=1, default=lambda obj: '<UNKNOWN>')}",
             )
 
-    async def _publish(self, content, s3_object_key):
-        """Publish notebook model to the path
-        
+    def validated_json(self, model, content_json=None):
+        """Validate a model and return the JSON and digest of the notebook to publish.
+
+        Parameters
+        ----------
+        model: dict
+            Request model for publishing describing the type and content of the object.
+        content_json: bytes, optional
+            The notebook's JSON as received, if any
+
+        Returns
+        --------
+        tuple
+            ``content_json``, or the notebook encoded again if there is no
+            JSON as received or validation repaired the notebook, and the
+            notebook's :func:`~bookstore.json_body.content_digest`
+
+        Raises
+        ------
+        tornado.web.HTTPError
+            Your model does not validate correctly
+        """
+        if self.validate_model(model) or content_json is None:
+            content_json = encode(model['content'])
+        return content_json, content_digest(model['content'])
+
+    async def _publish(self, content_json, s3_object_key, digest):
+        """Publish a notebook's JSON to the path
+
+        The JSON is stored as received rather than serialized again, see
+        :func:`bookstore.json_body.parse_model`. Large notebooks are uploaded
+        with a multipart upload, see :func:`bookstore.s3_upload.upload_object`.
+        Transient failures are retried by the shared retry policy.
+
+        Parameters
+        ----------
+        content_json : bytes
+            The notebook's JSON
+        s3_object_key : str
+            Key the notebook is published to
+        digest : str
+            The notebook's :func:`~bookstore.json_body.content_digest`
+
+        Returns
+        --------
+        dict
+            S3 PutObject or CompleteMultipartUpload response object, or the
+            HeadObject response of the published object if it is unchanged
+        """
+        unchanged = await self._published_unchanged(s3_object_key, digest)
+        if unchanged is not None:
+            return unchanged
+
+        body, content_encoding = await ioloop.IOLoop.current().run_in_executor(
+            None, compress, content_json, self.bookstore_settings.compression
+        )
+        return await self._upload(body, content_encoding, s3_object_key, digest)
+
+    def conditional(self):
+        """Whether publishing skips notebooks identical to the published ones."""
+        return (
+            self.bookstore_settings.publish_skip_unchanged
+            or self.request.headers.get("If-None-Match") is not None
+        )
+
+    async def _published_unchanged(self, s3_object_key, digest):
+        """Check whether the notebook published at a key is the one about to be published.
+
+        Only checked for conditional requests, see :meth:`conditional`. A
+        known different digest answers without a request to S3; otherwise
+        the published object's metadata is read.
+
+        Returns
+        --------
+        dict or None
+            The S3 HeadObject response of the published object, marked
+            ``NotModified``, if it is unchanged, else None
+        """
+        if not self.conditional():
+            return None
+        tags = parse_if_none_match(self.request.headers.get("If-None-Match"))
+        if tags is not None and "*" not in tags and digest not in tags:
+            return None
+        known = self.published_digests.get(s3_object_key)
+        if known is not None and known != digest:
+            return None
+
+        client = await self.client_manager.get_client()
+        try:
+            obj = await self.client_manager.retry.call(
+                client.head_object, Bucket=self.bookstore_settings.s3_bucket, Key=s3_object_key
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                self.log.warning(f"Could not read published {s3_object_key}: {e}")
+            return None
+        except CircuitOpenError as e:
+            raise web.HTTPError(503, str(e))
+
+        published_digest = obj.get("Metadata", {}).get(DIGEST_METADATA_KEY)
+        if published_digest is not None:
+            self.published_digests.put(s3_object_key, published_digest)
+        if published_digest != digest:
+            return None
+        self.log.info(f"Published {s3_object_key} is unchanged, skipping upload")
+        self.metrics.inc("bookstore_publish_unchanged_total")
+        return {**obj, "NotModified": True}
+
+    async def _upload(self, body, content_encoding, s3_object_key, digest):
+        """Upload a serialized notebook to the path, mapping S3 errors to HTTP errors.
+
+        Parameters
+        ----------
+        body : bytes or bookstore.s3_upload.FileBody
+            The notebook as stored
+        content_encoding : str or None
+            The body's ``Content-Encoding``, when compressed
+        s3_object_key : str
+            Key the notebook is published to
+        digest : str
+            The notebook's :func:`~bookstore.json_body.content_digest`, stored
+            in the object's metadata
+
         Returns
         --------
         dict
-            S3 PutObject response object
+            S3 PutObject or CompleteMultipartUpload response object
         """
+        s3_kwargs = {
+            "Bucket": self.bookstore_settings.s3_bucket,
+            "Key": s3_object_key,
+            "Body": body,
+            "Metadata": {DIGEST_METADATA_KEY: digest},
+        }
+        if content_encoding is not None:
+            s3_kwargs["ContentEncoding"] = content_encoding
 
-        async with self.session.create_client(
-            's3',
-            aws_secret_access_key=self.bookstore_settings.s3_secret_access_key,
-            aws_access_key_id=self.bookstore_settings.s3_access_key_id,
-            endpoint_url=self.bookstore_settings.s3_endpoint_url,
-            region_name=self.bookstore_settings.s3_region_name,
-        ) as client:
-            self.log.info(f"Processing published write to {s3_object_key}")
-            try:
-                obj = await client.put_object(
-                    Bucket=self.bookstore_settings.s3_bucket,
-                    Key=s3_object_key,
-                    Body=json.dumps(content),
-                )
-            except ClientError as e:
-                status_code = e.response['ResponseMetadata'].get('HTTPStatusCode')
-                raise web.HTTPError(status_code, e.args[0])
-            self.log.info(f"Done with published write to {s3_object_key}")
+        client = await self.client_manager.get_client()
+        self.log.info(f"Processing published write to {s3_object_key}")
+        try:
+            obj = await upload_object(
+                client, self.bookstore_settings, retry=self.client_manager.retry, **s3_kwargs
+            )
+        except ClientError as e:
+            status_code = e.response['ResponseMetadata'].get('HTTPStatusCode')
+            raise web.HTTPError(status_code, e.args[0])
+        except CircuitOpenError as e:
+            raise web.HTTPError(503, str(e))
+        self.published_digests.put(s3_object_key, digest)
+        self.log.info(f"Done with published write to {s3_object_key}")
 
         return obj
 
-    def prepare_response(self, obj, full_s3_path):
+    def prepare_response(self, obj, full_s3_path, digest=None):
         """Prepares repsonse to publish PUT request.
 
         Parameters
@@ -130,6 +361,8 @@ class BookstorePublishAPIHandler(APIHandler):
             Validation dictionary for determining which endpoints to enable.
         path: 
             path to place after the published prefix in the designated bucket
+        digest: str, optional
+            The published notebook's :func:`~bookstore.json_body.content_digest`
 
         Returns
         --------
@@ -141,5 +374,347 @@ class BookstorePublishAPIHandler(APIHandler):
 
         if 'VersionId' in obj:
             resp_content["versionID"] = obj['VersionId']
+        if digest is not None:
+            resp_content["sha256"] = digest
+        if obj.get('NotModified'):
+            resp_content["not_modified"] = True
 
         return resp_content
+
+
+@web.stream_request_body
+class BookstoreStreamPublishAPIHandler(BookstorePublishAPIHandler):
+    """Publish a notebook streamed in the request body to the publish path.
+
+    The request body is the notebook itself rather than a contents model.
+    It is written to a temporary file as it arrives, validated once complete
+    and uploaded from the file a part at a time, so large notebooks are
+    neither buffered in memory by the server nor serialized again. The file
+    is only written, read and closed on worker threads or once they are done
+    with it, never blocking the event loop.
+    """
+
+    metrics_endpoint = "publish-stream"
+
+    # bytes received before they are written to the spooled body together
+    spool_write_bytes = 1024 * 1024
+
+    def initialize(self):
+        super().initialize()
+        self.spool_file = None
+        self.received_bytes = 0
+        self.digest = None
+        self.pending_chunks = []
+        self.pending_bytes = 0
+        # the latest write of received chunks to the spooled body, on the executor
+        self.spool_write = None
+        # set once publishing starts, after which put closes the spooled body
+        self.publishing = False
+
+    @web.authenticated
+    def prepare(self):
+        """Check the path and start spooling the body, before any of it is received."""
+        super().prepare()
+        if self.path_kwargs.get('path', '').strip('/') == '':
+            raise web.HTTPError(400, "Must provide a path for publishing")
+        self.request.connection.set_max_body_size(self.bookstore_settings.stream_publish_max_bytes)
+        self.spool_file = tempfile.TemporaryFile()
+
+    async def data_received(self, chunk):
+        self.received_bytes += len(chunk)
+        self.pending_chunks.append(chunk)
+        self.pending_bytes += len(chunk)
+        if self.pending_bytes >= self.spool_write_bytes:
+            # tornado waits for the write before delivering more of the body
+            await self.write_pending()
+
+    async def write_pending(self):
+        """Write the chunks received since the last write to the spooled body, on the executor."""
+        data = b"".join(self.pending_chunks)
+        self.pending_chunks = []
+        self.pending_bytes = 0
+        if not data or self.spool_file is None:
+            return
+        self.spool_write = ioloop.IOLoop.current().run_in_executor(
+            None, self.spool_file.write, data
+        )
+        await self.spool_write
+
+    def request_body_size(self):
+        return self.received_bytes
+
+    async def put(self, path):
+        """Publish the notebook streamed in the request body on a given path.
+
+        PUT /api/bookstore/publish-stream
+
+        Unchanged notebooks are skipped as for ``/api/bookstore/publish``.
+
+        Parameters
+        ----------
+        path: str
+            Path describing where contents should be published to, postfixed to the published_prefix .
+        """
+        if self.spool_file is None:
+            # the connection closed before publishing started
+            return
+        self.publishing = True
+        try:
+            await self.publish_spooled(path)
+        finally:
+            self.close_spool()
+
+    async def publish_spooled(self, path):
+        """Validate and publish the spooled body on a given path."""
+        path = path.lstrip('/')
+        s3_object_key = s3_key(self.bookstore_settings.published_prefix, path)
+
+        await self.write_pending()
+        await ioloop.IOLoop.current().run_in_executor(None, self.validate_spooled)
+
+        full_s3_path = s3_display_path(
+            self.bookstore_settings.s3_bucket, self.bookstore_settings.published_prefix, path
+        )
+        self.log.info(f"Publishing {self.received_bytes} streamed bytes to {full_s3_path}")
+
+        digest = self.digest
+        obj = await self._published_unchanged(s3_object_key, digest)
+        if obj is None:
+            obj = await self._upload_spooled(s3_object_key, digest)
+        resp_content = self.prepare_response(obj, full_s3_path, digest)
+
+        self.set_status(obj['ResponseMetadata']['HTTPStatusCode'])
+        self.set_header("ETag", f'"{digest}"')
+        self.finish(json.dumps(resp_content))
+
+    async def _upload_spooled(self, s3_object_key, digest):
+        """Upload the spooled body, compressed into another temporary file if configured."""
+        body_file = self.spool_file
+        content_encoding = None
+        if self.bookstore_settings.compression != "none":
+            body_file = tempfile.TemporaryFile()
+            self.spool_file.seek(0)
+            try:
+                content_encoding = await ioloop.IOLoop.current().run_in_executor(
+                    None,
+                    compress_file,
+                    self.spool_file,
+                    body_file,
+                    self.bookstore_settings.compression,
+                )
+                body_file.flush()
+            except BaseException:
+                body_file.close()
+                raise
+            # the compressed copy is uploaded, so the spooled body can go
+            self.spool_file.close()
+            self.spool_file = body_file
+
+        return await self._upload(FileBody(body_file), content_encoding, s3_object_key, digest)
+
+    def validate_spooled(self):
+        """Check that the spooled body is a valid notebook and compute its digest.
+
+        If validation repairs the notebook, e.g. giving its cells unique ids,
+        the spooled body is replaced by the repaired notebook.
+
+        Raises
+        ------
+        tornado.web.HTTPError
+            The body is empty, is not JSON or is not a valid notebook
+        """
+        if self.received_bytes == 0:
+            raise web.HTTPError(400, "Bookstore cannot publish an empty model")
+        self.spool_file.flush()
+        self.spool_file.seek(0)
+        try:
+            content = json.load(self.spool_file)
+        except ValueError as e:
+            raise web.HTTPError(400, f"Bookstore cannot publish a body that is not JSON: {e}")
+        if self.validate_model({"type": "notebook", "content": content}):
+            repaired = encode(content)
+            self.spool_file.seek(0)
+            self.spool_file.truncate()
+            self.spool_file.write(repaired)
+            self.spool_file.flush()
+        self.digest = content_digest(content)
+
+    def on_finish(self):
+        self.close_spool()
+        super().on_finish()
+
+    def on_connection_close(self):
+        # once publishing, the spooled body may be in use on the executor until put closes it
+        if not self.publishing:
+            self.close_spool()
+        super().on_connection_close()
+
+    def close_spool(self):
+        """Close the spooled body, once a write of it in progress on the executor is done."""
+        spool_file, self.spool_file = self.spool_file, None
+        if spool_file is None:
+            return
+        if self.spool_write is not None and not self.spool_write.done():
+            self.spool_write.add_done_callback(lambda _: spool_file.close())
+        else:
+            spool_file.close()
+
+
+class BookstoreBatchPublishAPIHandler(BookstorePublishAPIHandler):
+    """Publish many notebooks in one request.
+
+    Each item of the batch names the path to publish to and either carries
+    the notebook or names a notebook in the contents manager. Items are
+    validated and uploaded concurrently, at most ``publish_batch_concurrency``
+    at a time, sharing the S3 client, and each gets its own result: a failed
+    item does not fail the others.
+    """
+
+    SUPPORTED_METHODS = ("POST",)
+
+    metrics_endpoint = "publish-batch"
+
+    @web.authenticated
+    async def post(self):
+        """Publish a batch of notebooks.
+
+        POST /api/bookstore/publish-batch
+
+        The payload type for the request should be::
+
+            {
+            "items": [
+                {"path": string, "content": notebook},
+                {"path": string, "contents_path": string},
+                ...
+            ]
+            }
+
+        Unchanged notebooks are skipped as for ``/api/bookstore/publish``,
+        with an ``If-None-Match`` header applying to every item.
+
+        The response lists a result per item, in the order of the request::
+
+            {
+            "results": [
+                {
+                    "path": string,
+                    "status": int,
+                    "s3_path": string,
+                    "versionID": string,
+                    "sha256": string,
+                    "not_modified": bool  # only when unchanged
+                },
+                {"path": string, "status": int, "error": string},
+                ...
+            ]
+            }
+        """
+        batch, _ = self.parse_body()
+        items = batch.get("items") if isinstance(batch, dict) else None
+        if not isinstance(items, list) or not items:
+            raise web.HTTPError(400, "Must provide a list of items to publish")
+        max_items = self.bookstore_settings.publish_batch_max_items
+        if len(items) > max_items:
+            raise web.HTTPError(413, f"Bookstore publishes at most {max_items} items per batch")
+
+        semaphore = asyncio.Semaphore(max(1, self.bookstore_settings.publish_batch_concurrency))
+        seen_paths = set()
+
+        async def publish(item):
+            async with semaphore:
+                return await self.publish_item(item)
+
+        tasks = []
+        for item in items:
+            path = self.item_path(item)
+            if path is not None and path in seen_paths:
+                tasks.append(self.item_error(path, 400, "Path appears more than once in the batch"))
+            else:
+                seen_paths.add(path)
+                tasks.append(publish(item))
+        results = await asyncio.gather(*tasks)
+        self.log.info(
+            f"Published {sum(result['status'] == 200 for result in results)} "
+            f"of {len(results)} notebooks in a batch"
+        )
+
+        self.set_status(200)
+        self.finish(json.dumps({"results": results}))
+
+    def item_path(self, item):
+        """The path an item is published to, or None if it has none."""
+        if not isinstance(item, dict):
+            return None
+        path = item.get("path")
+        if not isinstance(path, str) or path.strip('/') == '':
+            return None
+        return path.lstrip('/')
+
+    async def item_error(self, path, status_code, message):
+        """Result of an item that could not be published."""
+        self.metrics.inc("bookstore_publish_batch_items_total", status=status_code)
+        return {"path": path, "status": status_code, "error": message}
+
+    async def publish_item(self, item):
+        """Validate and publish one item of a batch.
+
+        Parameters
+        ----------
+        item : dict
+            The path to publish to and either the notebook's ``content`` or
+            the ``contents_path`` of a notebook in the contents manager
+
+        Returns
+        --------
+        dict
+            The item's result: its path, an HTTP status and either the
+            published ``s3_path`` and ``versionID`` or an ``error``
+        """
+        path = self.item_path(item)
+        try:
+            if path is None:
+                raise web.HTTPError(400, "Must provide a path for publishing")
+            model = self.item_model(item)
+            # the size of an item's notebook is not known before it is encoded, so
+            # items are all validated, then encoded as validation left them, on the
+            # executor; concurrent items would otherwise take turns on the event loop
+            content_json, digest = await ioloop.IOLoop.current().run_in_executor(
+                None, self.validated_json, model
+            )
+
+            full_s3_path = s3_display_path(
+                self.bookstore_settings.s3_bucket, self.bookstore_settings.published_prefix, path
+            )
+            self.log.info(f"Publishing to {full_s3_path}")
+            s3_object_key = s3_key(self.bookstore_settings.published_prefix, path)
+            obj = await self._publish(content_json, s3_object_key, digest)
+        except web.HTTPError as e:
+            return await self.item_error(path, e.status_code, e.log_message)
+        except Exception:
+            self.log.error(f"Failed to publish {path}", exc_info=True)
+            return await self.item_error(path, 500, "Internal error while publishing")
+
+        status_code = obj['ResponseMetadata']['HTTPStatusCode']
+        self.metrics.inc("bookstore_publish_batch_items_total", status=status_code)
+        resp_content = self.prepare_response(obj, full_s3_path, digest)
+        return {"path": path, "status": status_code, **resp_content}
+
+    def item_model(self, item):
+        """The contents model of an item, read from the contents manager if it names a notebook.
+
+        Raises
+        ------
+        tornado.web.HTTPError
+            The item has both or neither of ``content`` and ``contents_path``,
+            or its ``contents_path`` cannot be read
+        """
+        if ("content" in item) == ("contents_path" in item):
+            raise web.HTTPError(400, "Must provide one of content or contents_path")
+        if "content" in item:
+            return {"type": "notebook", "content": item["content"]}
+        contents_path = item["contents_path"]
+        if not isinstance(contents_path, str):
+            raise web.HTTPError(400, "contents_path must be a string")
+        # on the event loop: the contents manager's notary is bound to its thread
+        return self.contents_manager.get(contents_path, content=True)
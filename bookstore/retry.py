@@ -0,0 +1,236 @@
+"""Retrying S3 operations with backoff, guarded by a circuit breaker."""
+import asyncio
+import random
+import time
+from collections import deque
+
+import aiohttp
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.exceptions import HTTPClientError
+
+from .limiter import AdaptiveLimiter
+
+# S3 error codes signalling throttling or a transient server-side failure
+RETRYABLE_ERROR_CODES = frozenset(
+    [
+        "SlowDown",
+        "Throttling",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+        "TooManyRequestsException",
+        "RequestTimeout",
+        "RequestTimeoutException",
+        "InternalError",
+        "ServiceUnavailable",
+    ]
+)
+
+# Exceptions raised when S3 could not be reached or the connection dropped
+CONNECTION_ERRORS = (
+    BotocoreConnectionError,
+    HTTPClientError,
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling S3 while the circuit breaker is open."""
+
+
+def is_retryable(error):
+    """Whether an error from S3 is transient: throttling, a 5xx or a connection failure.
+
+    Parameters
+    ----------
+    error : Exception
+        The error raised by an S3 operation
+
+    Returns
+    --------
+    bool
+        True if the operation may succeed when retried
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return code in RETRYABLE_ERROR_CODES or status == 429 or status >= 500
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+class CircuitBreaker:
+    """Stops calling S3 while the recent error rate is too high.
+
+    The breaker tracks the outcomes of the last ``window`` calls. Once at
+    least ``min_calls`` have been recorded and the share of failures reaches
+    ``failure_rate``, the breaker *opens* and calls fail fast for
+    ``reset_timeout`` seconds. A single trial call is then let through: its
+    success closes the breaker, its failure opens it again.
+
+    Attributes
+    ----------
+    failure_rate : float
+        Share of failed calls at and above which the breaker opens.
+    min_calls : int
+        Number of calls in the window before the breaker may open.
+    window : int
+        Number of recent calls considered.
+    reset_timeout : float
+        Seconds the breaker stays open before letting a trial call through.
+    """
+
+    def __init__(self, failure_rate=0.5, min_calls=20, window=50, reset_timeout=30.0, clock=None):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.clock = clock or time.monotonic
+
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self):
+        """``"closed"``, ``"open"`` or ``"half-open"``."""
+        if self._opened_at is None:
+            return "closed"
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Whether a call may go ahead now."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        """Record a call that reached S3 and did not fail transiently."""
+        if self._opened_at is not None:
+            self._opened_at = None
+            self._outcomes.clear()
+        self._trial_in_progress = False
+        self._outcomes.append(True)
+
+    def abandon(self):
+        """Forget a call that ended without an outcome, e.g. because it was cancelled."""
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        """Record a call that failed transiently, opening the breaker if needed."""
+        self._trial_in_progress = False
+        if self._opened_at is not None:
+            # the trial call failed
+            self._opened_at = self.clock()
+            return
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if (
+            len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_rate
+        ):
+            self._opened_at = self.clock()
+
+
+class RetryPolicy:
+    """Retries transient S3 failures with exponential backoff and full jitter.
+
+    Attributes
+    ----------
+    max_attempts : int
+        Maximum number of attempts, including the first.
+    base_delay : float
+        Upper bound, in seconds, of the delay before the first retry.
+    max_delay : float
+        Upper bound, in seconds, of the delay before any retry.
+    breaker : CircuitBreaker or None
+        Breaker consulted before, and informed after, every attempt.
+    limiter : bookstore.limiter.AdaptiveLimiter or None
+        Limiter every attempt runs under.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=0.1, max_delay=5.0, breaker=None, limiter=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.limiter = limiter
+
+    @classmethod
+    def from_settings(cls, settings, metrics=None):
+        """Build a policy, its circuit breaker and its concurrency limiter from bookstore settings.
+
+        Parameters
+        ----------
+        settings : bookstore.bookstore_config.BookstoreSettings
+            Settings for retries, the breaker and the limiter
+        metrics : bookstore.metrics.BookstoreMetrics, optional
+            Where the limiter reports its limit
+        """
+        limiter = None
+        if settings.s3_adaptive_concurrency:
+            limiter = AdaptiveLimiter.from_settings(settings, metrics=metrics)
+        breaker = CircuitBreaker(
+            failure_rate=settings.s3_breaker_failure_rate,
+            min_calls=settings.s3_breaker_min_calls,
+            window=settings.s3_breaker_window,
+            reset_timeout=settings.s3_breaker_reset_timeout,
+        )
+        return cls(
+            max_attempts=settings.s3_retry_max_attempts,
+            base_delay=settings.s3_retry_base_delay,
+            max_delay=settings.s3_retry_max_delay,
+            breaker=breaker,
+            limiter=limiter,
+        )
+
+    def backoff(self, attempt):
+        """Seconds to wait before retrying after the given (1-based) failed attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, operation, *args, **kwargs):
+        """Await ``operation(*args, **kwargs)``, retrying transient failures.
+
+        Raises
+        ------
+        CircuitOpenError
+            The circuit breaker is open
+        Exception
+            The last error from the operation, when it is not transient or
+            attempts are exhausted
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError("S3 circuit breaker is open, not calling S3")
+            try:
+                if self.limiter is not None:
+                    result = await self.limiter.run(operation, *args, **kwargs)
+                else:
+                    result = await operation(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if self.breaker is not None:
+                    if retryable:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                if not retryable or attempt >= self.max_attempts:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            except BaseException:
+                if self.breaker is not None:
+                    self.breaker.abandon()
+                raise
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
@@ -0,0 +1,129 @@
+"""Shared, long-lived S3 client management."""
+from asyncio import Lock
+
+import aiobotocore
+from aiobotocore.config import AioConfig
+
+from .bookstore_config import BookstoreSettings
+from .metrics import instrument_s3_client
+from .retry import RetryPolicy
+
+# Key under which the web application's settings hold the shared client manager
+CLIENT_MANAGER_KEY = "bookstore_client_manager"
+
+
+class S3ClientManager:
+    """Owns a single connection-pooled S3 client shared across bookstore.
+
+    Creating an S3 client pays for credential resolution, botocore client
+    construction and a fresh TLS handshake. The manager builds the client
+    once, on first use, and keeps its connections alive so every archive,
+    publish and clone reuses the same pool.
+
+    Attributes
+    ----------
+    settings : bookstore.bookstore_config.BookstoreSettings
+        Settings used for S3 authentication and pool sizing.
+    session : aiobotocore.AioSession
+        Session from which the client is created.
+    metrics : bookstore.metrics.BookstoreMetrics or None
+        Where the client's operations are recorded, if anywhere.
+    retry : bookstore.retry.RetryPolicy
+        Retry policy, circuit breaker and adaptive concurrency limiter shared
+        by every user of the client.
+    """
+
+    def __init__(self, settings: BookstoreSettings, session=None, metrics=None):
+        self.settings = settings
+        self.session = session or aiobotocore.get_session()
+        self.metrics = metrics
+        self.retry = RetryPolicy.from_settings(settings, metrics=metrics)
+
+        self._client = None
+        self._client_context = None
+        self._client_lock = None
+
+    def build_client_config(self):
+        """Helper that sizes the connection pool from ``max_threads``.
+
+        botocore's own retries are disabled, bookstore retries operations
+        through :attr:`retry` instead.
+
+        Returns
+        --------
+        aiobotocore.config.AioConfig
+            Client configuration with a keep-alive connection pool.
+        """
+        return AioConfig(
+            max_pool_connections=self.settings.max_threads, retries={"max_attempts": 0}
+        )
+
+    async def get_client(self):
+        """Retrieve the shared S3 client, creating it on first use.
+
+        Returns
+        --------
+        aiobotocore.client.AioBaseClient
+            The long-lived S3 client.
+        """
+        if self._client is not None:
+            return self._client
+
+        if self._client_lock is None:
+            self._client_lock = Lock()
+
+        async with self._client_lock:
+            if self._client is None:
+                context = self.session.create_client(
+                    's3',
+                    aws_secret_access_key=self.settings.s3_secret_access_key,
+                    aws_access_key_id=self.settings.s3_access_key_id,
+                    endpoint_url=self.settings.s3_endpoint_url,
+                    region_name=self.settings.s3_region_name,
+                    config=self.build_client_config(),
+                )
+                client = await context.__aenter__()
+                if self.metrics is not None:
+                    instrument_s3_client(client, self.metrics)
+                self._client = client
+                self._client_context = context
+        return self._client
+
+    async def close(self):
+        """Close the shared client and release its pooled connections."""
+        context = self._client_context
+        self._client = None
+        self._client_context = None
+        if context is not None:
+            await context.__aexit__(None, None, None)
+
+    @property
+    def closed(self):
+        """Whether no client is currently open."""
+        return self._client is None
+
+
+def get_client_manager(app_settings, bookstore_settings):
+    """Retrieve the shared client manager from the web application's settings.
+
+    ``load_jupyter_server_extension`` registers a manager for the whole
+    process. When none is registered (e.g. a handler used outside the
+    extension) one is created and stored so later requests reuse it.
+
+    Parameters
+    ----------
+    app_settings : dict
+        The tornado web application's settings.
+    bookstore_settings : bookstore.bookstore_config.BookstoreSettings
+        Settings used if a new manager must be created.
+
+    Returns
+    --------
+    S3ClientManager
+        The shared client manager.
+    """
+    manager = app_settings.get(CLIENT_MANAGER_KEY)
+    if manager is None:
+        manager = S3ClientManager(bookstore_settings)
+        app_settings[CLIENT_MANAGER_KEY] = manager
+    return manager
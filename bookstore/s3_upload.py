@@ -0,0 +1,172 @@
+"""Uploading objects to S3, with multipart uploads for large bodies"""
+import asyncio
+import os
+from contextlib import suppress
+
+from .bookstore_config import BookstoreSettings
+
+
+class FileBody:
+    """An open file uploaded from disk a part at a time, never held in memory whole.
+
+    Parts are read at explicit offsets, so a body can be re-read when an
+    upload is retried.
+
+    Attributes
+    ----------
+    file : file object
+      The open file, in binary mode
+    size : int
+      Size of the file in bytes
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+
+    def __len__(self):
+        return self.size
+
+    def read(self, offset, size):
+        """Read up to ``size`` bytes starting at ``offset``."""
+        return os.pread(self.file.fileno(), size, offset)
+
+    def close(self):
+        self.file.close()
+
+
+async def _read(Body, offset, size):
+    """Read a slice of a body, reading files off the event loop."""
+    if isinstance(Body, FileBody):
+        return await asyncio.get_event_loop().run_in_executor(None, Body.read, offset, size)
+    return Body[offset : offset + size]
+
+
+async def _call(retry, operation, **kwargs):
+    """Make one S3 request, retried by a retry policy if one is given."""
+    if retry is None:
+        return await operation(**kwargs)
+    return await retry.call(operation, **kwargs)
+
+
+async def upload_object(
+    client, settings: BookstoreSettings, Bucket, Key, Body, retry=None, **kwargs
+):
+    """Upload an object, switching to a multipart upload above the configured threshold.
+
+    Every S3 request of the upload is retried on its own by ``retry``, so a
+    transient failure of one part does not restart a multipart upload.
+
+    Parameters
+    ----------
+    client : aiobotocore.client.AioBaseClient
+      S3 client used for the upload
+    settings : bookstore.bookstore_config.BookstoreSettings
+      Settings providing the multipart threshold, part size and concurrency
+    Bucket : str
+      Destination bucket
+    Key : str
+      Destination key
+    Body : bytes or FileBody
+      The object body
+    retry : bookstore.retry.RetryPolicy, optional
+      Policy each S3 request is made through. Default is None, which makes
+      every request once.
+    **kwargs
+      Additional arguments for ``put_object`` / ``create_multipart_upload``
+      (e.g. ``ContentEncoding``)
+
+    Returns
+    --------
+    dict
+      S3 PutObject or CompleteMultipartUpload response object
+    """
+    if isinstance(Body, str):
+        Body = Body.encode('utf-8')
+
+    if len(Body) < settings.multipart_threshold:
+        if isinstance(Body, FileBody):
+            Body = await _read(Body, 0, len(Body))
+        return await _call(retry, client.put_object, Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+
+    return await multipart_upload(
+        client,
+        Bucket,
+        Key,
+        Body,
+        part_size=settings.multipart_part_size,
+        concurrency=settings.multipart_concurrency,
+        retry=retry,
+        **kwargs,
+    )
+
+
+async def multipart_upload(client, Bucket, Key, Body, part_size, concurrency, retry=None, **kwargs):
+    """Upload an object in parts, uploading up to ``concurrency`` parts at a time.
+
+    Each part, and the completion of the upload, is retried on its own by
+    ``retry``. The upload is aborted once a part fails for good so S3 does
+    not keep the incomplete parts around.
+
+    Parameters
+    ----------
+    client : aiobotocore.client.AioBaseClient
+      S3 client used for the upload
+    Bucket : str
+      Destination bucket
+    Key : str
+      Destination key
+    Body : bytes or FileBody
+      The object body
+    part_size : int
+      Size in bytes of every part but the last
+    concurrency : int
+      Maximum number of parts uploaded at once
+    retry : bookstore.retry.RetryPolicy, optional
+      Policy each S3 request is made through. Default is None, which makes
+      every request once.
+    **kwargs
+      Additional arguments for ``create_multipart_upload``
+
+    Returns
+    --------
+    dict
+      S3 CompleteMultipartUpload response object
+    """
+    upload = await _call(retry, client.create_multipart_upload, Bucket=Bucket, Key=Key, **kwargs)
+    upload_id = upload['UploadId']
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def upload_part(part_number, offset):
+        async with semaphore:
+            part = await _call(
+                retry,
+                client.upload_part,
+                Bucket=Bucket,
+                Key=Key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=await _read(Body, offset, part_size),
+            )
+        return {"PartNumber": part_number, "ETag": part["ETag"]}
+
+    tasks = [
+        asyncio.ensure_future(upload_part(part_number, offset))
+        for part_number, offset in enumerate(range(0, len(Body), part_size), start=1)
+    ]
+    try:
+        parts = await asyncio.gather(*tasks)
+        return await _call(
+            retry,
+            client.complete_multipart_upload,
+            Bucket=Bucket,
+            Key=Key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        with suppress(Exception):
+            await client.abort_multipart_upload(Bucket=Bucket, Key=Key, UploadId=upload_id)
+        raise
@@ -0,0 +1,200 @@
+"""Durable local spool of archive records waiting to be written to storage."""
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import suppress
+from hashlib import sha1
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+class ArchiveSpool:
+    """Append-only directory of archive records, written before uploading to S3.
+
+    Every record is written to its own entry file, named so that listing the
+    directory yields records in the order they were spooled, next to a body
+    file holding the serialized notebook. A record's files are removed once
+    that record, or a newer record for the same path, has been written to
+    storage; files left behind (e.g. by a crash or an S3 outage) are replayed
+    when the archiver starts.
+
+    Attributes
+    ----------
+    directory : str
+        Directory holding spooled records.
+    max_bytes : int
+        Records are not spooled once the spool holds this many bytes.
+    fsync : bool
+        Whether records are flushed to disk before being considered spooled.
+    size : int
+        Bytes currently held in the spool.
+    """
+
+    def __init__(self, directory, max_bytes, fsync=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+
+        os.makedirs(directory, exist_ok=True)
+
+        # breaks ties between records spooled within the same microsecond
+        self._counter = itertools.count()
+        # records are spooled from the archiver's executor threads
+        self._lock = threading.Lock()
+        self._entries_by_path: Dict[str, List[str]] = {}
+        self.size = 0
+        entries = set(self.entries())
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if path in entries or path[: -len('.body')] + '.json' in entries:
+                self.size += os.path.getsize(path)
+            elif name.endswith(('.body', '.tmp')):
+                # left behind by a crash while spooling, before the record was spooled
+                with suppress(OSError):
+                    os.remove(path)
+
+    def entries(self):
+        """List spooled entries, oldest first."""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    @staticmethod
+    def body_path(entry):
+        """The file holding the serialized notebook of a spooled entry."""
+        return entry[: -len('.json')] + '.body'
+
+    def write(self, filepath, queued_time, body=None, source_path=None) -> Optional[str]:
+        """Durably spool an archive record.
+
+        Parameters
+        ----------
+        filepath : str
+            The record's storage location
+        queued_time : float
+            When the record was queued
+        body : bytes, optional
+            The serialized notebook
+        source_path : str, optional
+            A saved file copied as the serialized notebook, for records without a body
+
+        Returns
+        --------
+        str or None
+            The spooled entry, or None when the spool is full
+        """
+        data = json.dumps({"filepath": filepath, "queued_time": queued_time}).encode('utf-8')
+        body_size = len(body) if body is not None else os.path.getsize(source_path)
+        size = len(data) + body_size
+
+        with self._lock:
+            if self.size + size > self.max_bytes:
+                return None
+            self.size += size
+            timestamp = int(time.time() * 1e6)
+            count = next(self._counter) % 1000000
+
+        path_hash = sha1(filepath.encode('utf-8')).hexdigest()[:16]
+        name = f"{timestamp:020d}-{count:06d}-{path_hash}.json"
+        entry = os.path.join(self.directory, name)
+        body_path = self.body_path(entry)
+        try:
+            # the body goes first, so a spooled entry always has its body
+            if body is not None:
+                with open(body_path + '.tmp', 'wb') as f:
+                    f.write(body)
+            else:
+                shutil.copyfile(source_path, body_path + '.tmp')
+                copied_size = os.path.getsize(body_path + '.tmp')
+                with self._lock:
+                    # the saved file may have changed since it was measured
+                    self.size += copied_size - body_size
+                size += copied_size - body_size
+            self._commit(body_path)
+            with open(entry + '.tmp', 'wb') as f:
+                f.write(data)
+            self._commit(entry)
+        except OSError:
+            with self._lock:
+                self.size -= size
+            for path in (body_path + '.tmp', body_path, entry + '.tmp'):
+                with suppress(OSError):
+                    os.remove(path)
+            raise
+        if self.fsync:
+            self._fsync_directory()
+
+        with self._lock:
+            self._entries_by_path.setdefault(filepath, []).append(entry)
+        return entry
+
+    def _commit(self, path):
+        """Move a fully written temporary file into place, flushing it to disk first."""
+        if self.fsync:
+            with open(path + '.tmp', 'rb') as f:
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def read(self, entry):
+        """Read a spooled entry.
+
+        Returns
+        --------
+        dict
+            The spooled ``filepath`` and ``queued_time``; the serialized
+            notebook is in the entry's :meth:`body_path`
+        """
+        with open(entry, 'rb') as f:
+            record = json.loads(f.read().decode('utf-8'))
+        with self._lock:
+            self._entries_by_path.setdefault(record["filepath"], []).append(entry)
+        return record
+
+    def contains(self, entry):
+        """Whether an entry is still spooled, i.e. not yet superseded or archived."""
+        return os.path.exists(entry)
+
+    def remove_through(self, filepath, entry):
+        """Remove an archived entry along with every older entry for the same path.
+
+        Parameters
+        ----------
+        filepath : str
+            The storage location the entry was archived to
+        entry : str
+            The archived entry
+        """
+        with self._lock:
+            entries = self._entries_by_path.get(filepath, [])
+            removed = [e for e in entries if e <= entry]
+            remaining = [e for e in entries if e > entry]
+            if remaining:
+                self._entries_by_path[filepath] = remaining
+            else:
+                self._entries_by_path.pop(filepath, None)
+
+        for e in removed:
+            for path in (e, self.body_path(e)):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    self.size -= size
+
+    def _fsync_directory(self):
+        """Flush the directory so renamed entries survive a crash."""
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
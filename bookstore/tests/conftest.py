@@ -0,0 +1,150 @@
+"""Test doubles of bookstore's S3 access, shared by the test modules"""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+from traitlets.config import Config
+
+from bookstore.archive import BookstoreContentsArchiver
+from bookstore.retry import RetryPolicy
+
+LAST_MODIFIED = datetime(2019, 1, 1, tzinfo=timezone.utc)
+
+
+class MockBody:
+    def __init__(self, body):
+        self.body = body
+
+    async def read(self):
+        return self.body
+
+
+class MockS3Client:
+    """Keeps objects in memory and records the requests made to it.
+
+    Attributes
+    ----------
+    objects : dict
+        Dictionary of keys to object bodies.
+    params : dict
+        Dictionary of keys to the other arguments of the put that stored them,
+        such as ``ContentEncoding`` and ``Metadata``.
+    bodies : list
+        Bodies put outside of ``.bookstore/``, in order.
+    puts, heads, listings : int
+        Number of objects put, heads requested and listings started.
+    fail : bool
+        Whether puts fail with a server error.
+    release : asyncio.Event
+        Puts wait for it once the object is stored; clear it to pause them.
+    """
+
+    def __init__(self, objects=None):
+        self.objects = {} if objects is None else objects
+        self.params = {}
+        self.bodies = []
+        self.puts = 0
+        self.heads = 0
+        self.listings = 0
+        self.fail = False
+        self.release = asyncio.Event()
+        self.release.set()
+
+    def stored(self, Key):
+        """The body of an object and the other arguments of the put that stored it."""
+        return self.objects[Key], self.params.get(Key, {})
+
+    def _missing(self, Key, operation):
+        if Key not in self.objects:
+            raise ClientError(
+                {"Error": {"Code": "NoSuchKey"}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+                operation,
+            )
+
+    async def put_object(self, Bucket, Key, Body, **kwargs):
+        if self.fail:
+            raise ClientError({"Error": {"Code": "500"}}, "PutObject")
+        self.objects[Key] = Body
+        self.params[Key] = kwargs
+        self.puts += 1
+        if '.bookstore/' not in Key:
+            self.bodies.append(Body)
+        await self.release.wait()
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}, "VersionId": f"v{self.puts}"}
+
+    async def head_object(self, Bucket, Key, **kwargs):
+        self.heads += 1
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "VersionId": f"v{self.puts}",
+            "LastModified": LAST_MODIFIED,
+            "Metadata": self.params.get(Key, {}).get("Metadata", {}),
+        }
+
+    async def get_object(self, Bucket, Key, **kwargs):
+        self._missing(Key, "GetObject")
+        response = {
+            "Body": MockBody(self.objects[Key]),
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "LastModified": LAST_MODIFIED,
+        }
+        content_encoding = self.params.get(Key, {}).get("ContentEncoding")
+        if content_encoding is not None:
+            response["ContentEncoding"] = content_encoding
+        return response
+
+    async def copy_object(self, Bucket, Key, CopySource):
+        self._missing(CopySource["Key"], "CopyObject")
+        self.objects[Key] = self.objects[CopySource["Key"]]
+        self.params[Key] = self.params.get(CopySource["Key"], {})
+
+    async def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+        self.params.pop(Key, None)
+
+    async def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            await self.delete_object(Bucket, obj["Key"])
+        return {}
+
+    def get_paginator(self, operation):
+        self.listings += 1
+        objects = self.objects
+
+        class Paginator:
+            async def paginate(self, Bucket, Prefix):
+                yield {"Contents": [{"Key": key} for key in objects if key.startswith(Prefix)]}
+
+        return Paginator()
+
+
+class MockClientManager:
+    """Hands out one MockS3Client, retrying without delay."""
+
+    def __init__(self, client=None):
+        self.client = MockS3Client() if client is None else client
+        self.retry = RetryPolicy(base_delay=0)
+
+    async def get_client(self):
+        return self.client
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def mock_archiver():
+    """Factory of archivers with the given bookstore settings, archiving to a MockS3Client.
+
+    Returns the archiver and its client.
+    """
+
+    def factory(**settings):
+        archiver = BookstoreContentsArchiver(config=Config({"BookstoreSettings": settings}))
+        archiver.client_manager = MockClientManager()
+        return archiver, archiver.client_manager.client
+
+    return factory
@@ -1,11 +1,17 @@
 """Tests for archive"""
 import asyncio
+import gzip
+import hashlib
 import pytest
 import json
 import logging
+import nbformat
+import os
 
+from botocore.exceptions import ClientError
+from bookstore.archive import AUTOSAVE, BACKGROUND, EXPLICIT_SAVE
 from bookstore.archive import ArchiveRecord, BookstoreContentsArchiver
-from nbformat.v4 import new_notebook
+from nbformat.v4 import new_code_cell, new_notebook, new_output
 
 
 def test_create_contentsarchiver():
@@ -18,19 +24,20 @@ def test_create_contentsarchiver_invalid_args_count():
 
 
 @pytest.mark.asyncio
-async def test_archive_failure_on_no_lock():
-    archiver = BookstoreContentsArchiver()
-    assert archiver
+async def test_archive_failure_on_no_lock(mock_archiver):
+    archiver, client = mock_archiver()
+    client.fail = True
 
     record = ArchiveRecord('my_notebook_path.ipynb', json.dumps(new_notebook()), 100.2)
     assert record
 
     await archiver.archive(record)
+    assert client.bodies == []
 
 
 @pytest.mark.asyncio
-async def test_archive_abort_with_lock(caplog):
-    """Acquire a lock in advance so that when the archiver attempts to archive, it will abort."""
+async def test_archive_queued_with_lock(caplog):
+    """Acquire a lock in advance so that when the archiver attempts to archive, it will queue."""
 
     archiver = BookstoreContentsArchiver()
     record = ArchiveRecord('my_notebook_path.ipynb', json.dumps(new_notebook()), 100.2)
@@ -40,7 +47,36 @@ async def test_archive_abort_with_lock(caplog):
     async with lock:
         with caplog.at_level(logging.INFO):
             await archiver.archive(record)
-    assert 'Skipping archive of my_notebook_path.ipynb' in caplog.text
+    assert 'Queueing latest archive of my_notebook_path.ipynb' in caplog.text
+    assert archiver.pending_records['my_notebook_path.ipynb'] is record
+
+
+@pytest.mark.asyncio
+async def test_archive_coalesces_to_latest(mock_archiver):
+    """Saves arriving during an in-flight write collapse into one write of the newest content."""
+    archiver, client = mock_archiver()
+    client.release.clear()
+
+    first = asyncio.ensure_future(archiver.archive(ArchiveRecord('nb.ipynb', 'first', 1.0)))
+    while not client.bodies:
+        await asyncio.sleep(0.01)
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'second', 2.0))
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'third', 3.0))
+    assert client.bodies == [b'first']
+
+    client.release.set()
+    await first
+    assert client.bodies == [b'first', b'third']
+    assert archiver.pending_records == {}
+
+
+@pytest.mark.asyncio
+async def test_archive_path_locks_evicted_when_idle(mock_archiver):
+    archiver, client = mock_archiver()
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    assert client.bodies == [b'content']
+    assert 'nb.ipynb' not in archiver.path_locks
 
 
 def test_pre_save_hook():
@@ -57,3 +93,501 @@ def test_pre_save_hook_bad_model():
     target_path = "my_notebook_path.ipynb"
 
     archiver.run_pre_save_hook(model, target_path)
+
+
+@pytest.mark.asyncio
+async def test_archive_skips_unchanged_content(mock_archiver):
+    archiver, client = mock_archiver()
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 2.0))
+    assert client.bodies == [b'content']
+    assert archiver.skipped_uploads == 1
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'changed', 3.0))
+    assert client.bodies == [b'content', b'changed']
+
+
+@pytest.mark.asyncio
+async def test_archive_digests_persisted(tmp_path, mock_archiver):
+    digest_file = str(tmp_path / 'digests.json')
+    archiver, client = mock_archiver()
+    archiver.settings.archive_digest_file = digest_file
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    await archiver.archive(ArchiveRecord('other.ipynb', 'other', 1.0))
+    # persisted once for both archives, after a delay or on flush
+    assert archiver._digest_save_handle is not None
+    assert not os.path.exists(digest_file)
+    assert await archiver.flush(1) == []
+    assert archiver._digest_save_handle is None
+    with open(digest_file) as f:
+        assert list(json.load(f)["digests"]) == ['nb.ipynb', 'other.ipynb']
+
+    reloaded, reloaded_client = mock_archiver()
+    reloaded.settings.archive_digest_file = digest_file
+    reloaded.archived_digests = reloaded._load_digests()
+    await reloaded.archive(ArchiveRecord('nb.ipynb', 'content', 2.0))
+    assert reloaded_client.bodies == []
+    assert reloaded.skipped_uploads == 1
+
+
+@pytest.mark.asyncio
+async def test_archive_digests_discarded_for_another_archive(tmp_path, mock_archiver):
+    digest_file = str(tmp_path / 'digests.json')
+    archiver, client = mock_archiver(archive_digest_file=digest_file)
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    await archiver.flush(1)
+
+    for settings in [{"s3_bucket": "other-bucket"}, {"workspace_prefix": "other-workspace"}]:
+        other, other_client = mock_archiver(archive_digest_file=digest_file, **settings)
+        assert other.archived_digests == {}
+        await other.archive(ArchiveRecord('nb.ipynb', 'content', 2.0))
+        assert other_client.bodies == [b'content']
+
+    other, _ = mock_archiver(archive_digest_file=digest_file, archive_format="manifest")
+    assert other.archived_digests == {}
+    same, _ = mock_archiver(archive_digest_file=digest_file)
+    assert list(same.archived_digests) == ['nb.ipynb']
+
+
+@pytest.mark.asyncio
+async def test_archived_digests_bounded(mock_archiver):
+    archiver, client = mock_archiver()
+    archiver.max_archived_paths = 2
+    for name in ['a.ipynb', 'b.ipynb', 'c.ipynb']:
+        await archiver.archive(ArchiveRecord(name, name, 1.0))
+    await archiver.archive(ArchiveRecord('b.ipynb', 'changed', 2.0))
+
+    assert list(archiver.archived_digests) == ['c.ipynb', 'b.ipynb']
+    assert list(archiver.archived_sizes) == ['c.ipynb', 'b.ipynb']
+    assert archiver.archived_sizes['b.ipynb'] == len('changed')
+    # no digest file configured, so nothing is scheduled to persist them
+    assert archiver._digest_save_handle is None
+
+
+@pytest.mark.asyncio
+async def test_archive_serializes_notebook_dict(mock_archiver):
+    archiver, client = mock_archiver()
+    notebook = new_notebook()
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 1.0))
+    assert len(client.bodies) == 1
+    assert json.loads(client.bodies[0]) == notebook
+
+
+@pytest.mark.asyncio
+async def test_archive_compressed(mock_archiver):
+    archiver, client = mock_archiver()
+    archiver.settings.compression = "gzip"
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    assert gzip.decompress(client.bodies[0]) == b'content'
+
+
+@pytest.mark.asyncio
+async def test_archive_manifest_writes_blobs_once(mock_archiver):
+    archiver, client = mock_archiver()
+    archiver.settings.archive_format = "manifest"
+    archiver.settings.blob_threshold = 100
+    image = "iVBORw0KGgo" * 100
+    output = new_output("display_data", data={"image/png": image})
+    notebook = new_notebook(cells=[new_code_cell("plot()", outputs=[output])])
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 1.0))
+    blob_keys = [key for key in client.objects if key.startswith('workspace/.bookstore/blobs/')]
+    assert len(blob_keys) == 1
+    assert client.objects[blob_keys[0]] == image.encode('utf-8')
+    assert image not in client.bodies[0].decode('utf-8')
+    assert notebook["cells"][0]["outputs"][0]["data"]["image/png"] == image
+
+    notebook["cells"].append(new_code_cell("more()"))
+    client.objects.clear()
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 2.0))
+    assert list(client.objects) == ['workspace/nb.ipynb']
+
+
+@pytest.mark.asyncio
+async def test_archive_manifest_blobs_bounded_and_written_when_head_forbidden(mock_archiver):
+    archiver, client = mock_archiver()
+    archiver.settings.archive_format = "manifest"
+    archiver.settings.blob_threshold = 100
+    archiver.max_archived_blobs = 2
+
+    async def head_object(Bucket, Key, **kwargs):
+        raise ClientError({"Error": {"Code": "403"}}, "HeadObject")
+
+    client.head_object = head_object
+    images = ["iVBORw0KGgo" * 100 + str(i) for i in range(3)]
+    outputs = [new_output("display_data", data={"image/png": image}) for image in images]
+    notebook = new_notebook(cells=[new_code_cell("plot()", outputs=outputs)])
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 1.0))
+    blob_keys = [key for key in client.objects if key.startswith('workspace/.bookstore/blobs/')]
+    assert len(blob_keys) == 3
+    assert len(archiver.archived_blobs) == 2
+
+
+@pytest.mark.asyncio
+async def test_archive_delta_chain(mock_archiver):
+    archiver, client = mock_archiver()
+    archiver.settings.archive_format = "delta"
+    archiver.settings.delta_max_chain = 1
+    notebook = new_notebook(cells=[new_code_cell("a = 1")])
+    prefix = 'workspace/.bookstore/deltas/nb.ipynb/'
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 1.0))
+    notebook["cells"].append(new_code_cell("b = 2"))
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 2.0))
+    notebook["cells"].append(new_code_cell("c = 3"))
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 3.0))
+
+    assert sorted(client.objects) == [
+        prefix + '0000000000.base.json',
+        prefix + '0000000001.delta.json',
+        prefix + '0000000002.base.json',
+        prefix + 'latest.json',
+    ]
+    delta = json.loads(client.objects[prefix + '0000000001.delta.json'])
+    assert delta["cells"][0] == 0
+    assert json.loads(client.objects[prefix + 'latest.json']) == {"sequence": 2, "bases": [0, 2]}
+
+    # a new process continues the sequence with a base
+    restarted, _ = mock_archiver()
+    restarted.client_manager = archiver.client_manager
+    restarted.settings.archive_format = "delta"
+    notebook["cells"].append(new_code_cell("d = 4"))
+    await restarted.archive(ArchiveRecord('nb.ipynb', notebook, 4.0))
+    assert prefix + '0000000003.base.json' in client.objects
+    assert json.loads(client.objects[prefix + 'latest.json']) == {
+        "sequence": 3,
+        "bases": [0, 2, 3],
+    }
+
+
+@pytest.mark.asyncio
+async def test_archive_delta_prunes_old_bases(mock_archiver):
+    archiver, client = mock_archiver(archive_format="delta", delta_max_chain=1, delta_keep_bases=2)
+    notebook = new_notebook(cells=[new_code_cell("a = 1")])
+    prefix = 'workspace/.bookstore/deltas/nb.ipynb/'
+
+    for i in range(6):
+        notebook["cells"].append(new_code_cell(f"b = {i}"))
+        await archiver.archive(ArchiveRecord('nb.ipynb', notebook, float(i)))
+
+    # bases 0, 2 and 4 were written; the first base and its delta were deleted
+    assert sorted(client.objects) == [
+        prefix + '0000000002.base.json',
+        prefix + '0000000003.delta.json',
+        prefix + '0000000004.base.json',
+        prefix + '0000000005.delta.json',
+        prefix + 'latest.json',
+    ]
+    assert json.loads(client.objects[prefix + 'latest.json']) == {"sequence": 5, "bases": [2, 4]}
+
+
+@pytest.mark.asyncio
+async def test_archive_spooled_record_removed_once_archived(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_spool_dir=str(tmp_path))
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    assert client.bodies == [b'content']
+    assert archiver.spool.entries() == []
+
+
+@pytest.mark.asyncio
+async def test_archive_spooled_record_kept_on_failure(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_spool_dir=str(tmp_path))
+    client.fail = True
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    assert len(archiver.spool.entries()) == 1
+
+
+@pytest.mark.asyncio
+async def test_archive_spooled_notebook_serialized_once(tmp_path, monkeypatch, mock_archiver):
+    archiver, client = mock_archiver(archive_spool_dir=str(tmp_path))
+    writes = []
+    nbformat_writes = nbformat.writes
+    monkeypatch.setattr(
+        nbformat, 'writes', lambda nb, **kwargs: writes.append(nb) or nbformat_writes(nb, **kwargs)
+    )
+    notebook = new_notebook()
+    serialized = nbformat_writes(notebook).encode('utf-8')
+    client.fail = True
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', notebook, 1.0))
+    (entry,) = archiver.spool.entries()
+    with open(archiver.spool.body_path(entry), 'rb') as f:
+        assert f.read() == serialized
+
+    client.fail = False
+    assert await archiver.flush(timeout=5) == []
+    assert client.bodies == [serialized]
+    assert len(writes) == 1
+
+
+@pytest.mark.asyncio
+async def test_archive_spooled_saved_file_outlives_it(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_spool_dir=str(tmp_path / 'spool'))
+    saved = tmp_path / 'nb.ipynb'
+    saved.write_bytes(b'saved')
+    client.fail = True
+    await archiver.archive(ArchiveRecord('nb.ipynb', None, 1.0, os_path=str(saved)))
+
+    saved.unlink()
+    client.fail = False
+    assert await archiver.flush(timeout=5) == []
+    assert client.bodies == [b'saved']
+    assert archiver.spool.entries() == []
+
+
+@pytest.mark.asyncio
+async def test_archive_replays_spool(tmp_path, mock_archiver):
+    failing, failing_client = mock_archiver(archive_spool_dir=str(tmp_path))
+    failing_client.fail = True
+    await failing.archive(ArchiveRecord('nb.ipynb', 'first', 1.0))
+    await failing.archive(ArchiveRecord('nb.ipynb', 'second', 2.0))
+
+    archiver, client = mock_archiver(archive_spool_dir=str(tmp_path))
+    while archiver.spool.entries():
+        await asyncio.sleep(0.01)
+    assert client.bodies[-1] == b'second'
+
+
+@pytest.mark.asyncio
+async def test_archive_metrics(mock_archiver):
+    archiver, client = mock_archiver()
+    now = asyncio.get_event_loop().time()
+
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', now))
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', now))
+    client.fail = True
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'changed', now))
+
+    snapshot = archiver.metrics.snapshot()
+    assert snapshot["counters"]["bookstore_archive_writes_total"] == {(): 1}
+    assert snapshot["counters"]["bookstore_archive_skipped_total"] == {
+        (("reason", "unchanged"),): 1
+    }
+    assert snapshot["counters"]["bookstore_archive_failed_total"] == {(("stage", "upload"),): 1}
+    assert snapshot["histograms"]["bookstore_archive_queue_seconds"][()].count == 3
+    assert snapshot["histograms"]["bookstore_archive_upload_bytes"][()].sum == len(b'content')
+    assert snapshot["gauges"]["bookstore_archive_in_flight"] == {(): 0}
+
+
+@pytest.mark.asyncio
+async def test_archive_concurrency_bounded_by_max_threads(mock_archiver):
+    archiver, client = mock_archiver(max_threads=2)
+    client.release.clear()
+
+    writes = [
+        asyncio.ensure_future(archiver.archive(ArchiveRecord(f'nb{i}.ipynb', f'content{i}', 1.0)))
+        for i in range(4)
+    ]
+    while len(client.bodies) < 2:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    assert len(client.bodies) == 2
+    assert archiver.queued_writes == 2
+
+    client.release.set()
+    await asyncio.gather(*writes)
+    assert len(client.bodies) == 4
+
+
+@pytest.mark.asyncio
+async def test_archive_full_queue_drops(mock_archiver):
+    archiver, client = mock_archiver(
+        max_threads=1, archive_queue_size=0, archive_queue_full_policy="drop"
+    )
+    client.release.clear()
+
+    first = asyncio.ensure_future(archiver.archive(ArchiveRecord('a.ipynb', 'a', 1.0)))
+    while not client.bodies:
+        await asyncio.sleep(0.01)
+    await archiver.archive(ArchiveRecord('b.ipynb', 'b', 1.0))
+
+    client.release.set()
+    await first
+    assert client.bodies == [b'a']
+    assert archiver.metrics.snapshot()["counters"]["bookstore_archive_dropped_total"] == {(): 1}
+
+
+@pytest.mark.asyncio
+async def test_archive_full_queue_waits_for_newest(mock_archiver):
+    archiver, client = mock_archiver(max_threads=1, archive_queue_size=0)
+    client.release.clear()
+
+    first = asyncio.ensure_future(archiver.archive(ArchiveRecord('a.ipynb', 'a', 1.0)))
+    while not client.bodies:
+        await asyncio.sleep(0.01)
+    waiting = asyncio.ensure_future(archiver.archive(ArchiveRecord('b.ipynb', 'b1', 1.0)))
+    await asyncio.sleep(0.01)
+    await archiver.archive(ArchiveRecord('b.ipynb', 'b2', 2.0))
+    assert archiver.overflow_records['b.ipynb'].content == 'b2'
+
+    client.release.set()
+    await asyncio.gather(first, waiting)
+    assert client.bodies == [b'a', b'b2']
+    assert archiver.overflow_records == {}
+
+
+@pytest.mark.asyncio
+async def test_flush_waits_for_outstanding_archives(mock_archiver):
+    archiver, client = mock_archiver()
+    client.release.clear()
+    archiver.run_pre_save_hook({"type": "notebook", "content": new_notebook()}, 'nb.ipynb')
+    assert len(archiver.archive_tasks) == 1
+
+    asyncio.get_event_loop().call_later(0.05, client.release.set)
+    assert await archiver.flush(timeout=5) == []
+    assert len(client.bodies) == 1
+    assert archiver.archive_tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_flush_reports_unflushed_paths(caplog, mock_archiver):
+    archiver, client = mock_archiver()
+    client.release.clear()
+    archiver.run_pre_save_hook({"type": "notebook", "content": new_notebook()}, 'nb.ipynb')
+
+    with caplog.at_level(logging.WARNING):
+        assert await archiver.flush(timeout=0.05) == ['nb.ipynb']
+    assert 'Unable to archive 1 notebooks before shutdown: nb.ipynb' in caplog.text
+    assert archiver.archive_tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_flush_retries_scheduled_records(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_spool_dir=str(tmp_path))
+    client.fail = True
+    await archiver.archive(ArchiveRecord('nb.ipynb', 'content', 1.0))
+    assert len(archiver.scheduled_retries) == 1
+
+    client.fail = False
+    assert await archiver.flush(timeout=5) == []
+    assert client.bodies == [b'content']
+    assert archiver.spool.entries() == []
+
+
+@pytest.mark.asyncio
+async def test_post_save_archives_saved_file(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_trigger="post_save")
+    archiver.root_dir = str(tmp_path)
+
+    archiver.save({"type": "notebook", "content": new_notebook()}, 'nb.ipynb')
+    assert len(archiver.archive_tasks) == 1
+    await archiver.flush(timeout=5)
+
+    assert client.bodies == [(tmp_path / 'nb.ipynb').read_bytes()]
+    assert archiver.archived_digests['nb.ipynb'] == hashlib.sha256(client.bodies[0]).hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_post_save_compressed(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_trigger="post_save", compression="gzip")
+    archiver.root_dir = str(tmp_path)
+
+    archiver.save({"type": "notebook", "content": new_notebook()}, 'nb.ipynb')
+    await archiver.flush(timeout=5)
+
+    assert gzip.decompress(client.bodies[0]) == (tmp_path / 'nb.ipynb').read_bytes()
+
+
+def notebook_model(title):
+    notebook = new_notebook()
+    notebook.metadata["title"] = title
+    return {"type": "notebook", "content": notebook}
+
+
+@pytest.mark.asyncio
+async def test_min_interval_archives_latest_save_when_it_ends(mock_archiver):
+    archiver, client = mock_archiver(archive_min_interval=0.1)
+
+    for title in ("first", "second", "third"):
+        archiver.run_pre_save_hook(notebook_model(title), 'nb.ipynb')
+    assert list(archiver.debounced_records) == ['nb.ipynb']
+    await asyncio.wait(list(archiver.archive_tasks))
+    assert len(client.bodies) == 1
+
+    while archiver.debounced_records or archiver.archive_tasks:
+        await asyncio.sleep(0.02)
+    assert [json.loads(body)["metadata"]["title"] for body in client.bodies] == ["first", "third"]
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_archives_held_save_immediately(tmp_path, mock_archiver):
+    archiver, client = mock_archiver(archive_min_interval=60)
+    archiver.root_dir = str(tmp_path)
+    archiver.save(notebook_model("first"), 'nb.ipynb')
+    archiver.save(notebook_model("second"), 'nb.ipynb')
+    assert 'nb.ipynb' in archiver.debounced_records
+
+    archiver.create_checkpoint('nb.ipynb')
+    assert archiver.debounced_records == {}
+    await asyncio.wait(list(archiver.archive_tasks))
+    assert [json.loads(body)["metadata"]["title"] for body in client.bodies] == ["first", "second"]
+
+
+async def wait_for_queued(archiver, count):
+    while archiver.queued_writes < count:
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_explicit_save_written_ahead_of_autosaves(mock_archiver):
+    archiver, client = mock_archiver(max_threads=1)
+    client.release.clear()
+
+    first = asyncio.ensure_future(archiver.archive(ArchiveRecord('busy.ipynb', 'busy', 1.0)))
+    writes = [
+        asyncio.ensure_future(archiver.archive(ArchiveRecord(f'auto{i}.ipynb', f'auto{i}', 1.0)))
+        for i in range(3)
+    ]
+    writes.append(asyncio.ensure_future(archiver.archive(ArchiveRecord('nb.ipynb', 'nb', 1.0))))
+    await wait_for_queued(archiver, 4)
+    assert archiver.queued_by_priority[AUTOSAVE] == 4
+
+    archiver._prioritize('nb.ipynb', EXPLICIT_SAVE)
+    assert archiver.queued_by_priority == {EXPLICIT_SAVE: 1, AUTOSAVE: 3, BACKGROUND: 0}
+    gauges = archiver.metrics.snapshot()["gauges"]["bookstore_archive_queued_writes"]
+    assert gauges[(("priority", "explicit"),)] == 1
+
+    client.release.set()
+    await asyncio.gather(first, *writes)
+    assert client.bodies == [b'busy', b'nb', b'auto0', b'auto1', b'auto2']
+    assert archiver.queued_writes == 0
+    assert archiver.free_write_slots == 1
+
+
+@pytest.mark.asyncio
+async def test_small_notebooks_written_first(mock_archiver):
+    archiver, client = mock_archiver(max_threads=1, archive_prioritize_small=True)
+    client.release.clear()
+
+    first = asyncio.ensure_future(archiver.archive(ArchiveRecord('busy.ipynb', 'busy', 1.0)))
+    large = asyncio.ensure_future(archiver.archive(ArchiveRecord('large.ipynb', 'x' * 4096, 1.0)))
+    small = asyncio.ensure_future(archiver.archive(ArchiveRecord('small.ipynb', 'y', 1.0)))
+    await wait_for_queued(archiver, 2)
+
+    client.release.set()
+    await asyncio.gather(first, large, small)
+    assert client.bodies == [b'busy', b'y', b'x' * 4096]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_queued_write_leaves_queue(mock_archiver):
+    archiver, client = mock_archiver(max_threads=1)
+    client.release.clear()
+
+    first = asyncio.ensure_future(archiver.archive(ArchiveRecord('busy.ipynb', 'busy', 1.0)))
+    queued = asyncio.ensure_future(archiver.archive(ArchiveRecord('nb.ipynb', 'nb', 1.0)))
+    await wait_for_queued(archiver, 1)
+    queued.cancel()
+    await asyncio.wait([queued])
+    assert archiver.queued_writes == 0
+
+    client.release.set()
+    await first
+    assert client.bodies == [b'busy']
+    assert archiver.free_write_slots == 1
@@ -0,0 +1,64 @@
+"""Tests for content-addressed blobs"""
+import copy
+import hashlib
+
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+from bookstore.blobs import (
+    BLOB_REFERENCE_PREFIX,
+    blob_key,
+    blob_prefix,
+    blob_references,
+    extract_blobs,
+    is_manifest,
+    manifest_blob_prefix,
+    reassemble,
+)
+
+IMAGE = "iVBORw0KGgo" * 100
+
+
+def notebook_with_outputs():
+    output = new_output("display_data", data={"image/png": IMAGE, "text/plain": "<Figure>"})
+    markdown = new_markdown_cell("![img](attachment:img.png)")
+    markdown["attachments"] = {"img.png": {"image/png": IMAGE}}
+    return new_notebook(cells=[new_code_cell("plot()", outputs=[output]), markdown])
+
+
+def test_blob_key():
+    assert blob_key(blob_prefix("workspace"), "abc") == "workspace/.bookstore/blobs/abc"
+
+
+def test_extract_blobs():
+    digest = hashlib.sha256(IMAGE.encode("utf-8")).hexdigest()
+    manifest, blobs = extract_blobs(notebook_with_outputs(), 100, "workspace/.bookstore/blobs")
+
+    assert blobs == {digest: IMAGE.encode("utf-8")}
+    assert is_manifest(manifest)
+    assert manifest_blob_prefix(manifest) == "workspace/.bookstore/blobs"
+    assert blob_references(manifest) == {digest}
+    output_data = manifest["cells"][0]["outputs"][0]["data"]
+    assert output_data["image/png"] == BLOB_REFERENCE_PREFIX + digest
+    assert output_data["text/plain"] == "<Figure>"
+    assert manifest["cells"][1]["attachments"]["img.png"]["image/png"].startswith(
+        BLOB_REFERENCE_PREFIX
+    )
+
+
+def test_extract_blobs_below_threshold():
+    manifest, blobs = extract_blobs(notebook_with_outputs(), len(IMAGE) + 1, "prefix")
+    assert blobs == {}
+    assert not is_manifest(manifest)
+
+
+def test_is_manifest_ignores_user_metadata():
+    assert not is_manifest(new_notebook(metadata={"bookstore": {"blob_prefix": "mine"}}))
+    assert not is_manifest(new_notebook(metadata={"bookstore_manifest": {}}))
+    assert not is_manifest({"metadata": None})
+
+
+def test_reassemble_round_trip():
+    notebook = notebook_with_outputs()
+    expected = copy.deepcopy(notebook)
+    manifest, blobs = extract_blobs(notebook, 100, "prefix")
+    assert reassemble(manifest, blobs) == expected
@@ -4,6 +4,8 @@ import logging
 import pytest
 
 from bookstore.bookstore_config import BookstoreSettings, validate_bookstore
+from bookstore.compression import zstd_available
+from traitlets import TraitError
 
 
 def test_validate_bookstore_defaults():
@@ -14,6 +16,8 @@ def test_validate_bookstore_defaults():
         "archive_valid": False,
         "s3_clone_valid": True,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings()
     assert validate_bookstore(settings) == expected
@@ -27,6 +31,8 @@ def test_validate_bookstore_published():
         "archive_valid": True,
         "s3_clone_valid": True,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings(s3_bucket="A_bucket", published_prefix="")
     assert validate_bookstore(settings) == expected
@@ -40,6 +46,8 @@ def test_validate_bookstore_workspace():
         "archive_valid": False,
         "s3_clone_valid": True,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings(s3_bucket="A_bucket", workspace_prefix="")
     assert validate_bookstore(settings) == expected
@@ -53,6 +61,8 @@ def test_validate_bookstore_endpoint():
         "archive_valid": False,
         "s3_clone_valid": True,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings(s3_endpoint_url="")
     assert validate_bookstore(settings) == expected
@@ -66,6 +76,8 @@ def test_validate_bookstore_bucket():
         "archive_valid": True,
         "s3_clone_valid": True,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings(s3_bucket="A_bucket")
     assert validate_bookstore(settings) == expected
@@ -79,6 +91,8 @@ def test_disable_cloning():
         "archive_valid": True,
         "s3_clone_valid": False,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings(s3_bucket="A_bucket", enable_s3_cloning=False)
     assert validate_bookstore(settings) == expected
@@ -92,6 +106,8 @@ def test_enable_fs_cloning():
         "archive_valid": False,
         "s3_clone_valid": False,
         "fs_clone_valid": True,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     settings = BookstoreSettings(enable_s3_cloning=False, fs_cloning_basedir="/Users/bookstore")
     assert validate_bookstore(settings) == expected
@@ -105,6 +121,8 @@ def test_relative_basepath(caplog):
         "archive_valid": False,
         "s3_clone_valid": False,
         "fs_clone_valid": False,
+        "metrics_valid": False,
+        "stream_publish_valid": False,
     }
     fs_cloning_basedir = "Users/jupyter"
     settings = BookstoreSettings(enable_s3_cloning=False, fs_cloning_basedir=fs_cloning_basedir)
@@ -112,3 +130,9 @@ def test_relative_basepath(caplog):
         actual = validate_bookstore(settings)
     assert actual == expected
     assert f"{fs_cloning_basedir} is not an absolute path," in caplog.text
+
+
+@pytest.mark.skipif(zstd_available(), reason="zstandard is installed")
+def test_zstd_compression_requires_zstandard():
+    with pytest.raises(TraitError):
+        BookstoreSettings(compression="zstd")
@@ -0,0 +1,190 @@
+"""Tests for S3-backed checkpoints"""
+import asyncio
+import gzip
+import json
+import threading
+
+import pytest
+from nbformat.v4 import new_notebook
+from notebook.services.contents.filemanager import FileContentsManager
+from tornado.web import HTTPError
+from traitlets.config import Config
+
+from bookstore.checkpoints import BookstoreCheckpoints, checkpoint_key
+
+from .conftest import MockClientManager, MockS3Client
+
+
+class SlowReadS3Client(MockS3Client):
+    """Holds up reads while `readable` is clear."""
+
+    def __init__(self):
+        super().__init__()
+        self.readable = threading.Event()
+        self.readable.set()
+
+    async def get_object(self, Bucket, Key, **kwargs):
+        while not self.readable.is_set():
+            await asyncio.sleep(0.01)
+        return await super().get_object(Bucket, Key, **kwargs)
+
+
+def contents_manager(root_dir, client, **settings):
+    config = Config({"BookstoreSettings": settings})
+    manager = FileContentsManager(
+        root_dir=str(root_dir), checkpoints_class=BookstoreCheckpoints, config=config
+    )
+    checkpoints = manager.checkpoints
+    checkpoints.client_manager = MockClientManager(client)
+    checkpoints.reader_client_manager = MockClientManager(client)
+    return manager, checkpoints
+
+
+def save_notebook(manager, path, title):
+    notebook = new_notebook()
+    notebook.metadata["title"] = title
+    manager.save({"type": "notebook", "content": notebook}, path)
+
+
+def title(root_dir, path):
+    return json.loads((root_dir / path).read_text())["metadata"]["title"]
+
+
+def cache_counts(checkpoints):
+    counts = checkpoints.metrics.snapshot()["counters"]["bookstore_checkpoint_cache_total"]
+    return {labels[0][1]: count for labels, count in counts.items()}
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_uploaded_and_listed_from_cache(tmp_path):
+    client = SlowReadS3Client()
+    manager, checkpoints = contents_manager(tmp_path, client)
+
+    save_notebook(manager, 'nb.ipynb', "first")
+    assert [cp["id"] for cp in manager.list_checkpoints('nb.ipynb')] == ["checkpoint"]
+    assert await checkpoints.flush(timeout=5) == []
+
+    body, params = client.stored(checkpoint_key("workspace", "nb.ipynb"))
+    assert body == (tmp_path / 'nb.ipynb').read_bytes()
+    assert "ContentEncoding" not in params
+    # the first save's check for a checkpoint is the only miss
+    assert cache_counts(checkpoints) == {"miss": 1, "hit": 1}
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_restored_on_another_server(tmp_path):
+    client = SlowReadS3Client()
+    (tmp_path / "a").mkdir()
+    manager, checkpoints = contents_manager(tmp_path / "a", client, compression="gzip")
+    save_notebook(manager, 'nb.ipynb', "checkpointed")
+    await checkpoints.flush(timeout=5)
+    assert gzip.decompress(client.objects[checkpoint_key("workspace", "nb.ipynb")])
+
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b" / "nb.ipynb").write_text("{}")
+    other, other_checkpoints = contents_manager(tmp_path / "b", client)
+    # not cached yet: read from S3 while the caller waits
+    assert len(other.list_checkpoints('nb.ipynb')) == 1
+    other.restore_checkpoint("checkpoint", 'nb.ipynb')
+    assert title(tmp_path / "b", 'nb.ipynb') == "checkpointed"
+    assert cache_counts(other_checkpoints) == {"miss": 1, "hit": 1}
+    await other_checkpoints.close()
+    assert not other_checkpoints._reader_thread.is_alive()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_read_slower_than_timeout(tmp_path):
+    client = SlowReadS3Client()
+    (tmp_path / "a").mkdir()
+    manager, checkpoints = contents_manager(tmp_path / "a", client)
+    save_notebook(manager, 'nb.ipynb', "checkpointed")
+    await checkpoints.flush(timeout=5)
+
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b" / "nb.ipynb").write_text("{}")
+    other, other_checkpoints = contents_manager(
+        tmp_path / "b", client, checkpoint_fetch_timeout=0.05
+    )
+    client.readable.clear()
+    assert other.list_checkpoints('nb.ipynb') == []
+    with pytest.raises(HTTPError) as e:
+        other.restore_checkpoint("checkpoint", 'nb.ipynb')
+    assert e.value.status_code == 503
+    future = other_checkpoints.fetching['nb.ipynb']
+
+    # the read carries on and is cached once it completes
+    client.readable.set()
+    await asyncio.wrap_future(future)
+    await asyncio.sleep(0)
+    assert other_checkpoints.fetching == {}
+    assert len(other.list_checkpoints('nb.ipynb')) == 1
+    await other_checkpoints.close()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_restore_missing(tmp_path):
+    manager, checkpoints = contents_manager(tmp_path, SlowReadS3Client())
+    (tmp_path / 'nb.ipynb').write_text("{}")
+
+    assert manager.list_checkpoints('nb.ipynb') == []
+    with pytest.raises(HTTPError) as e:
+        manager.restore_checkpoint("checkpoint", 'nb.ipynb')
+    assert e.value.status_code == 404
+    await checkpoints.close()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_renamed_and_deleted(tmp_path):
+    client = SlowReadS3Client()
+    manager, checkpoints = contents_manager(tmp_path, client)
+    save_notebook(manager, 'nb.ipynb', "first")
+
+    manager.rename('nb.ipynb', 'renamed.ipynb')
+    assert manager.list_checkpoints('nb.ipynb') == []
+    assert len(manager.list_checkpoints('renamed.ipynb')) == 1
+    await checkpoints.flush(timeout=5)
+    assert list(client.objects) == [checkpoint_key("workspace", "renamed.ipynb")]
+
+    manager.delete('renamed.ipynb')
+    assert manager.list_checkpoints('renamed.ipynb') == []
+    await checkpoints.flush(timeout=5)
+    assert client.objects == {}
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_cache_evicts_least_recently_used(tmp_path):
+    client = SlowReadS3Client()
+    manager, checkpoints = contents_manager(tmp_path, client)
+    save_notebook(manager, 'a.ipynb', "a")
+    size = checkpoints.cached_bytes
+    checkpoints.settings.checkpoint_cache_max_bytes = 2 * size
+    save_notebook(manager, 'b.ipynb', "b")
+    await checkpoints.flush(timeout=5)
+
+    manager.list_checkpoints('a.ipynb')
+    save_notebook(manager, 'c.ipynb', "c")
+    assert list(checkpoints.cache) == ['a.ipynb', 'c.ipynb']
+    assert checkpoints.cached_bytes == 2 * size
+
+
+@pytest.mark.asyncio
+async def test_uncached_checkpoint_renamed_and_deleted(tmp_path):
+    client = SlowReadS3Client()
+    (tmp_path / "a").mkdir()
+    manager, checkpoints = contents_manager(tmp_path / "a", client)
+    save_notebook(manager, 'nb.ipynb', "first")
+    await checkpoints.flush(timeout=5)
+
+    (tmp_path / "b").mkdir()
+    save_notebook(FileContentsManager(root_dir=str(tmp_path / "b")), 'nb.ipynb', "copy")
+    other, other_checkpoints = contents_manager(tmp_path / "b", client)
+    other.rename('nb.ipynb', 'renamed.ipynb')
+    await other_checkpoints.flush(timeout=5)
+    assert list(client.objects) == [checkpoint_key("workspace", "renamed.ipynb")]
+
+    other.delete('renamed.ipynb')
+    await other_checkpoints.flush(timeout=5)
+    assert client.objects == {}
+    # renaming and deleting did not read the checkpoint from S3
+    counters = other_checkpoints.metrics.snapshot()["counters"]
+    assert "bookstore_checkpoint_cache_total" not in counters
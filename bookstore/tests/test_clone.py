@@ -1,5 +1,6 @@
 import json
 import logging
+import threading
 import uuid
 import os
 
@@ -16,6 +17,7 @@ from tornado.web import Application, HTTPError
 from tornado.httpserver import HTTPRequest
 from traitlets.config import Config
 
+from bookstore.blobs import extract_blobs
 from bookstore.bookstore_config import BookstoreSettings
 from bookstore.clone import (
     build_notebook_model,
@@ -26,9 +28,11 @@ from bookstore.clone import (
     BookstoreFSCloneHandler,
     BookstoreFSCloneAPIHandler,
 )
+from bookstore.deltas import BASE, DELTA, compute_delta, latest_key, version_key
 from bookstore.utils import TemporaryWorkingDirectory
 
 from . import test_dir
+from .conftest import MockClientManager, MockS3Client
 
 
 log = logging.getLogger('test_clone')
@@ -227,6 +231,92 @@ class TestCloneAPIHandler(AsyncTestCase):
         with pytest.raises(HTTPError):
             await success_handler._clone(s3_bucket, s3_object_key)
 
+    @gen_test
+    async def test_reassemble_manifest(self):
+        image = "iVBORw0KGgo" * 100
+        output = nbformat.v4.new_output("display_data", data={"image/png": image})
+        notebook = nbformat.v4.new_notebook(
+            cells=[nbformat.v4.new_code_cell("plot()", outputs=[output])]
+        )
+        expected = nbformat.from_dict(json.loads(json.dumps(notebook)))
+        manifest, blobs = extract_blobs(notebook, 100, "workspace/.bookstore/blobs")
+        client = MockS3Client(
+            {f"workspace/.bookstore/blobs/{digest}": body for digest, body in blobs.items()}
+        )
+
+        handler = self.post_handler({})
+        content = await handler._reassemble(client, "my_bucket", json.dumps(manifest))
+        assert json.loads(content) == expected
+
+    @gen_test
+    async def test_reassemble_plain_content(self):
+        handler = self.post_handler({})
+        content = "not a bookstore-blob:sha256: manifest"
+        assert await handler._reassemble(MockS3Client({}), "my_bucket", content) == content
+
+    @gen_test
+    async def test_clone_plain_notebook_with_bookstore_metadata(self):
+        handler = self.post_handler({})
+        for metadata in [{}, {"blob_prefix": "mine"}]:
+            notebook = nbformat.v4.new_notebook(
+                cells=[nbformat.v4.new_markdown_cell("bookstore-blob:sha256:abc")],
+                metadata={"bookstore": metadata},
+            )
+            content = json.dumps(notebook)
+            client = MockS3Client({"workspace/nb.ipynb": content.encode('utf-8')})
+            handler.client_manager = MockClientManager(client)
+
+            _, cloned = await handler._clone("my_bucket", "workspace/nb.ipynb")
+            assert json.loads(cloned) == notebook
+
+    @gen_test
+    async def test_clone_delta_archived(self):
+        app = Mock(
+            spec=Application,
+            ui_methods={},
+            ui_modules={},
+            settings=dict(self.mock_application.settings),
+        )
+        app.settings["config"] = Config(
+            {
+                "BookstoreSettings": {
+                    "s3_bucket": "my_bucket",
+                    "workspace_prefix": "workspace",
+                    "archive_format": "delta",
+                }
+            }
+        )
+        base = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell("a = 1")])
+        latest = nbformat.v4.new_notebook(
+            cells=[nbformat.v4.new_code_cell("a = 1"), nbformat.v4.new_code_cell("b = 2")]
+        )
+        client = MockS3Client(
+            {
+                "workspace/nb.ipynb": b'"stale"',
+                version_key("workspace", "nb.ipynb", 0, BASE): json.dumps(base).encode(),
+                version_key("workspace", "nb.ipynb", 1, DELTA): json.dumps(
+                    compute_delta(base, latest)
+                ).encode(),
+                latest_key("workspace", "nb.ipynb"): b'{"sequence": 1, "bases": [0]}',
+                "workspace/other.ipynb": b'"not delta archived"',
+            }
+        )
+        handler = self.post_handler({}, app=app)
+        handler.client_manager = MockClientManager(client)
+
+        obj, content = await handler._clone("my_bucket", "workspace/nb.ipynb")
+        assert obj["ResponseMetadata"]["HTTPStatusCode"] == 200
+        assert json.loads(content) == latest
+        # the latest pointer spares listing the versions
+        assert client.listings == 0
+
+        # paths without versions, specific S3 versions and other buckets read the key itself
+        _, content = await handler._clone("my_bucket", "workspace/other.ipynb")
+        assert content == '"not delta archived"'
+        assert handler._delta_archived_path("my_bucket", "workspace/nb.ipynb", "v1") is None
+        assert handler._delta_archived_path("other_bucket", "workspace/nb.ipynb") is None
+        assert handler._delta_archived_path("my_bucket", "published/nb.ipynb") is None
+
     def test_build_s3_request_object(self):
         expected = {"Bucket": "my_bucket", "Key": "my_key"}
         s3_bucket = "my_bucket"
@@ -501,6 +591,45 @@ class TestFSCloneAPIHandler(AsyncTestCase):
                 actual = json.load(f)
         assert actual == expected
 
+    @gen_test
+    async def test_post_offloaded_uses_contents_manager_on_loop(self):
+        mock_settings = {
+            "BookstoreSettings": {
+                "fs_cloning_basedir": os.path.join(test_dir, 'test_files'),
+                "validation_offload_bytes": 0,
+            }
+        }
+        contents_manager = FileContentsManager()
+        app = Mock(
+            spec=Application,
+            ui_methods={},
+            ui_modules={},
+            settings={
+                'jinja2_env': Environment(),
+                "config": Config(mock_settings),
+                "contents_manager": contents_manager,
+                "base_url": "/",
+            },
+        )
+        threads = []
+
+        def record(method):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return method(*args, **kwargs)
+
+            return wrapper
+
+        contents_manager.increment_filename = record(contents_manager.increment_filename)
+        contents_manager.save = record(contents_manager.save)
+        success_handler = self.post_handler({"relpath": 'EmptyNotebook.ipynb'}, app=app)
+        setattr(success_handler, '_transforms', [])
+
+        with TemporaryWorkingDirectory() as tmp:
+            await success_handler.post()
+            assert os.path.exists('EmptyNotebook.ipynb')
+        assert threads == [threading.get_ident()] * 2
+
     @gen_test
     async def test_build_text_content_model(self):
         content = "some content"
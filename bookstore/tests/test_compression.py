@@ -0,0 +1,34 @@
+"""Tests for compression of stored objects"""
+import pytest
+
+from bookstore.compression import compress, decompress, zstd_available
+
+
+@pytest.mark.parametrize("mode", ["none", "gzip"])
+def test_compress_round_trip(mode):
+    body = b'{"cells": []}' * 100
+    compressed, content_encoding = compress(body, mode)
+    assert decompress(compressed, content_encoding) == body
+
+
+def test_compress_none_is_passthrough():
+    assert compress(b"content", "none") == (b"content", None)
+
+
+def test_gzip_compresses():
+    body = b'{"cells": []}' * 100
+    compressed, content_encoding = compress(body, "gzip")
+    assert content_encoding == "gzip"
+    assert len(compressed) < len(body)
+
+
+def test_decompress_unknown_encoding_passthrough():
+    assert decompress(b"content", "identity") == b"content"
+
+
+@pytest.mark.skipif(not zstd_available(), reason="zstandard is not installed")
+def test_zstd_round_trip():
+    body = b'{"cells": []}' * 100
+    compressed, content_encoding = compress(body, "zstd")
+    assert content_encoding == "zstd"
+    assert decompress(compressed, content_encoding) == body
@@ -0,0 +1,93 @@
+"""Tests for delta archiving"""
+import json
+
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
+
+from bookstore.deltas import (
+    BASE,
+    DELTA,
+    apply_delta,
+    compute_delta,
+    delta_prefix,
+    latest_key,
+    parse_version_key,
+    restore_notebook,
+    restore_version,
+    version_key,
+)
+
+from .conftest import MockS3Client
+
+
+def test_version_key():
+    key = version_key("workspace", "dir/nb.ipynb", 12, DELTA)
+    assert key == "workspace/.bookstore/deltas/dir/nb.ipynb/0000000012.delta.json"
+    assert key.startswith(delta_prefix("workspace", "dir/nb.ipynb"))
+    assert parse_version_key(key) == (12, DELTA)
+
+
+def test_compute_delta_references_unchanged_cells():
+    first = new_notebook(cells=[new_code_cell("a = 1"), new_markdown_cell("# Title")])
+    second = new_notebook(cells=[first.cells[1], new_code_cell("b = 2"), first.cells[0]])
+
+    delta = compute_delta(first, second)
+    assert delta["cells"][0] == 1
+    assert delta["cells"][1] == second.cells[1]
+    assert delta["cells"][2] == 0
+    assert apply_delta(first, delta) == second
+
+
+def test_restore_notebook_applies_chain():
+    first = new_notebook(cells=[new_code_cell("a = 1")])
+    second = new_notebook(cells=[first.cells[0], new_code_cell("b = 2")])
+    third = new_notebook(cells=[second.cells[1]])
+
+    versions = [
+        (BASE, first),
+        (DELTA, compute_delta(first, second)),
+        (DELTA, compute_delta(second, third)),
+    ]
+    assert restore_notebook(versions) == third
+
+
+@pytest.mark.asyncio
+async def test_restore_version():
+    first = new_notebook(cells=[new_code_cell("a = 1")])
+    second = new_notebook(cells=[first.cells[0], new_code_cell("b = 2")])
+    third = new_notebook(cells=[new_code_cell("c = 3")])
+    documents = [
+        (0, BASE, first),
+        (1, DELTA, compute_delta(first, second)),
+        (2, BASE, third),
+    ]
+    objects = {
+        version_key("workspace", "nb.ipynb", sequence, kind): json.dumps(doc).encode("utf-8")
+        for sequence, kind, doc in documents
+    }
+    client = MockS3Client(objects)
+
+    assert await restore_version(client, "bucket", "workspace", "nb.ipynb", 1) == second
+    assert await restore_version(client, "bucket", "workspace", "nb.ipynb") == third
+    with pytest.raises(LookupError):
+        await restore_version(client, "bucket", "workspace", "other.ipynb")
+
+
+@pytest.mark.asyncio
+async def test_restore_latest_version_from_pointer():
+    first = new_notebook(cells=[new_code_cell("a = 1")])
+    second = new_notebook(cells=[first.cells[0], new_code_cell("b = 2")])
+    objects = {
+        version_key("workspace", "nb.ipynb", 3, BASE): json.dumps(first).encode("utf-8"),
+        version_key("workspace", "nb.ipynb", 4, DELTA): json.dumps(
+            compute_delta(first, second)
+        ).encode("utf-8"),
+        latest_key("workspace", "nb.ipynb"): b'{"sequence": 4, "bases": [0, 3]}',
+    }
+    client = MockS3Client(objects)
+
+    assert await restore_version(client, "bucket", "workspace", "nb.ipynb") == second
+    assert client.listings == 0
+    # older versions are listed, skipping the pointer
+    assert await restore_version(client, "bucket", "workspace", "nb.ipynb", 3) == first
+    assert client.listings == 1
@@ -6,7 +6,13 @@ import logging
 from unittest.mock import Mock
 
 from bookstore._version import __version__
-from bookstore.handlers import collect_handlers, build_settings_dict, BookstoreVersionHandler
+from bookstore.handlers import (
+    collect_handlers,
+    build_settings_dict,
+    BookstoreMetricsHandler,
+    BookstoreVersionHandler,
+)
+from bookstore.metrics import METRICS_KEY, BookstoreMetrics
 from bookstore.bookstore_config import BookstoreSettings, validate_bookstore
 from bookstore.clone import (
     BookstoreCloneHandler,
@@ -14,7 +20,11 @@ from bookstore.clone import (
     BookstoreFSCloneHandler,
     BookstoreFSCloneAPIHandler,
 )
-from bookstore.publish import BookstorePublishAPIHandler
+from bookstore.publish import (
+    BookstoreBatchPublishAPIHandler,
+    BookstorePublishAPIHandler,
+    BookstoreStreamPublishAPIHandler,
+)
 from notebook.base.handlers import path_regex
 from tornado.testing import AsyncTestCase
 from tornado.web import Application, HTTPError
@@ -31,6 +41,7 @@ def test_collect_handlers_all():
     expected = [
         ('/api/bookstore', BookstoreVersionHandler),
         ('/api/bookstore/publish%s' % path_regex, BookstorePublishAPIHandler),
+        ('/api/bookstore/publish-batch(?:/?)*', BookstoreBatchPublishAPIHandler),
         ('/api/bookstore/clone(?:/?)*', BookstoreCloneAPIHandler),
         ('/bookstore/clone(?:/?)*', BookstoreCloneHandler),
         ('/bookstore/fs-clone(?:/?)*', BookstoreFSCloneHandler),
@@ -50,6 +61,7 @@ def test_collect_handlers_no_clone():
     expected = [
         ('/api/bookstore', BookstoreVersionHandler),
         ('/api/bookstore/publish%s' % path_regex, BookstorePublishAPIHandler),
+        ('/api/bookstore/publish-batch(?:/?)*', BookstoreBatchPublishAPIHandler),
     ]
     web_app = Application()
     mock_settings = {"BookstoreSettings": {"s3_bucket": "mock_bucket", "enable_s3_cloning": False}}
@@ -111,6 +123,38 @@ def test_collect_handlers_only_version():
     assert expected == handlers
 
 
+def test_collect_handlers_metrics():
+    expected = [
+        ('/api/bookstore', BookstoreVersionHandler),
+        ('/api/bookstore/metrics', BookstoreMetricsHandler),
+    ]
+    mock_settings = {"BookstoreSettings": {"enable_s3_cloning": False, "enable_metrics": True}}
+    bookstore_settings = BookstoreSettings(config=Config(mock_settings))
+    validation = validate_bookstore(bookstore_settings)
+    handlers = collect_handlers(log, '/', validation)
+    assert expected == handlers
+
+
+def test_collect_handlers_stream_publish():
+    expected = [
+        ('/api/bookstore', BookstoreVersionHandler),
+        ('/api/bookstore/publish%s' % path_regex, BookstorePublishAPIHandler),
+        ('/api/bookstore/publish-batch(?:/?)*', BookstoreBatchPublishAPIHandler),
+        ('/api/bookstore/publish-stream%s' % path_regex, BookstoreStreamPublishAPIHandler),
+    ]
+    mock_settings = {
+        "BookstoreSettings": {
+            "s3_bucket": "mock_bucket",
+            "enable_s3_cloning": False,
+            "enable_stream_publish": True,
+        }
+    }
+    bookstore_settings = BookstoreSettings(config=Config(mock_settings))
+    validation = validate_bookstore(bookstore_settings)
+    handlers = collect_handlers(log, '/', validation)
+    assert expected == handlers
+
+
 @pytest.fixture(scope="class")
 def bookstore_settings(request):
     mock_settings = {
@@ -136,6 +180,8 @@ def test_build_settings_dict(bookstore_settings):
             'publish_valid': True,
             's3_clone_valid': True,
             'fs_clone_valid': True,
+            'metrics_valid': False,
+            'stream_publish_valid': False,
         },
         'release': version,
     }
@@ -199,7 +245,34 @@ class TestCloneAPIHandler(AsyncTestCase):
                 'publish_valid': True,
                 's3_clone_valid': True,
                 'fs_clone_valid': True,
+                'metrics_valid': False,
+                'stream_publish_valid': False,
             },
             'release': version,
         }
         assert empty_handler.build_response_dict() == expected
+
+
+class TestMetricsHandler(AsyncTestCase):
+    def test_get(self):
+        metrics = BookstoreMetrics()
+        metrics.inc("bookstore_requests_total", endpoint="publish")
+        app = Mock(
+            spec=Application,
+            ui_methods={},
+            ui_modules={},
+            settings={METRICS_KEY: metrics},
+            transforms=[],
+        )
+        request = HTTPRequest(
+            method='GET',
+            uri='/api/bookstore/metrics',
+            headers={"Host": "localhost:8888"},
+            connection=Mock(context=Mock(protocol="https")),
+        )
+        handler = BookstoreMetricsHandler(app, request)
+        handler.finish = Mock()
+        handler.get()
+        body = handler.finish.call_args[0][0]
+        assert 'bookstore_requests_total{endpoint="publish"} 1' in body
+        assert handler._headers["Content-Type"].startswith("text/plain; version=0.0.4")
@@ -0,0 +1,78 @@
+"""Tests for parsing publish request bodies"""
+import json
+
+import pytest
+
+from bookstore import json_body
+from bookstore.json_body import decode_object, parse_model
+from nbformat.v4 import new_code_cell, new_notebook
+
+
+@pytest.fixture(params=["orjson", "json"])
+def parser(request, monkeypatch):
+    if request.param == "orjson" and not json_body.orjson_available():
+        pytest.skip("orjson is not installed")
+    if request.param == "json":
+        monkeypatch.setattr(json_body, "orjson", None)
+    return parse_model
+
+
+def test_decode_object_spans():
+    text = ' { "type" : "notebook", "content":{"cells": [1, 2]} , "x": null } '
+    members, spans = decode_object(text)
+    assert members == {"type": "notebook", "content": {"cells": [1, 2]}, "x": None}
+    start, end = spans["content"]
+    assert text[start:end] == '{"cells": [1, 2]}'
+
+
+@pytest.mark.parametrize("text", ['[]', '{"a" 1}', '{"a": 1,}', '{"a": 1} {}', '{a: 1}', '{'])
+def test_decode_object_invalid(text):
+    with pytest.raises(json.JSONDecodeError):
+        decode_object(text)
+
+
+def test_decode_object_empty():
+    assert decode_object('{}') == ({}, {})
+
+
+def test_parse_model_content_json(parser):
+    notebook = new_notebook(cells=[new_code_cell("print('héllo')")])
+    body = json.dumps({"type": "notebook", "content": notebook}, indent=1).encode('utf-8')
+
+    model, content_json = parser(body)
+    assert model == {"type": "notebook", "content": notebook}
+    assert json.loads(content_json) == notebook
+
+
+def test_parse_model_without_content(parser):
+    assert parser(b'{"type": "notebook"}') == ({"type": "notebook"}, None)
+    assert parser(b'  ') == (None, None)
+
+
+def test_parse_model_keeps_raw_json(monkeypatch):
+    monkeypatch.setattr(json_body, "orjson", None)
+    body = b'{"content": {"b": 1,\n "a": [1.50]}, "type": "notebook"}'
+    assert parse_model(body)[1] == b'{"b": 1,\n "a": [1.50]}'
+
+
+@pytest.mark.parametrize("body", [b'[1]', b'{"content": }', b'\xff'])
+def test_parse_model_invalid(parser, body):
+    with pytest.raises(ValueError):
+        parser(body)
+
+
+@pytest.mark.parametrize("value", [new_notebook(cells=[new_code_cell("x = 1")]), [2 ** 70]])
+def test_encode(parser, value):
+    assert json.loads(json_body.encode(value)) == value
+
+
+def test_content_digest(parser):
+    notebook = new_notebook(cells=[new_code_cell("x = 'é'")])
+    _, compact = parse_model(json.dumps({"content": notebook}).encode('utf-8'))
+    _, indented = parse_model(json.dumps({"content": notebook}, indent=2).encode('utf-8'))
+
+    digests = {
+        json_body.content_digest(json.loads(body))
+        for body in [compact, indented, json_body.encode(notebook)]
+    }
+    assert digests == {json_body.content_digest(notebook)}
@@ -0,0 +1,83 @@
+"""Tests for the adaptive concurrency limiter"""
+import asyncio
+
+import pytest
+
+from botocore.exceptions import ClientError
+from bookstore.bookstore_config import BookstoreSettings
+from bookstore.limiter import AdaptiveLimiter, is_throttling
+from bookstore.metrics import BookstoreMetrics
+
+
+def slow_down():
+    return ClientError(
+        {"Error": {"Code": "SlowDown"}, "ResponseMetadata": {"HTTPStatusCode": 503}}, "PutObject"
+    )
+
+
+def test_is_throttling():
+    assert is_throttling(slow_down())
+    assert is_throttling(asyncio.TimeoutError())
+    assert not is_throttling(
+        ClientError({"Error": {"Code": "NoSuchKey"}, "ResponseMetadata": {}}, "GetObject")
+    )
+
+
+async def succeed():
+    return "done"
+
+
+async def throttled():
+    raise slow_down()
+
+
+@pytest.mark.asyncio
+async def test_limit_increases_while_healthy():
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=3)
+    assert await limiter.run(succeed) == "done"
+    assert limiter.limit == 2.5
+    await limiter.run(succeed)
+    await limiter.run(succeed)
+    assert limiter.current_limit == 3
+    for _ in range(10):
+        await limiter.run(succeed)
+    assert limiter.limit == 3
+
+
+@pytest.mark.asyncio
+async def test_limit_halves_on_throttling_once_per_cooldown():
+    limiter = AdaptiveLimiter(initial_limit=8, min_limit=1, max_limit=8, cooldown=60)
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            await limiter.run(throttled)
+    assert limiter.current_limit == 4
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_limit_caps_in_flight_operations():
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=2)
+    release = asyncio.Event()
+    running = []
+
+    async def operation():
+        running.append(limiter.in_flight)
+        await release.wait()
+
+    tasks = [asyncio.ensure_future(limiter.run(operation)) for _ in range(4)]
+    await asyncio.sleep(0.01)
+    assert limiter.in_flight == 2
+    assert len(running) == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert max(running) == 2
+    assert limiter.in_flight == 0
+
+
+def test_from_settings_reports_limit():
+    metrics = BookstoreMetrics()
+    settings = BookstoreSettings(max_threads=8, s3_concurrency_initial=20)
+    limiter = AdaptiveLimiter.from_settings(settings, metrics=metrics)
+    assert limiter.current_limit == 8
+    assert metrics.snapshot()["gauges"]["bookstore_s3_concurrency_limit"] == {(): 8}
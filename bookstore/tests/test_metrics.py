@@ -0,0 +1,125 @@
+"""Tests for metrics"""
+from unittest.mock import Mock
+
+from botocore.hooks import HierarchicalEmitter
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler
+
+from bookstore.metrics import (
+    METRICS_KEY,
+    BookstoreMetrics,
+    Histogram,
+    RequestMetricsMixin,
+    format_prometheus,
+    instrument_s3_client,
+)
+
+
+def test_counters_by_label():
+    metrics = BookstoreMetrics()
+    metrics.inc("writes_total")
+    metrics.inc("writes_total", 2)
+    metrics.inc("skipped_total", reason="unchanged")
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["writes_total"] == {(): 3}
+    assert snapshot["counters"]["skipped_total"] == {(("reason", "unchanged"),): 1}
+
+
+def test_gauge_set():
+    metrics = BookstoreMetrics()
+    metrics.set("in_flight", 3)
+    metrics.set("in_flight", 1)
+    assert metrics.snapshot()["gauges"]["in_flight"] == {(): 1}
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = BookstoreMetrics()
+    for value in (1, 5, 50):
+        metrics.observe("size", value, buckets=(1, 10, 100))
+    assert metrics.snapshot()["histograms"]["size"] == {(): Histogram((1, 10, 100), [1, 2, 3], 56, 3)}
+
+
+def test_timer_observes_duration():
+    metrics = BookstoreMetrics()
+    with metrics.timer("latency", route="publish"):
+        pass
+    histogram = metrics.snapshot()["histograms"]["latency"][(("route", "publish"),)]
+    assert histogram.count == 1
+
+
+def test_format_prometheus():
+    metrics = BookstoreMetrics()
+    metrics.inc("requests_total", endpoint="pub\"lish")
+    metrics.set("in_flight", 2)
+    metrics.observe("latency", 0.5, buckets=(1.0,))
+    assert format_prometheus(metrics.snapshot()) == (
+        '# TYPE requests_total counter\n'
+        'requests_total{endpoint="pub\\"lish"} 1\n'
+        '# TYPE in_flight gauge\n'
+        'in_flight 2\n'
+        '# TYPE latency histogram\n'
+        'latency_bucket{le="1.0"} 1\n'
+        'latency_bucket{le="+Inf"} 1\n'
+        'latency_sum 0.5\n'
+        'latency_count 1\n'
+    )
+
+
+def test_instrument_s3_client():
+    metrics = BookstoreMetrics()
+    client = Mock()
+    client.meta.events = HierarchicalEmitter()
+    instrument_s3_client(client, metrics)
+
+    model = Mock()
+    model.name = "PutObject"
+    context = {}
+    client.meta.events.emit(
+        "before-call.s3.PutObject", model=model, params={"body": b"data"}, context=context
+    )
+    client.meta.events.emit(
+        "after-call.s3.PutObject",
+        http_response=Mock(status_code=200),
+        parsed={},
+        model=model,
+        context=context,
+    )
+    client.meta.events.emit(
+        "after-call-error.s3.PutObject", exception=OSError(), context={}
+    )
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["bookstore_s3_request_bytes_total"] == {
+        (("operation", "PutObject"),): 4
+    }
+    assert snapshot["counters"]["bookstore_s3_operations_total"] == {
+        (("operation", "PutObject"), ("status", "200")): 1,
+        (("operation", "PutObject"), ("status", "error")): 1,
+    }
+    assert snapshot["histograms"]["bookstore_s3_operation_seconds"][
+        (("operation", "PutObject"),)
+    ].count == 1
+
+
+class EchoHandler(RequestMetricsMixin, RequestHandler):
+    metrics_endpoint = "echo"
+
+    def post(self):
+        self.finish(self.request.body + b"!")
+
+
+class TestRequestMetricsMixin(AsyncHTTPTestCase):
+    def get_app(self):
+        self.metrics = BookstoreMetrics()
+        return Application([("/echo", EchoHandler)], **{METRICS_KEY: self.metrics})
+
+    def test_request_recorded(self):
+        response = self.fetch("/echo", method="POST", body=b"hello")
+        assert response.body == b"hello!"
+
+        labels = (("endpoint", "echo"), ("method", "POST"))
+        snapshot = self.metrics.snapshot()
+        assert snapshot["counters"]["bookstore_requests_total"] == {labels + (("status", "200"),): 1}
+        assert snapshot["counters"]["bookstore_request_bytes_total"] == {labels: 5}
+        assert snapshot["counters"]["bookstore_response_bytes_total"] == {labels: 6}
+        assert snapshot["histograms"]["bookstore_request_seconds"][labels].count == 1
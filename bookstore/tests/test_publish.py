@@ -1,17 +1,28 @@
 import asyncio
+import gzip
 import json
+import tempfile
+import threading
 
 from unittest.mock import Mock
 
 import pytest
 
-from bookstore.publish import BookstorePublishAPIHandler
-from nbformat.v4 import new_notebook
+from bookstore.json_body import content_digest
+from bookstore.publish import (
+    BookstoreBatchPublishAPIHandler,
+    BookstorePublishAPIHandler,
+    BookstoreStreamPublishAPIHandler,
+)
+from nbformat.v4 import new_code_cell, new_notebook
+from notebook.services.contents.filemanager import FileContentsManager
 from tornado.testing import AsyncTestCase, gen_test
 from tornado.web import Application, HTTPError
 from tornado.httpserver import HTTPRequest
 from traitlets.config import Config
 
+from .conftest import MockClientManager, MockS3Client
+
 
 def test_create_publish_handler_no_params():
     with pytest.raises(TypeError):
@@ -109,3 +120,425 @@ class TestPublishAPIHandler(AsyncTestCase):
         body_dict = {'content': new_notebook(), 'type': "notebook"}
         empty_handler = self.put_handler('/bookstore/publish/hi')
         empty_handler.validate_model(body_dict)
+
+    @gen_test
+    async def test_put_bad_notebook_validated_on_worker(self):
+        config = Config({"BookstoreSettings": {"validation_offload_bytes": 0}})
+        app = Mock(spec=Application, ui_methods={}, ui_modules={}, settings={"config": config})
+        bad_notebook = new_notebook()
+        bad_notebook['other_field'] = "hello"
+        body_dict = {'content': bad_notebook, 'type': "notebook"}
+        handler = self.put_handler('/bookstore/publish/hi', body_dict=body_dict, app=app)
+        assert handler.validator.offloaded(len(handler.request.body))
+        with pytest.raises(HTTPError) as e:
+            await handler.put('hi')
+        assert e.value.status_code == 422
+
+
+class TestStreamPublishAPIHandler(AsyncTestCase):
+    async def stream_handler(self, chunks, **settings):
+        mock_settings = {
+            "BookstoreSettings": {
+                "s3_bucket": "my_bucket",
+                "published_prefix": "custom_prefix",
+                **settings,
+            }
+        }
+        app = Mock(
+            spec=Application,
+            ui_methods={},
+            ui_modules={},
+            settings={"config": Config(mock_settings)},
+            transforms=[],
+        )
+        request = HTTPRequest(
+            method='PUT',
+            uri='/api/bookstore/publish-stream/hi',
+            headers={"Host": "localhost:8888"},
+            connection=Mock(context=Mock(protocol="https")),
+        )
+        handler = BookstoreStreamPublishAPIHandler(app, request)
+        handler._transforms = []
+        handler.client_manager = MockClientManager()
+        handler.spool_file = tempfile.TemporaryFile()
+        for chunk in chunks:
+            await handler.data_received(chunk)
+        return handler
+
+    def chunks(self, body, size=7):
+        return [body[i : i + size] for i in range(0, len(body), size)]
+
+    @gen_test
+    async def test_put_uploads_streamed_bytes(self):
+        body = json.dumps(new_notebook(), indent=2).encode('utf-8')
+        handler = await self.stream_handler(self.chunks(body))
+        await handler.put('hi')
+
+        stored, kwargs = handler.client_manager.client.stored('custom_prefix/hi')
+        assert stored == body
+        assert "ContentEncoding" not in kwargs
+        assert handler.get_status() == 200
+        assert handler.spool_file is None
+
+    @gen_test
+    async def test_put_compressed(self):
+        body = json.dumps(new_notebook()).encode('utf-8')
+        handler = await self.stream_handler(self.chunks(body), compression="gzip")
+        await handler.put('hi')
+
+        stored, kwargs = handler.client_manager.client.stored('custom_prefix/hi')
+        assert gzip.decompress(stored) == body
+        assert kwargs["ContentEncoding"] == "gzip"
+
+    @gen_test
+    async def test_put_unchanged_skipped(self):
+        body = json.dumps(new_notebook()).encode('utf-8')
+        first = await self.stream_handler(self.chunks(body), publish_skip_unchanged=True)
+        await first.put('hi')
+        second = await self.stream_handler(self.chunks(body), publish_skip_unchanged=True)
+        second.client_manager = first.client_manager
+        await second.put('hi')
+
+        assert second.client_manager.client.puts == 1
+        assert second._headers["ETag"] == f'"{content_digest(json.loads(body))}"'
+
+    @gen_test
+    async def test_put_publishes_repaired_notebook(self):
+        notebook = new_notebook(cells=[new_code_cell("x = 1"), new_code_cell("y = 2")])
+        notebook.cells[1]["id"] = notebook.cells[0]["id"]
+        handler = await self.stream_handler(self.chunks(json.dumps(notebook).encode('utf-8')))
+        await handler.put('hi')
+
+        stored, _ = handler.client_manager.client.stored('custom_prefix/hi')
+        published = json.loads(stored)
+        assert published["cells"][0]["id"] != published["cells"][1]["id"]
+        assert handler._headers["ETag"] == f'"{content_digest(published)}"'
+
+    @gen_test
+    async def test_received_chunks_written_on_executor(self):
+        body = json.dumps(new_notebook()).encode('utf-8')
+        handler = await self.stream_handler([])
+        handler.spool_write_bytes = 16
+        for chunk in self.chunks(body):
+            await handler.data_received(chunk)
+        assert handler.spool_write is not None
+        assert 0 < handler.spool_file.tell() <= len(body)
+
+        await handler.put('hi')
+        stored, _ = handler.client_manager.client.stored('custom_prefix/hi')
+        assert stored == body
+
+    @gen_test
+    async def test_connection_close_while_validating(self):
+        body = json.dumps(new_notebook()).encode('utf-8')
+        handler = await self.stream_handler(self.chunks(body))
+        validating = threading.Event()
+        release = threading.Event()
+        validate_spooled = handler.validate_spooled
+
+        def slow_validate():
+            validating.set()
+            release.wait(5)
+            validate_spooled()
+
+        handler.validate_spooled = slow_validate
+        put = asyncio.ensure_future(handler.put('hi'))
+        while not validating.is_set():
+            await asyncio.sleep(0.001)
+        spool_file = handler.spool_file
+        handler.request._body_future = asyncio.Future()
+        handler.request._body_future.set_result(None)
+        handler.on_connection_close()
+        assert not spool_file.closed
+
+        release.set()
+        await put
+        assert spool_file.closed
+        assert handler.spool_file is None
+
+    @gen_test
+    async def test_validate_spooled_empty(self):
+        handler = await self.stream_handler([])
+        with pytest.raises(HTTPError) as e:
+            await handler.put('hi')
+        assert e.value.status_code == 400
+
+    @gen_test
+    async def test_validate_spooled_not_json(self):
+        handler = await self.stream_handler([b'{"cells": ['])
+        with pytest.raises(HTTPError) as e:
+            await handler.put('hi')
+        assert e.value.status_code == 400
+
+    @gen_test
+    async def test_validate_spooled_bad_notebook(self):
+        handler = await self.stream_handler([b'{"cells": []}'])
+        with pytest.raises(HTTPError) as e:
+            await handler.put('hi')
+        assert e.value.status_code == 422
+
+
+class SlowS3Client(MockS3Client):
+    """Records the largest number of uploads in flight at once."""
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def put_object(self, Bucket, Key, Body, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return await super().put_object(Bucket, Key, Body, **kwargs)
+
+
+class TestBatchPublishAPIHandler(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root_dir.cleanup)
+
+    def batch_handler(self, body_dict, **settings):
+        mock_settings = {
+            "BookstoreSettings": {
+                "s3_bucket": "my_bucket",
+                "published_prefix": "custom_prefix",
+                **settings,
+            }
+        }
+        app = Mock(
+            spec=Application,
+            ui_methods={},
+            ui_modules={},
+            settings={
+                "config": Config(mock_settings),
+                "contents_manager": FileContentsManager(root_dir=self.root_dir.name),
+            },
+            transforms=[],
+        )
+        request = HTTPRequest(
+            method='POST',
+            uri='/api/bookstore/publish-batch',
+            headers={"Host": "localhost:8888"},
+            body=json.dumps(body_dict).encode('utf-8'),
+            connection=Mock(context=Mock(protocol="https")),
+        )
+        handler = BookstoreBatchPublishAPIHandler(app, request)
+        handler._transforms = []
+        handler.client_manager = MockClientManager()
+        handler.client_manager.client = SlowS3Client()
+        handler.finish = Mock()
+        return handler
+
+    def results(self, handler):
+        return json.loads(handler.finish.call_args[0][0])["results"]
+
+    @gen_test
+    async def test_post_publishes_items_concurrently(self):
+        items = [{"path": f"nb{i}.ipynb", "content": new_notebook()} for i in range(10)]
+        handler = self.batch_handler({"items": items}, publish_batch_concurrency=3)
+        await handler.post()
+
+        assert [result["status"] for result in self.results(handler)] == [200] * 10
+        result = self.results(handler)[0]
+        assert result["path"] == "nb0.ipynb"
+        assert result["s3_path"] == "s3://my_bucket/custom_prefix/nb0.ipynb"
+        assert result["versionID"].startswith("v")
+        stored, kwargs = handler.client_manager.client.stored("custom_prefix/nb0.ipynb")
+        assert kwargs["Metadata"] == {"bookstore-sha256": result["sha256"]}
+        assert content_digest(json.loads(stored)) == result["sha256"]
+        client = handler.client_manager.client
+        assert len(client.objects) == 10
+        assert client.max_in_flight == 3
+
+    @gen_test
+    async def test_post_reports_failed_items(self):
+        bad_notebook = new_notebook()
+        bad_notebook['other_field'] = "hello"
+        items = [
+            {"path": "good.ipynb", "content": new_notebook()},
+            {"path": "bad.ipynb", "content": bad_notebook},
+            {"path": "good.ipynb", "content": new_notebook()},
+            {"path": "", "content": new_notebook()},
+            {"content": new_notebook()},
+            {"path": "missing.ipynb", "contents_path": "missing.ipynb"},
+            {"path": "both.ipynb"},
+        ]
+        handler = self.batch_handler({"items": items})
+        await handler.post()
+
+        results = self.results(handler)
+        assert [result["status"] for result in results] == [200, 422, 400, 400, 400, 404, 400]
+        assert "error" in results[1]
+        assert results[2]["error"] == "Path appears more than once in the batch"
+        assert results[4]["error"] == "Must provide a path for publishing"
+        assert list(handler.client_manager.client.objects) == ["custom_prefix/good.ipynb"]
+
+    @gen_test
+    async def test_post_publishes_repaired_notebooks(self):
+        notebook = new_notebook(cells=[new_code_cell("x = 1"), new_code_cell("y = 2")])
+        notebook.cells[1]["id"] = notebook.cells[0]["id"]
+        handler = self.batch_handler({"items": [{"path": "nb.ipynb", "content": notebook}]})
+        await handler.post()
+
+        stored, _ = handler.client_manager.client.stored("custom_prefix/nb.ipynb")
+        published = json.loads(stored)
+        assert published["cells"][0]["id"] != published["cells"][1]["id"]
+
+    @gen_test
+    async def test_post_from_contents_manager(self):
+        notebook = new_notebook()
+        notebook.metadata["title"] = "report"
+        handler = self.batch_handler({"items": [{"path": "out.ipynb", "contents_path": "r.ipynb"}]})
+        handler.contents_manager.save({"type": "notebook", "content": notebook}, "r.ipynb")
+        await handler.post()
+
+        assert self.results(handler)[0]["status"] == 200
+        stored, _ = handler.client_manager.client.stored("custom_prefix/out.ipynb")
+        assert json.loads(stored)["metadata"]["title"] == "report"
+
+    @gen_test
+    async def test_post_rejects_bad_batches(self):
+        for body_dict, status_code in [({}, 400), ({"items": []}, 400), ({"items": [{}] * 3}, 413)]:
+            handler = self.batch_handler(body_dict, publish_batch_max_items=2)
+            with pytest.raises(HTTPError) as e:
+                await handler.post()
+            assert e.value.status_code == status_code
+
+
+class TestConditionalPublish(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_manager = MockClientManager()
+        self.app_settings = {}
+
+    def publish_handler(self, content, headers=None, **settings):
+        config = Config(
+            {
+                "BookstoreSettings": {
+                    "s3_bucket": "my_bucket",
+                    "published_prefix": "custom_prefix",
+                    **settings,
+                }
+            }
+        )
+        self.app_settings["config"] = config
+        app = Mock(spec=Application, ui_methods={}, ui_modules={}, settings=self.app_settings)
+        request = HTTPRequest(
+            method='PUT',
+            uri='/api/bookstore/publish/hi',
+            headers={"Host": "localhost:8888", **(headers or {})},
+            body=json.dumps({"type": "notebook", "content": content}).encode('utf-8'),
+            connection=Mock(context=Mock(protocol="https")),
+        )
+        handler = BookstorePublishAPIHandler(app, request)
+        handler.client_manager = self.client_manager
+        handler.finish = Mock()
+        return handler
+
+    async def publish(self, content, headers=None, **settings):
+        handler = self.publish_handler(content, headers, **settings)
+        await handler.put('hi')
+        return handler, json.loads(handler.finish.call_args[0][0])
+
+    async def publish_batch(self, content, **settings):
+        self.app_settings["config"] = Config(
+            {
+                "BookstoreSettings": {
+                    "s3_bucket": "my_bucket",
+                    "published_prefix": "custom_prefix",
+                    **settings,
+                }
+            }
+        )
+        app = Mock(spec=Application, ui_methods={}, ui_modules={}, settings=self.app_settings)
+        request = HTTPRequest(
+            method='POST',
+            uri='/api/bookstore/publish-batch',
+            headers={"Host": "localhost:8888"},
+            body=json.dumps({"items": [{"path": "hi", "content": content}]}).encode('utf-8'),
+            connection=Mock(context=Mock(protocol="https")),
+        )
+        handler = BookstoreBatchPublishAPIHandler(app, request)
+        handler.client_manager = self.client_manager
+        handler.finish = Mock()
+        await handler.post()
+        return json.loads(handler.finish.call_args[0][0])["results"][0]
+
+    @gen_test
+    async def test_put_publishes_repaired_notebook(self):
+        notebook = new_notebook(cells=[new_code_cell("x = 1"), new_code_cell("y = 2")])
+        notebook.cells[1]["id"] = notebook.cells[0]["id"]
+        _, response = await self.publish(notebook)
+
+        stored, _ = self.client_manager.client.stored('custom_prefix/hi')
+        published = json.loads(stored)
+        assert published["cells"][0]["id"] != published["cells"][1]["id"]
+        assert [cell["source"] for cell in published["cells"]] == ["x = 1", "y = 2"]
+        assert content_digest(published) == response["sha256"]
+
+    @gen_test
+    async def test_unconditional_publish_always_uploads(self):
+        notebook = new_notebook()
+        for _ in range(2):
+            handler, response = await self.publish(notebook)
+            assert "not_modified" not in response
+            assert handler._headers["ETag"] == f'"{response["sha256"]}"'
+        assert self.client_manager.client.puts == 2
+        assert self.client_manager.client.heads == 0
+
+    @gen_test
+    async def test_same_digest_across_endpoints(self):
+        notebook = new_notebook(cells=[new_code_cell("x = 1")], metadata={"title": "é"})
+        _, first = await self.publish(notebook, publish_skip_unchanged=True)
+        second = await self.publish_batch(notebook, publish_skip_unchanged=True)
+
+        assert second["sha256"] == first["sha256"] == content_digest(notebook)
+        assert second["not_modified"] is True
+        assert self.client_manager.client.puts == 1
+
+    @gen_test
+    async def test_if_none_match_skips_unchanged(self):
+        notebook = new_notebook()
+        _, first = await self.publish(notebook, {"If-None-Match": "*"})
+        _, second = await self.publish(notebook, {"If-None-Match": f'"{first["sha256"]}"'})
+
+        assert second == {**first, "not_modified": True}
+        assert self.client_manager.client.puts == 1
+
+        # a tag other than the notebook's does not skip the upload, nor read S3
+        heads = self.client_manager.client.heads
+        _, third = await self.publish(notebook, {"If-None-Match": '"other"'})
+        assert "not_modified" not in third
+        assert self.client_manager.client.heads == heads
+        assert self.client_manager.client.puts == 2
+
+    @gen_test
+    async def test_skip_unchanged_setting(self):
+        notebook = new_notebook()
+        await self.publish(notebook, publish_skip_unchanged=True)
+        _, response = await self.publish(notebook, publish_skip_unchanged=True)
+        assert response["not_modified"]
+
+        # a known different digest is uploaded without reading S3
+        heads = self.client_manager.client.heads
+        notebook.metadata["title"] = "changed"
+        _, response = await self.publish(notebook, publish_skip_unchanged=True)
+        assert "not_modified" not in response
+        assert self.client_manager.client.heads == heads
+        assert self.client_manager.client.puts == 2
+
+    @gen_test
+    async def test_skip_unchanged_checks_published_object(self):
+        notebook = new_notebook()
+        await self.publish(notebook)
+        # another writer replaces the published notebook
+        body, kwargs = self.client_manager.client.stored('custom_prefix/hi')
+        self.client_manager.client.objects['custom_prefix/hi'] = b"{}"
+        self.client_manager.client.params['custom_prefix/hi'] = {}
+
+        _, response = await self.publish(notebook, {"If-None-Match": "*"})
+        assert "not_modified" not in response
+        assert self.client_manager.client.stored('custom_prefix/hi') == (body, kwargs)
@@ -0,0 +1,116 @@
+"""Tests for retries and the circuit breaker"""
+import pytest
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from bookstore.bookstore_config import BookstoreSettings
+from bookstore.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, is_retryable
+
+
+def client_error(code, status):
+    return ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "PutObject"
+    )
+
+
+def test_is_retryable():
+    assert is_retryable(client_error("SlowDown", 503))
+    assert is_retryable(client_error("InternalError", 500))
+    assert is_retryable(client_error("Unknown", 502))
+    assert is_retryable(EndpointConnectionError(endpoint_url="https://s3.amazonaws.com"))
+    assert not is_retryable(client_error("NoSuchKey", 404))
+    assert not is_retryable(client_error("AccessDenied", 403))
+    assert not is_retryable(ValueError())
+
+
+class FlakyOperation:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+
+@pytest.mark.asyncio
+async def test_retry_transient_errors():
+    operation = FlakyOperation([client_error("SlowDown", 503), client_error("SlowDown", 503)])
+    assert await RetryPolicy(base_delay=0).call(operation) == "done"
+    assert operation.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_gives_up_after_max_attempts():
+    operation = FlakyOperation([client_error("SlowDown", 503)] * 3)
+    with pytest.raises(ClientError):
+        await RetryPolicy(max_attempts=2, base_delay=0).call(operation)
+    assert operation.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_no_retry_of_permanent_errors():
+    operation = FlakyOperation([client_error("AccessDenied", 403)])
+    with pytest.raises(ClientError):
+        await RetryPolicy(base_delay=0).call(operation)
+    assert operation.calls == 1
+
+
+def test_backoff_bounded():
+    policy = RetryPolicy(base_delay=1.0, max_delay=3.0)
+    for attempt in range(1, 10):
+        assert 0 <= policy.backoff(attempt) <= min(3.0, 2 ** (attempt - 1))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=4, reset_timeout=10, clock=clock)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    # only a single trial call goes through
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_retry_fails_fast_when_circuit_open():
+    breaker = CircuitBreaker(min_calls=1, window=1)
+    breaker.record_failure()
+    operation = FlakyOperation([])
+    with pytest.raises(CircuitOpenError):
+        await RetryPolicy(breaker=breaker).call(operation)
+    assert operation.calls == 0
+
+
+def test_from_settings():
+    settings = BookstoreSettings(s3_retry_max_attempts=7, s3_breaker_min_calls=3)
+    policy = RetryPolicy.from_settings(settings)
+    assert policy.max_attempts == 7
+    assert policy.breaker.min_calls == 3
+    # S3 operations are only limited once adaptive concurrency is opted into
+    assert policy.limiter is None
+    assert RetryPolicy.from_settings(BookstoreSettings(s3_adaptive_concurrency=True)).limiter
@@ -0,0 +1,44 @@
+"""Tests for the shared S3 client"""
+import pytest
+
+from bookstore.bookstore_config import BookstoreSettings
+from bookstore.s3_client import CLIENT_MANAGER_KEY, S3ClientManager, get_client_manager
+
+
+def test_client_config_pool_size():
+    settings = BookstoreSettings(max_threads=4)
+    manager = S3ClientManager(settings)
+    assert manager.build_client_config().max_pool_connections == 4
+
+
+@pytest.mark.asyncio
+async def test_get_client_reuses_client():
+    manager = S3ClientManager(BookstoreSettings(s3_bucket="my_bucket"))
+    assert manager.closed
+
+    client = await manager.get_client()
+    assert client is await manager.get_client()
+    assert not manager.closed
+
+    await manager.close()
+    assert manager.closed
+
+
+@pytest.mark.asyncio
+async def test_close_unused_manager():
+    manager = S3ClientManager(BookstoreSettings())
+    await manager.close()
+    assert manager.closed
+
+
+def test_get_client_manager_registers_once():
+    app_settings = {}
+    settings = BookstoreSettings()
+    manager = get_client_manager(app_settings, settings)
+    assert app_settings[CLIENT_MANAGER_KEY] is manager
+    assert get_client_manager(app_settings, settings) is manager
+
+
+def test_client_config_disables_botocore_retries():
+    manager = S3ClientManager(BookstoreSettings())
+    assert manager.build_client_config().retries == {"max_attempts": 0}
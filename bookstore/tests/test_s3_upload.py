@@ -0,0 +1,137 @@
+"""Tests for S3 uploads"""
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+from bookstore.bookstore_config import BookstoreSettings
+from bookstore.limiter import AdaptiveLimiter
+from bookstore.retry import RetryPolicy
+from bookstore.s3_upload import FileBody, multipart_upload, upload_object
+
+
+class MockMultipartClient:
+    def __init__(self, fail_part=None, throttle_part=None):
+        self.fail_part = fail_part
+        self.throttle_part = throttle_part
+        self.calls = []
+        self.parts = {}
+        self.part_uploads = []
+
+    async def put_object(self, **kwargs):
+        self.calls.append('put_object')
+        return {"VersionId": "put"}
+
+    async def create_multipart_upload(self, **kwargs):
+        self.calls.append('create_multipart_upload')
+        return {"UploadId": "upload"}
+
+    async def upload_part(self, PartNumber, Body, **kwargs):
+        self.part_uploads.append(PartNumber)
+        if PartNumber == self.fail_part:
+            raise ValueError("part failed")
+        if PartNumber == self.throttle_part:
+            self.throttle_part = None
+            raise ClientError({"Error": {"Code": "SlowDown"}}, "UploadPart")
+        self.parts[PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    async def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.calls.append('complete_multipart_upload')
+        self.completed = MultipartUpload["Parts"]
+        return {"VersionId": "multipart"}
+
+    async def abort_multipart_upload(self, **kwargs):
+        self.calls.append('abort_multipart_upload')
+
+
+@pytest.mark.asyncio
+async def test_upload_object_small_body_uses_put_object():
+    client = MockMultipartClient()
+    settings = BookstoreSettings()
+    obj = await upload_object(client, settings, Bucket="bucket", Key="key", Body=b"small")
+    assert obj == {"VersionId": "put"}
+    assert client.calls == ['put_object']
+
+
+@pytest.mark.asyncio
+async def test_upload_object_large_body_uses_multipart():
+    client = MockMultipartClient()
+    settings = BookstoreSettings(multipart_threshold=4)
+    obj = await upload_object(client, settings, Bucket="bucket", Key="key", Body=b"not small")
+    assert obj == {"VersionId": "multipart"}
+    assert client.calls == ['create_multipart_upload', 'complete_multipart_upload']
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_parts():
+    client = MockMultipartClient()
+    body = b"0123456789"
+    await multipart_upload(client, "bucket", "key", body, part_size=4, concurrency=2)
+    assert b"".join(client.parts[n] for n in sorted(client.parts)) == body
+    assert client.completed == [
+        {"PartNumber": 1, "ETag": "etag-1"},
+        {"PartNumber": 2, "ETag": "etag-2"},
+        {"PartNumber": 3, "ETag": "etag-3"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_aborts_on_failure():
+    client = MockMultipartClient(fail_part=2)
+    with pytest.raises(ValueError):
+        await multipart_upload(client, "bucket", "key", b"0123456789", part_size=4, concurrency=2)
+    assert client.calls == ['create_multipart_upload', 'abort_multipart_upload']
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_retries_failed_part_alone():
+    client = MockMultipartClient(throttle_part=2)
+    retry = RetryPolicy(base_delay=0)
+    body = b"0123456789"
+
+    obj = await multipart_upload(
+        client, "bucket", "key", body, part_size=4, concurrency=2, retry=retry
+    )
+    assert obj == {"VersionId": "multipart"}
+    assert sorted(client.part_uploads) == [1, 2, 2, 3]
+    assert client.calls == ['create_multipart_upload', 'complete_multipart_upload']
+    assert b"".join(client.parts[n] for n in sorted(client.parts)) == body
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_limits_each_part():
+    running = []
+
+    class SlowPartClient(MockMultipartClient):
+        async def upload_part(self, **kwargs):
+            running.append(limiter.in_flight)
+            await asyncio.sleep(0)
+            return await super().upload_part(**kwargs)
+
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=2, max_limit=2)
+    client = SlowPartClient()
+    retry = RetryPolicy(base_delay=0, limiter=limiter)
+
+    await multipart_upload(
+        client, "bucket", "key", b"0123456789" * 2, part_size=4, concurrency=5, retry=retry
+    )
+    assert sorted(client.part_uploads) == [1, 2, 3, 4, 5]
+    assert max(running) == 2
+
+
+@pytest.mark.asyncio
+async def test_upload_file_body(tmp_path):
+    path = tmp_path / "body"
+    path.write_bytes(b"0123456789")
+    client = MockMultipartClient()
+
+    with open(path, 'rb') as f:
+        await upload_object(
+            client, BookstoreSettings(), Bucket="bucket", Key="key", Body=FileBody(f)
+        )
+    assert client.calls == ['put_object']
+
+    with open(path, 'rb') as f:
+        await multipart_upload(client, "bucket", "key", FileBody(f), part_size=4, concurrency=2)
+    assert b"".join(client.parts[n] for n in sorted(client.parts)) == b"0123456789"
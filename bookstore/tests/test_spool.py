@@ -0,0 +1,74 @@
+"""Tests for the archive spool"""
+import os
+
+from bookstore.spool import ArchiveSpool
+
+
+def spooled_size(*entries):
+    return sum(os.path.getsize(e) + os.path.getsize(ArchiveSpool.body_path(e)) for e in entries)
+
+
+def test_spool_write_read(tmp_path):
+    spool = ArchiveSpool(str(tmp_path), max_bytes=1024 * 1024)
+    entry = spool.write('nb.ipynb', 1.5, body=b'{"cells": []}')
+
+    assert spool.entries() == [entry]
+    assert spool.size == spooled_size(entry)
+    assert spool.read(entry) == {"filepath": 'nb.ipynb', "queued_time": 1.5}
+    with open(spool.body_path(entry), 'rb') as f:
+        assert f.read() == b'{"cells": []}'
+
+
+def test_spool_copies_saved_file(tmp_path):
+    saved = tmp_path / 'nb.ipynb'
+    saved.write_bytes(b'saved')
+    spool = ArchiveSpool(str(tmp_path / 'spool'), max_bytes=1024 * 1024, fsync=False)
+    entry = spool.write('nb.ipynb', 1.0, source_path=str(saved))
+
+    # the spooled copy survives the saved file changing or being deleted
+    saved.unlink()
+    with open(spool.body_path(entry), 'rb') as f:
+        assert f.read() == b'saved'
+    assert spool.size == spooled_size(entry)
+
+
+def test_spool_entries_ordered(tmp_path):
+    spool = ArchiveSpool(str(tmp_path), max_bytes=1024 * 1024, fsync=False)
+    entries = [spool.write('nb.ipynb', float(i), body=str(i).encode()) for i in range(5)]
+    assert spool.entries() == entries
+
+
+def test_spool_remove_through(tmp_path):
+    spool = ArchiveSpool(str(tmp_path), max_bytes=1024 * 1024, fsync=False)
+    first = spool.write('nb.ipynb', 1.0, body=b'first')
+    second = spool.write('nb.ipynb', 2.0, body=b'second')
+    third = spool.write('nb.ipynb', 3.0, body=b'third')
+    other = spool.write('other.ipynb', 4.0, body=b'other')
+
+    spool.remove_through('nb.ipynb', second)
+    assert not spool.contains(first)
+    assert not spool.contains(second)
+    assert not os.path.exists(spool.body_path(second))
+    assert spool.entries() == [third, other]
+    assert spool.size == spooled_size(third, other)
+
+
+def test_spool_full(tmp_path):
+    spool = ArchiveSpool(str(tmp_path), max_bytes=100, fsync=False)
+    assert spool.write('nb.ipynb', 1.0, body=b'x' * 200) is None
+    assert spool.entries() == []
+    assert os.listdir(str(tmp_path)) == []
+    assert spool.size == 0
+
+
+def test_spool_size_restored(tmp_path):
+    spool = ArchiveSpool(str(tmp_path), max_bytes=1024 * 1024, fsync=False)
+    entry = spool.write('nb.ipynb', 1.0, body=b'content')
+    # a body whose entry was never written, as after a crash while spooling
+    orphan = os.path.join(str(tmp_path), 'orphan.body')
+    with open(orphan, 'wb') as f:
+        f.write(b'orphan')
+
+    restored = ArchiveSpool(str(tmp_path), max_bytes=1024 * 1024)
+    assert restored.size == spool.size == spooled_size(entry)
+    assert not os.path.exists(orphan)
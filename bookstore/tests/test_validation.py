@@ -0,0 +1,80 @@
+"""Tests for the compiled notebook validator"""
+import nbformat
+import pytest
+from nbformat import ValidationError
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
+from traitlets.config import Config
+
+from bookstore import validation
+from bookstore.bookstore_config import BookstoreSettings
+from bookstore.validation import VALIDATOR_KEY, NotebookValidator, get_validator
+
+
+@pytest.fixture(params=["fastjsonschema", "jsonschema"])
+def validator(request, monkeypatch):
+    if request.param == "jsonschema":
+        monkeypatch.setattr(validation, "fastjsonschema", None)
+    elif not validation.fastjsonschema_available():
+        pytest.skip("fastjsonschema is not installed")
+    return NotebookValidator()
+
+
+def test_validate_good_notebook(validator):
+    validator.warm()
+    compiled = dict(validator._validators)
+    notebook = new_notebook(cells=[new_code_cell("x = 1"), new_markdown_cell("# x")])
+
+    assert validator.validate(notebook) is False
+    assert validator.validate(notebook) is False
+    assert validator._validators == compiled
+    assert compiled[(nbformat.current_nbformat, nbformat.current_nbformat_minor)] is not None
+
+
+def test_validate_bad_notebook_reports_nbformat_error(validator):
+    notebook = new_notebook(cells=[new_code_cell("x = 1")])
+    notebook.cells[0]["source"] = 5
+
+    with pytest.raises(ValidationError) as e:
+        validator.validate(notebook)
+    with pytest.raises(ValidationError) as expected:
+        nbformat.validate(notebook)
+    assert e.value.message == expected.value.message
+
+
+def test_validate_repairs_like_nbformat(validator):
+    notebook = new_notebook(cells=[new_code_cell("x = 1"), new_code_cell("y = 2")])
+    notebook.cells[1]["id"] = notebook.cells[0]["id"]
+
+    assert validator.validate(notebook) is True
+    assert notebook.cells[0]["id"] != notebook.cells[1]["id"]
+
+    del notebook.cells[0]["id"]
+    assert validator.validate(notebook) is True
+    assert "id" in notebook.cells[0]
+
+
+def test_validate_without_schema(validator):
+    notebook = new_notebook()
+    notebook["nbformat_minor"] = 99
+    validator.validate(notebook)
+    assert validator._validators[(4, 99)] is None
+
+    with pytest.raises(ValidationError):
+        validator.validate(["not", "a", "notebook"])
+
+
+def test_offloaded():
+    validator = NotebookValidator(offload_bytes=100)
+    assert not validator.offloaded(99)
+    assert validator.offloaded(100)
+
+
+def test_get_validator_shared():
+    settings = BookstoreSettings(
+        config=Config({"BookstoreSettings": {"validation_offload_bytes": 10}})
+    )
+    app_settings = {}
+    validator = get_validator(app_settings, settings)
+    assert app_settings[VALIDATOR_KEY] is validator
+    assert validator.offload_bytes == 10
+    assert get_validator(app_settings, BookstoreSettings()) is validator
@@ -0,0 +1,189 @@
+"""Validation of notebooks against the nbformat schema, compiling each schema once.
+
+``nbformat.validate`` normalizes the notebook and walks the schema through
+several layers on every call. :class:`NotebookValidator` compiles the schema
+of each nbformat version once, with the optional ``fastjsonschema`` package
+when it is installed or else a ``jsonschema`` validator, and reuses it for
+every notebook of that version. Notebooks of versions without a schema in
+the installed nbformat, such as newer minor versions, are validated by
+``nbformat.validate``.
+
+Notebooks that fail the compiled schema are validated again by
+``nbformat.validate``, which repairs what it can (e.g. missing or duplicate
+cell ids) and reports the remaining errors in its usual words, so that a
+notebook is accepted or rejected exactly as before. :meth:`NotebookValidator.validate`
+reports such repairs, so that callers storing the notebook's original JSON
+store the repaired notebook instead.
+"""
+import importlib
+import json
+import threading
+from pathlib import Path
+
+import nbformat
+from jsonschema import Draft4Validator
+from nbformat import ValidationError
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+# Key under which the web application's settings hold the shared validator
+VALIDATOR_KEY = "bookstore_notebook_validator"
+
+
+def fastjsonschema_available():
+    """Whether the optional ``fastjsonschema`` package is installed."""
+    return fastjsonschema is not None
+
+
+def _load_schema(major, minor):
+    """Load the schema of an nbformat version, or None if nbformat has none for it."""
+    try:
+        module = importlib.import_module(f"nbformat.v{major}")
+    except (ImportError, TypeError):
+        return None
+    schema_file = getattr(module, "nbformat_schema", {}).get((major, minor))
+    if schema_file is None:
+        return None
+    with open(Path(module.__file__).parent / schema_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _compile(schema):
+    """Compile a schema into a function raising ``nbformat.ValidationError`` on invalid data."""
+    if fastjsonschema is not None:
+        compiled = fastjsonschema.compile(schema)
+
+        def validate(data):
+            try:
+                compiled(data)
+            except fastjsonschema.JsonSchemaException as e:
+                raise ValidationError(e.message) from e
+
+        return validate
+    return Draft4Validator(schema).validate
+
+
+def _cell_ids(notebook):
+    """The ids of a notebook's cells, the only part ``nbformat.validate`` repairs."""
+    cells = notebook.get("cells")
+    if not isinstance(cells, list):
+        return None
+    return [cell.get("id") if isinstance(cell, dict) else None for cell in cells]
+
+
+def _duplicate_cell_ids(notebook):
+    """Whether cell ids are repeated, which the schema cannot express."""
+    ids = [cell.get("id") for cell in notebook.get("cells", [])]
+    return len(set(ids)) != len(ids)
+
+
+class NotebookValidator:
+    """Validates notebooks against the nbformat schema of their version.
+
+    Validators are compiled on first use of a version and kept for the
+    lifetime of the process; :meth:`warm` compiles the current version
+    ahead of the first request.
+
+    Attributes
+    ----------
+    offload_bytes : int
+        Size in bytes of a notebook's JSON from which handlers validate it
+        on a worker thread rather than the event loop, see :meth:`offloaded`.
+    """
+
+    def __init__(self, offload_bytes=1024 * 1024):
+        self.offload_bytes = offload_bytes
+        self._validators = {}
+        # validators may be compiled from worker threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Build a validator from bookstore settings."""
+        return cls(offload_bytes=settings.validation_offload_bytes)
+
+    def warm(self):
+        """Compile the validator of the current nbformat version."""
+        self._validator(nbformat.current_nbformat, nbformat.current_nbformat_minor)
+
+    def _validator(self, major, minor):
+        key = (major, minor)
+        if key not in self._validators:
+            with self._lock:
+                if key not in self._validators:
+                    schema = _load_schema(major, minor)
+                    self._validators[key] = None if schema is None else _compile(schema)
+        return self._validators[key]
+
+    def validate(self, notebook):
+        """Validate a notebook.
+
+        Parameters
+        ----------
+        notebook : dict
+            The notebook, as decoded from JSON
+
+        Returns
+        --------
+        bool
+            Whether validation repaired the notebook in place, e.g. giving
+            cells unique ids
+
+        Raises
+        ------
+        nbformat.ValidationError
+            The notebook is not valid
+        """
+        if not isinstance(notebook, dict):
+            raise ValidationError("Notebook must be a JSON object", instance=notebook)
+        major = notebook.get("nbformat", 1)
+        minor = notebook.get("nbformat_minor", 0)
+        try:
+            validator = self._validator(major, minor)
+        except TypeError:
+            # an unhashable version, which nbformat.validate reports
+            validator = None
+        if validator is not None:
+            try:
+                validator(notebook)
+            except ValidationError:
+                pass
+            else:
+                if (major, minor) < (4, 5) or not _duplicate_cell_ids(notebook):
+                    return False
+        cell_ids = _cell_ids(notebook)
+        nbformat.validate(notebook)
+        return _cell_ids(notebook) != cell_ids
+
+    def offloaded(self, size):
+        """Whether a notebook whose JSON is ``size`` bytes should be validated on a worker thread."""
+        return size >= self.offload_bytes
+
+
+def get_validator(app_settings, bookstore_settings):
+    """Retrieve the shared notebook validator from the web application's settings.
+
+    ``load_jupyter_server_extension`` registers a warmed validator for the
+    whole process. When none is registered (e.g. a handler used outside the
+    extension) one is created and stored.
+
+    Parameters
+    ----------
+    app_settings : dict
+        The tornado web application's settings.
+    bookstore_settings : bookstore.bookstore_config.BookstoreSettings
+        Settings used if a new validator must be created.
+
+    Returns
+    --------
+    NotebookValidator
+        The shared validator.
+    """
+    validator = app_settings.get(VALIDATOR_KEY)
+    if validator is None:
+        validator = NotebookValidator.from_settings(bookstore_settings)
+        app_settings[VALIDATOR_KEY] = validator
+    return validator
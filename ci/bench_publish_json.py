@@ -0,0 +1,100 @@
+""" Benchmark of the JSON work done by the publish endpoint.
+
+Compares the CPU time per MB of request body spent turning a publish request
+into the bytes uploaded to S3:
+
+- ``loads+dumps``: parsing the body with ``json.loads`` and serializing the
+  notebook again with ``json.dumps``, as publish did before
+- ``raw slice``: :func:`bookstore.json_body.parse_model` without orjson,
+  slicing the notebook's JSON out of the body
+- ``orjson``: :func:`bookstore.json_body.parse_model` with orjson, when it
+  is installed
+
+Validation is not included, it is the same in every case.
+
+Example Usage
+-------------
+
+python ci/bench_publish_json.py --size-mb 50 --repeat 5
+"""
+import argparse
+import json
+import time
+
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+
+from bookstore import json_body
+
+
+def build_body(size_mb):
+    """A publish request body of roughly ``size_mb`` MB, mostly cell sources and outputs."""
+    cells = []
+    size = 0
+    index = 0
+    while size < size_mb * 1024 * 1024:
+        source = "\n".join(f"value_{index}_{line} = {line} * 2" for line in range(20))
+        output = new_output(
+            "execute_result",
+            data={"text/plain": "x" * 2048, "application/json": {"values": list(range(100))}},
+            execution_count=index,
+        )
+        cells.append(new_code_cell(source, outputs=[output], execution_count=index))
+        size += len(source) + 2600
+        index += 1
+    model = {"type": "notebook", "content": new_notebook(cells=cells)}
+    return json.dumps(model, indent=1).encode('utf-8')
+
+
+def loads_dumps(body):
+    model = json.loads(body.strip().decode('utf-8'))
+    return json.dumps(model['content']).encode('utf-8')
+
+
+def raw_slice(body):
+    orjson = json_body.orjson
+    json_body.orjson = None
+    try:
+        return json_body.parse_model(body)[1]
+    finally:
+        json_body.orjson = orjson
+
+
+def with_orjson(body):
+    return json_body.parse_model(body)[1]
+
+
+def cpu_seconds(function, body, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        function(body)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = build_body(args.size_mb)
+    megabytes = len(body) / (1024 * 1024)
+    print(f"request body: {megabytes:.1f} MB, best of {args.repeat}")
+
+    cases = [("loads+dumps", loads_dumps), ("raw slice", raw_slice)]
+    if json_body.orjson_available():
+        cases.append(("orjson", with_orjson))
+    baseline = None
+    for name, function in cases:
+        seconds = cpu_seconds(function, body, args.repeat)
+        baseline = baseline or seconds
+        print(
+            f"{name:>12}: {1000 * seconds / megabytes:7.2f} ms CPU/MB"
+            f"  ({baseline / seconds:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
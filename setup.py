@@ -76,6 +76,9 @@ setup(
         'aioboto3',
     ],
     extras_require={
+        'zstd': ['zstandard'],
+        'orjson': ['orjson'],
+        'fastjsonschema': ['fastjsonschema'],
         'docs': ['sphinx', 'm2r', 'sphinxcontrib-napoleon', 'sphinxcontrib-openapi'],
         'test': [
             'codecov',